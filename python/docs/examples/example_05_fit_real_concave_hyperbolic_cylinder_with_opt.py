@@ -7,38 +7,20 @@ This example shows how to fit real data of a concave hyperbolic cylinder using t
 """
 
 import os
-from scipy.io import loadmat
 import xmf
 
 # Load the data
-concave_hyperbolic_cylinder_map = loadmat(os.path.join('..', '..', '..', 'real_data', 'sample_02_concave_hyperbolic_cylinder_height_map.mat'))
-
-p = concave_hyperbolic_cylinder_map['params_target'][0][0][0][0][0]
-q = concave_hyperbolic_cylinder_map['params_target'][0][0][1][0][0]
-theta = concave_hyperbolic_cylinder_map['params_target'][0][0][2][0][0]
-x_i = concave_hyperbolic_cylinder_map['params_target'][0][0][3][0][0]
-y_i = concave_hyperbolic_cylinder_map['params_target'][0][0][4][0][0]
-z_i = concave_hyperbolic_cylinder_map['params_target'][0][0][5][0][0]
-alpha = concave_hyperbolic_cylinder_map['params_target'][0][0][6][0][0]
-beta = concave_hyperbolic_cylinder_map['params_target'][0][0][7][0][0]
-gamma = concave_hyperbolic_cylinder_map['params_target'][0][0][8][0][0]
-
-x2d = concave_hyperbolic_cylinder_map['x2d']
-y2d = concave_hyperbolic_cylinder_map['y2d']
-z2d_measured = concave_hyperbolic_cylinder_map['z2d']
+measurement = xmf.load_measurement(os.path.join('..', '..', '..', 'real_data', 'sample_02_concave_hyperbolic_cylinder_height_map.mat'))
+
+x2d = measurement.x
+y2d = measurement.y
+z2d_measured = measurement.v
 
 # Target parameters as dictionary
-target_params_dict = {
-    'p': p,
-    'q': q,
-    'theta': theta,
-    'x_i': x_i,
-    'y_i': y_i,
-    'z_i': z_i,
-    'alpha': alpha,
-    'beta': beta,
-    'gamma': gamma
-}
+target_params_dict = measurement.params_target
+p = target_params_dict['p']
+q = target_params_dict['q']
+theta = target_params_dict['theta']
 
 # Set input parameters as dictionary
 input_params_dict = {
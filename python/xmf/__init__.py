@@ -1,4 +1,6 @@
 
+__version__ = '0.1.0'
+
 from .layer_01_standard import(
     standard_convex_ellipsoid_height,
     standard_concave_ellipsoid_height,
@@ -16,6 +18,8 @@ from .layer_01_standard import(
 
     standard_sag_col_diaboloid_height,
     standard_tan_col_diaboloid_height,
+
+    StandardHeightSurrogate,
 )
   
 from .layer_02_generation import(
@@ -23,6 +27,23 @@ from .layer_02_generation import(
     generate_2d_cylinder_height,
     generate_1d_height,
     generate_1d_slope,
+    RegularGrid,
+    get_generation_memo_info,
+    set_generation_memo_budget,
+    clear_generation_memo,
+    memory_budget,
+)
+
+from .layer_03_optimization import(
+    compute_sensitivity_maps,
+    save_sensitivity_maps,
+    load_sensitivity_maps,
+    optimize_parameters_linearized,
+    optimize_stacked_1d_parameters,
+    bootstrap_ci,
+    optimize_joint_parameters,
+    optimize_parameters_out_of_core,
+    OptParamsDict,
 )
 
 from .layer_04_fit import(
@@ -46,8 +67,62 @@ from .layer_04_fit import(
     
     fit_sag_col_diaboloid_height,
     fit_tan_col_diaboloid_height,
+
+    get_fit_model,
+    fit_stacked_profiles,
+    fit_joint_subapertures,
+    fit_out_of_core,
+    get_fit_function,
+    FitSession,
+)
+
+from .analysis import(
+    tolerance_analysis,
+)
+
+from .batch import(
+    load_fit_config,
+    find_measurement_files,
+    fit_measurement_file,
+    run_batch,
+    create_batch_queue,
+    run_batch_queue,
+    queue_worker,
+    get_queue_records,
+)
+
+from .io import(
+    Measurement,
+    load_measurement,
+    save_measurement,
+)
+
+from .cache import(
+    FitCache,
+)
+
+from .history import(
+    fit_with_history,
+    record_fit_params,
+    get_parameter_history,
+    get_last_fit_params,
+)
+
+from .parallel import(
+    SharedMemoryFitPool,
 )
 
+from .serve import(
+    create_fit_server,
+)
+
+from .profiling import(
+    profile,
+    Profiler,
+)
+
+from . import aio
+
 from .fig_show import (
     fig_show_2d_map,
     fig_show_1d_height,
@@ -58,6 +133,8 @@ from .fig_show import (
     fig_show_1d_fitting_height,
     fig_show_1d_fitting_slope,
     fig_show_2d_different_fitting_maps,
+    FittingMapViewer,
+    FittingHeightViewer,
 )
 
 
@@ -80,13 +157,30 @@ __all__ = [
     
     'standard_sag_col_diaboloid_height',
     'standard_tan_col_diaboloid_height',
+
+    'StandardHeightSurrogate',
     
     # layer_02_generation.py
     'generate_2d_curved_surface_height',
     'generate_2d_cylinder_height',
     'generate_1d_height',
     'generate_1d_slope',
+    'RegularGrid',
+    'get_generation_memo_info',
+    'set_generation_memo_budget',
+    'clear_generation_memo',
+    'memory_budget',
 
+    # layer_03_optimization.py
+    'compute_sensitivity_maps',
+    'save_sensitivity_maps',
+    'load_sensitivity_maps',
+    'optimize_parameters_linearized',
+    'optimize_stacked_1d_parameters',
+    'bootstrap_ci',
+    'optimize_joint_parameters',
+    'optimize_parameters_out_of_core',
+    'OptParamsDict',
 
     # layer_04_fit.py
     'fit_convex_ellipsoid_height',
@@ -110,6 +204,53 @@ __all__ = [
     'fit_sag_col_diaboloid_height',
     'fit_tan_col_diaboloid_height',
 
+    'get_fit_model',
+    'fit_stacked_profiles',
+    'fit_joint_subapertures',
+    'fit_out_of_core',
+    'get_fit_function',
+    'FitSession',
+
+    # analysis.py
+    'tolerance_analysis',
+
+    # batch.py
+    'load_fit_config',
+    'find_measurement_files',
+    'fit_measurement_file',
+    'run_batch',
+    'create_batch_queue',
+    'run_batch_queue',
+    'queue_worker',
+    'get_queue_records',
+
+    # io.py
+    'Measurement',
+    'load_measurement',
+    'save_measurement',
+
+    # history.py
+    'fit_with_history',
+    'record_fit_params',
+    'get_parameter_history',
+    'get_last_fit_params',
+
+    # parallel.py
+    'SharedMemoryFitPool',
+
+    # cache.py
+    'FitCache',
+
+    # serve.py
+    'create_fit_server',
+
+    # profiling.py
+    'profile',
+    'Profiler',
+
+    # aio.py
+    'aio',
+
     # fig_show.py
     'fig_show_2d_map',
     'fig_show_1d_height',
@@ -120,4 +261,6 @@ __all__ = [
     'fig_show_1d_fitting_height',
     'fig_show_1d_fitting_slope',
     'fig_show_2d_different_fitting_maps',
+    'FittingMapViewer',
+    'FittingHeightViewer',
 ]
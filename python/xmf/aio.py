@@ -0,0 +1,127 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import functools
+import threading
+import types
+from concurrent.futures import CancelledError, Executor, ProcessPoolExecutor
+
+from xmf.layer_04_fit import get_fit_function
+
+# The executor used when none is given, None for the default executor of the event loop
+default_executor = None
+
+
+def set_default_executor(executor: Executor):
+    """
+    Set the executor running the asynchronous fits when none is given
+
+    Parameters
+    ----------
+        executor: `concurrent.futures.Executor`
+            The thread or process pool, None for the default executor of the event loop
+    """
+
+    global default_executor
+    default_executor = executor
+
+
+def run_cancellable_fit(fit_function: types.FunctionType, cancel_event: threading.Event, args: tuple, kwargs: dict):
+    """
+    Run a fitting function which stops at the next ``least_squares`` iteration once the event is set
+
+    Parameters
+    ----------
+        fit_function: `function`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``
+        cancel_event: `threading.Event`
+            The event set to cancel the fit
+        args: `tuple`
+            The positional arguments of the fitting function
+        kwargs: `dict`
+            The keyword arguments of the fitting function, including an optional ``callback``
+    Returns
+    -------
+        result: `tuple`
+            The result of the fitting function
+    """
+
+    user_callback = kwargs.pop('callback', None)
+
+    def callback(intermediate_result):
+        if cancel_event.is_set():
+            raise CancelledError("The fit is cancelled.")
+        if user_callback is not None:
+            return user_callback(intermediate_result)
+
+    if cancel_event.is_set():
+        raise CancelledError("The fit is cancelled.")
+    return fit_function(*args, callback=callback, **kwargs)
+
+
+async def fit(model, *args, executor: Executor = None, **kwargs):
+    """
+    Run a fitting function in an executor without blocking the event loop
+
+    With a thread pool (the default), cancelling the awaiting task stops the fit at the 
+    next ``least_squares`` iteration and frees the worker thread before ``CancelledError`` 
+    is raised. With a process pool, only the fits which have not started can be cancelled.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``, or its name
+        args:
+            The positional arguments of the fitting function
+        executor: `concurrent.futures.Executor`
+            The executor running the fit, ``default_executor`` if None
+        kwargs:
+            The keyword arguments of the fitting function, e.g. ``use_surrogate``
+    Returns
+    -------
+        result: `tuple`
+            The result of the fitting function
+    """
+
+    loop = asyncio.get_running_loop()
+    fit_function = get_fit_function(model)
+    executor = executor or default_executor
+
+    if isinstance(executor, ProcessPoolExecutor):
+        return await loop.run_in_executor(executor, functools.partial(fit_function, *args, **kwargs))
+
+    cancel_event = threading.Event()
+    future = loop.run_in_executor(executor, run_cancellable_fit, fit_function, cancel_event, args, kwargs)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        try:
+            await future
+        except (CancelledError, Exception):
+            pass
+        raise
+
@@ -0,0 +1,249 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import types
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from xmf.layer_02_generation import (
+    generate_1d_height,
+    generate_1d_slope,
+    RegularGrid,
+)
+
+from xmf.layer_03_optimization import (
+    check_input_params,
+    check_tol_dict,
+    generate_surface_with_params,
+    optimize_parameters,
+    optimize_stacked_1d_parameters,
+)
+
+from xmf.layer_04_fit import get_fit_model
+
+def summarize_distribution(values: np.ndarray):
+    """
+    Summarize the distribution of a sampled quantity.
+
+    Parameters
+    ----------
+        values: `numpy.ndarray`
+            The sampled values
+
+    Returns
+    -------
+        stats_dict: `dict`
+            The ``mean``, ``std``, ``min``, ``median``, ``p95``, ``p99`` and ``max`` of the values
+    """
+
+    return {'mean': np.nanmean(values),
+            'std': np.nanstd(values),
+            'min': np.nanmin(values),
+            'median': np.nanmedian(values),
+            'p95': np.nanpercentile(values, 95),
+            'p99': np.nanpercentile(values, 99),
+            'max': np.nanmax(values),
+            }
+
+def evaluate_tolerance_chunk(surface_generation_function: types.FunctionType,
+                             standard_surface_shape_function: types.FunctionType,
+                             x: np.ndarray,
+                             y: np.ndarray,
+                             v_nominal: np.ndarray,
+                             nominal_params: np.ndarray,
+                             sampled_params: np.ndarray,
+                             refit_opt_or_tol_dict: dict = None,
+                             ):
+    """
+    Evaluate the surface errors of a chunk of sampled parameter sets.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x: `numpy.ndarray`
+            The x-coordinate in unit of [m] as a suggestion
+        y: `numpy.ndarray`
+            The y-coordinate in unit of [m] as a suggestion
+        v_nominal: `numpy.ndarray`
+            The nominal slope or height
+        nominal_params: `numpy.ndarray`
+            The nominal ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma`` parameters
+        sampled_params: `numpy.ndarray`
+            The sampled parameters in shape of (9, N)
+        refit_opt_or_tol_dict: `dict`
+            If given, each sampled surface is refitted from the nominal parameters with 
+            this optimization flag or tolerance structure, and the fitting residual is evaluated
+
+    Returns
+    -------
+        rms: `numpy.ndarray`
+            The RMS (standard deviation) of the surface errors in shape of (N,)
+        pv: `numpy.ndarray`
+            The PV of the surface errors in shape of (N,)
+        refit_params: `numpy.ndarray`
+            The refitted parameters in shape of (9, N), or None without refitting
+    """
+
+    # Generate all the sampled surfaces of the chunk at once
+    v_samples = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, sampled_params, v_nominal)
+    refit_params = None
+
+    if refit_opt_or_tol_dict is None:
+        v_err = v_samples - v_nominal
+    elif surface_generation_function in (generate_1d_height, generate_1d_slope):
+        input_params_dict = dict(zip(['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma'], nominal_params))
+        v_err, _, opt_params_dict, _, _ = optimize_stacked_1d_parameters(surface_generation_function, standard_surface_shape_function, x, v_samples, input_params_dict, refit_opt_or_tol_dict)
+        refit_params = np.array(list(opt_params_dict.values()))
+    else:
+        input_params_dict = dict(zip(['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma'], nominal_params))
+        v_err = np.empty_like(v_samples)
+        refit_params = np.empty_like(sampled_params)
+        for k in range(v_samples.shape[0]):
+            v_err[k], _, opt_params_dict, _, _ = optimize_parameters(surface_generation_function, standard_surface_shape_function, x, y, v_samples[k], input_params_dict, refit_opt_or_tol_dict)
+            refit_params[:, k] = list(opt_params_dict.values())
+
+    v_err = v_err.reshape(v_err.shape[0], -1)
+    rms = np.nanstd(v_err, axis=1)
+    pv = np.nanmax(v_err, axis=1) - np.nanmin(v_err, axis=1)
+
+    return rms, pv, refit_params
+
+def tolerance_analysis(model,
+                       nominal_params: dict,
+                       tol_dict: dict,
+                       n_samples: int,
+                       grid,
+                       refit_opt_or_tol_dict: dict = None,
+                       distribution: str = 'uniform',
+                       seed: int = None,
+                       chunk_size: int = 64,
+                       max_workers: int = None,
+                       ):
+    """
+    Monte Carlo tolerance analysis of the surface errors caused by the parameter deviations.
+
+    The parameter sets are sampled within the tolerances, and the surfaces are generated 
+    in vectorized chunks which are distributed over a process pool. Optionally, each sampled 
+    surface is refitted with the production fitting settings, so that the statistics describe 
+    the residuals which cannot be compensated by the fitting (e.g. alignment).
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``, or its name
+        nominal_params: `dict`
+            The nominal ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) parameters
+        tol_dict: `dict`
+            The tolerances of the parameters, in the same format as the one for 
+            ``optimize_parameters_with_tol``. The parameters not in ``tol_dict`` are not varied.
+        n_samples: `int`
+            The number of the sampled parameter sets
+        grid: `numpy.ndarray`, `tuple` or `RegularGrid`
+            The ``x1d`` coordinates for 1D models, or ``(x2d, y2d)`` or a ``RegularGrid`` for 2D models
+        refit_opt_or_tol_dict: `dict`
+            The optimization flag or tolerance structure to refit each sampled surface. 
+            If None, the surface errors are the differences to the nominal surface.
+        distribution: `str`
+            ``'uniform'`` within the tolerances, or ``'normal'`` with the tolerances as 
+            the 3-sigma range around the center
+        seed: `int`
+            The seed of the random generator
+        chunk_size: `int`
+            The number of parameter sets generated at once in a worker
+        max_workers: `int`
+            The number of worker processes. If 1, everything runs in the current process.
+
+    Returns
+    -------
+        result_dict: `dict`
+            ``params``: the sampled parameters in dictionary of arrays in shape of (n_samples,),
+            ``refit_params``: the refitted parameters in dictionary (if refitted),
+            ``rms`` and ``pv``: the RMS and PV of the surface errors in shape of (n_samples,),
+            ``rms_stats`` and ``pv_stats``: the statistics of RMS and PV
+    """
+
+    surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+    str_param_name_list = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
+
+    if surface_generation_function in (generate_1d_height, generate_1d_slope):
+        x = np.asarray(grid, dtype=float)
+        y = np.zeros_like(x)
+    elif isinstance(grid, RegularGrid):
+        x, y = grid, None
+    else:
+        x, y = [np.asarray(val, dtype=float) for val in grid]
+
+    # Nominal parameters and surface
+    nominal = check_input_params(nominal_params, x, y, np.zeros(x.shape))
+    v_nominal = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, nominal)
+
+    # Only vary the parameters in tol_dict
+    _, tol_vector = check_tol_dict({key: tol_dict.get(key, 0) for key in str_param_name_list}, surface_generation_function)
+    if not np.all(np.isfinite(tol_vector)):
+        raise ValueError("The tolerances must be finite for the tolerance analysis.")
+
+    rng = np.random.default_rng(seed)
+    if distribution == 'uniform':
+        deviations = rng.uniform(tol_vector[:, 0:1], tol_vector[:, 1:2], (9, n_samples))
+    elif distribution == 'normal':
+        center = tol_vector.mean(axis=1, keepdims=True)
+        sigma = (tol_vector[:, 1:2] - tol_vector[:, 0:1]) / 6
+        deviations = center + sigma * rng.standard_normal((9, n_samples))
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}. Use 'uniform' or 'normal'.")
+    sampled_params = nominal[:, np.newaxis] + deviations
+
+    # Evaluate the chunks in the current process or over a process pool
+    chunks = [sampled_params[:, start:start + chunk_size] for start in range(0, n_samples, chunk_size)]
+    args = (surface_generation_function, standard_surface_shape_function, x, y, v_nominal, nominal)
+    if max_workers is None:
+        max_workers = min(len(chunks), os.cpu_count() or 1)
+
+    if max_workers <= 1 or len(chunks) <= 1:
+        chunk_results = [evaluate_tolerance_chunk(*args, chunk, refit_opt_or_tol_dict) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(evaluate_tolerance_chunk, *args, chunk, refit_opt_or_tol_dict) for chunk in chunks]
+            chunk_results = [future.result() for future in futures]
+
+    rms = np.concatenate([val[0] for val in chunk_results])
+    pv = np.concatenate([val[1] for val in chunk_results])
+
+    result_dict = {'params': dict(zip(str_param_name_list, sampled_params)),
+                   'rms': rms,
+                   'pv': pv,
+                   'rms_stats': summarize_distribution(rms),
+                   'pv_stats': summarize_distribution(pv),
+                   }
+    if refit_opt_or_tol_dict is not None:
+        result_dict['refit_params'] = dict(zip(str_param_name_list, np.concatenate([val[2] for val in chunk_results], axis=1)))
+
+    return result_dict
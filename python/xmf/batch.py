@@ -0,0 +1,609 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import csv
+import json
+import os
+import socket
+import sqlite3
+import time
+import tomllib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from xmf.layer_02_generation import (
+    generate_1d_height,
+    generate_1d_slope,
+)
+
+from xmf.layer_04_fit import get_fit_model, get_fit_function
+from xmf.io import load_measurement, x_name_list
+
+str_param_name_list = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
+measurement_ext_list = ['.mat', '.npz', '.h5', '.hdf5']
+
+
+def load_fit_config(path: str):
+    """
+    Load the fitting configuration from a JSON or TOML file
+
+    The configuration has the ``opt_dict`` or ``tol_dict`` of the fit, and optionally 
+    the ``model`` name, the ``input_params`` overriding the target parameters of the 
+    measurements and the ``fit_options`` passed to the fitting function, e.g.
+
+    .. code-block:: json
+
+        {"model": "concave_ellipsoid_height",
+         "tol_dict": {"p": 0, "q": 0, "theta": 0, "y_i": [-0.5e-3, 0.5e-3]},
+         "fit_options": {"use_surrogate": true}}
+
+    Parameters
+    ----------
+        path: `str`
+            The ``.json`` or ``.toml`` file path
+    Returns
+    -------
+        config: `dict`
+            The configuration with ``model``, ``opt_or_tol_dict``, ``input_params`` and ``fit_options``
+    """
+
+    if os.path.splitext(path)[1].lower() == '.toml':
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        with open(path, 'r') as f:
+            config = json.load(f)
+
+    if 'opt_dict' in config:
+        opt_or_tol_dict = config['opt_dict']
+    elif 'tol_dict' in config:
+        opt_or_tol_dict = config['tol_dict']
+    else:
+        raise ValueError(f"{path} must have an opt_dict or a tol_dict.")
+
+    return {'model': config.get('model'),
+            'opt_or_tol_dict': opt_or_tol_dict,
+            'input_params': config.get('input_params', {}),
+            'fit_options': config.get('fit_options', {})}
+
+
+def find_measurement_files(source: str):
+    """
+    Find the measurement files in a directory or listed in a manifest
+
+    Parameters
+    ----------
+        source: `str`
+            A directory of ``.mat``, ``.npz``, HDF5 files and directories of ``.npy`` files, 
+            or a manifest text file with one path per line, relative to the manifest
+    Returns
+    -------
+        path_list: `list`
+            The measurement paths
+    """
+
+    if os.path.isdir(source):
+        path_list = []
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isdir(path):
+                if any(name + '.npy' in os.listdir(path) for name in x_name_list):
+                    path_list.append(path)
+            elif os.path.splitext(name)[1].lower() in measurement_ext_list:
+                path_list.append(path)
+        return path_list
+
+    with open(source, 'r') as f:
+        lines = [line.strip() for line in f]
+    base_dir = os.path.dirname(os.path.abspath(source))
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+
+
+def get_residual_name(path: str):
+    """
+    Get the file name of the residual map of a measurement, ``<name>_<extension>_residual.npy``
+
+    The extension is kept so that e.g. ``a.mat`` and ``a.npz`` in the same batch have their own residual maps.
+
+    Parameters
+    ----------
+        path: `str`
+            The measurement path
+    Returns
+    -------
+        name: `str`
+            The file name of the residual map
+    """
+
+    return os.path.basename(os.path.normpath(path)).replace('.', '_') + '_residual.npy'
+
+
+def check_residual_names(path_list: list):
+    """
+    Check that the measurements of a batch have distinct residual map names
+
+    Parameters
+    ----------
+        path_list: `list`
+            The measurement paths
+    """
+
+    path_dict = {}
+    for path in path_list:
+        path_dict.setdefault(get_residual_name(path), []).append(path)
+    duplicate_list = [path_same for path_same in path_dict.values() if len(path_same) > 1]
+    if duplicate_list:
+        raise ValueError(f"The residual maps of {', '.join(duplicate_list[0])} would overwrite each other in the output directory.")
+
+
+def fit_measurement_file(path: str,
+                         model,
+                         opt_or_tol_dict: dict,
+                         input_params_dict: dict = None,
+                         output_dir: str = None,
+                         fit_options: dict = None):
+    """
+    Load and fit one measurement file, and save its residual map
+
+    Parameters
+    ----------
+        path: `str`
+            The measurement path, see ``load_measurement``
+        model: `function` or `str`
+            The fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        input_params_dict: `dict`
+            The parameters overriding the target ``p``, ``q``, ``theta`` of the measurement
+        output_dir: `str`
+            The directory of the residual map, see ``get_residual_name``. If None, it is not saved.
+        fit_options: `dict`
+            The additional options passed to the fitting function
+    Returns
+    -------
+        record: `dict`
+            ``file``, ``model``, ``status``, ``fit_status`` of the optimization, ``rms`` of the residual, the ``params`` and 
+            ``params_ci`` dictionaries, ``residual_path``, ``error`` and the ``time_load``, 
+            ``time_fit`` and ``time_total`` in seconds
+    """
+
+    record = {'file': path, 'model': model if isinstance(model, str) else model.__name__, 'status': 'failed',
+              'fit_status': None, 'rms': np.nan, 'params': {}, 'params_ci': {}, 'residual_path': None, 'error': None,
+              'time_load': np.nan, 'time_fit': np.nan, 'time_total': np.nan}
+    t_start = time.perf_counter()
+    try:
+        fit_function = get_fit_function(model)
+        surface_generation_function, _ = get_fit_model(model)
+        measurement = load_measurement(path)
+        t_load = time.perf_counter()
+
+        # The target p, q, theta of the measurement, unless given in input_params_dict
+        params_dict = {name: val for name, val in measurement.params_target.items() if name in ('p', 'q', 'theta')}
+        params_dict.update(input_params_dict or {})
+
+        if surface_generation_function in (generate_1d_height, generate_1d_slope):
+            v_res, _, opt_params_dict, opt_params_ci_dict, _ = fit_function(measurement.x, measurement.v, params_dict, opt_or_tol_dict, **(fit_options or {}))
+        else:
+            v_res, _, opt_params_dict, opt_params_ci_dict, _ = fit_function(measurement.x, measurement.y, measurement.v, params_dict, opt_or_tol_dict, **(fit_options or {}))
+        t_fit = time.perf_counter()
+
+        if output_dir is not None:
+            record['residual_path'] = os.path.join(output_dir, get_residual_name(path))
+            np.save(record['residual_path'], v_res)
+
+        record.update({'status': 'done',
+                       'fit_status': getattr(opt_params_dict, 'status', 'converged'),
+                       'rms': float(np.nanstd(v_res)),
+                       'params': {name: float(val) for name, val in opt_params_dict.items()},
+                       'params_ci': {name: [float(val) for val in np.ravel(ci)] for name, ci in opt_params_ci_dict.items()},
+                       'time_load': t_load - t_start,
+                       'time_fit': t_fit - t_load})
+    except Exception as err:
+        record['error'] = f"{type(err).__name__}: {err}"
+    record['time_total'] = time.perf_counter() - t_start
+
+    return record
+
+
+def write_batch_results(record_list: list, output_dir: str):
+    """
+    Write the records of a batch to ``results.csv`` and ``results.json``
+
+    Parameters
+    ----------
+        record_list: `list`
+            The records returned by ``fit_measurement_file``
+        output_dir: `str`
+            The output directory
+    Returns
+    -------
+        csv_path: `str`
+            The CSV file path
+        json_path: `str`
+            The JSON file path
+    """
+
+    csv_path = os.path.join(output_dir, 'results.csv')
+    json_path = os.path.join(output_dir, 'results.json')
+
+    fieldnames = ['file', 'model', 'status', 'fit_status', 'rms']
+    for name in str_param_name_list:
+        fieldnames += [name, name + '_ci_lower', name + '_ci_upper']
+    fieldnames += ['time_load', 'time_fit', 'time_total', 'residual_path', 'error']
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for record in record_list:
+            row = {key: record[key] for key in fieldnames if key in record}
+            for name in str_param_name_list:
+                row[name] = record['params'].get(name)
+                row[name + '_ci_lower'], row[name + '_ci_upper'] = record['params_ci'].get(name, [None, None])
+            writer.writerow(row)
+
+    def to_json(val):
+        # NaN is not valid JSON
+        if isinstance(val, dict):
+            return {key: to_json(item) for key, item in val.items()}
+        if isinstance(val, list):
+            return [to_json(item) for item in val]
+        if isinstance(val, float) and not np.isfinite(val):
+            return None
+        return val
+
+    with open(json_path, 'w') as f:
+        json.dump([to_json(record) for record in record_list], f, indent=2)
+
+    return csv_path, json_path
+
+
+def run_batch(path_list: list,
+              model,
+              opt_or_tol_dict: dict,
+              output_dir: str,
+              input_params_dict: dict = None,
+              fit_options: dict = None,
+              max_workers: int = None):
+    """
+    Fit a batch of measurement files in worker processes and write the results
+
+    Parameters
+    ----------
+        path_list: `list`
+            The measurement paths
+        model: `function` or `str`
+            The fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        output_dir: `str`
+            The directory of the results and the residual maps
+        input_params_dict: `dict`
+            The parameters overriding the target ``p``, ``q``, ``theta`` of the measurements
+        fit_options: `dict`
+            The additional options passed to the fitting function
+        max_workers: `int`
+            The number of worker processes. If 1, the files are fitted in the current process.
+    Returns
+    -------
+        record_list: `list`
+            The records of the files in the order of ``path_list``
+    """
+
+    get_fit_model(model) # Fail early for an unknown model
+    check_residual_names(path_list)
+    os.makedirs(output_dir, exist_ok=True)
+    args = (model, opt_or_tol_dict, input_params_dict, output_dir, fit_options)
+
+    if max_workers == 1:
+        record_list = [fit_measurement_file(path, *args) for path in path_list]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fit_measurement_file, path, *args) for path in path_list]
+            record_list = [future.result() for future in futures]
+
+    write_batch_results(record_list, output_dir)
+
+    return record_list
+
+
+def connect_batch_queue(db_path: str):
+    """
+    Connect to the SQLite queue of a batch, creating the tables if needed
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+    Returns
+    -------
+        connection: `sqlite3.Connection`
+            The connection in autocommit mode
+    """
+
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        file TEXT UNIQUE,
+        state TEXT DEFAULT 'pending',
+        result_path TEXT,
+        elapsed REAL,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        worker TEXT,
+        pid INTEGER,
+        record TEXT)""")
+    return connection
+
+
+def create_batch_queue(db_path: str,
+                       path_list: list,
+                       model,
+                       opt_or_tol_dict: dict,
+                       output_dir: str,
+                       input_params_dict: dict = None,
+                       fit_options: dict = None):
+    """
+    Create the SQLite queue of a batch, or add the new files to an existing one
+
+    Every file is a job in the ``pending``, ``running``, ``done`` or ``failed`` state. 
+    The files already in the queue keep their states, so the same batch can be 
+    created again to resume it.
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+        path_list: `list`
+            The measurement paths
+        model: `str`
+            The fitting model name, e.g. ``'concave_ellipsoid_height'``
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        output_dir: `str`
+            The directory of the results and the residual maps
+        input_params_dict: `dict`
+            The parameters overriding the target ``p``, ``q``, ``theta`` of the measurements
+        fit_options: `dict`
+            The additional options passed to the fitting function
+    """
+
+    get_fit_model(model) # Fail early for an unknown model
+    config = {'model': model, 'opt_or_tol_dict': opt_or_tol_dict, 'output_dir': output_dir,
+              'input_params': input_params_dict or {}, 'fit_options': fit_options or {}}
+
+    connection = connect_batch_queue(db_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        rows = dict(connection.execute("SELECT key, value FROM config").fetchall())
+        for key, val in config.items():
+            str_val = json.dumps(val, sort_keys=True)
+            if key in rows and rows[key] != str_val:
+                connection.execute("ROLLBACK")
+                raise ValueError(f"The queue {db_path} was created with a different {key}: {rows[key]}")
+            connection.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", (key, str_val))
+        file_set = {row[0] for row in connection.execute("SELECT file FROM jobs")} | {os.path.abspath(path) for path in path_list}
+        try:
+            check_residual_names(sorted(file_set))
+        except ValueError:
+            connection.execute("ROLLBACK")
+            raise
+        connection.executemany("INSERT OR IGNORE INTO jobs (file) VALUES (?)", [(os.path.abspath(path),) for path in path_list])
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+
+def is_process_alive(pid: int):
+    """
+    Check if a local process is running
+
+    Parameters
+    ----------
+        pid: `int`
+            The process ID
+    Returns
+    -------
+        is_alive: `bool`
+            True if the process exists
+    """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reset_stale_jobs(db_path: str, retry_failed: bool = False):
+    """
+    Put the jobs of dead workers, and optionally the failed jobs, back to ``pending``
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+        retry_failed: `bool`
+            If True, the failed jobs are also retried
+    Returns
+    -------
+        num_reset: `int`
+            The number of the jobs put back to ``pending``
+    """
+
+    host = socket.gethostname()
+    connection = connect_batch_queue(db_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        running = connection.execute("SELECT id, worker, pid FROM jobs WHERE state = 'running'").fetchall()
+        stale_ids = [job_id for job_id, worker, pid in running
+                     if worker is None or worker.split(':')[0] != host or pid is None or not is_process_alive(pid)]
+        if retry_failed:
+            stale_ids += [job_id for (job_id,) in connection.execute("SELECT id FROM jobs WHERE state = 'failed'")]
+        connection.executemany("UPDATE jobs SET state = 'pending', worker = NULL, pid = NULL WHERE id = ?", [(job_id,) for job_id in stale_ids])
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+    return len(stale_ids)
+
+
+def claim_next_job(connection: sqlite3.Connection, worker: str):
+    """
+    Take the next pending job of the queue and mark it as ``running``
+
+    Parameters
+    ----------
+        connection: `sqlite3.Connection`
+            The connection to the queue
+        worker: `str`
+            The worker name, ``host:pid``
+    Returns
+    -------
+        job: `tuple`
+            The job ID and the file path, or None if no job is pending
+    """
+
+    connection.execute("BEGIN IMMEDIATE")
+    job = connection.execute("SELECT id, file FROM jobs WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+    if job is not None:
+        connection.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, pid = ? WHERE id = ?",
+                           (worker, os.getpid(), job[0]))
+    connection.execute("COMMIT")
+    return job
+
+
+def queue_worker(db_path: str):
+    """
+    Fit the pending jobs of the queue one by one until none is left
+
+    Several workers, in the same or different processes, can pull from the same queue.
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+    Returns
+    -------
+        num_jobs: `int`
+            The number of the jobs done or failed by this worker
+    """
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    connection = connect_batch_queue(db_path)
+    num_jobs = 0
+    try:
+        config = {key: json.loads(val) for key, val in connection.execute("SELECT key, value FROM config")}
+        while True:
+            job = claim_next_job(connection, worker)
+            if job is None:
+                break
+            job_id, path = job
+            record = fit_measurement_file(path, config['model'], config['opt_or_tol_dict'], config['input_params'],
+                                          config['output_dir'], config['fit_options'])
+            connection.execute("UPDATE jobs SET state = ?, result_path = ?, elapsed = ?, error = ?, record = ? WHERE id = ?",
+                               (record['status'], record['residual_path'], record['time_total'], record['error'],
+                                json.dumps(record), job_id))
+            num_jobs += 1
+    finally:
+        connection.close()
+
+    return num_jobs
+
+
+def get_queue_records(db_path: str):
+    """
+    Get the states and records of the jobs in the queue
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+    Returns
+    -------
+        state_count_dict: `dict`
+            The number of the jobs in each state
+        record_list: `list`
+            The records of the done and failed jobs, see ``fit_measurement_file``
+    """
+
+    connection = connect_batch_queue(db_path)
+    try:
+        state_count_dict = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        state_count_dict.update(dict(connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()))
+        record_list = [json.loads(record) for (record,) in connection.execute("SELECT record FROM jobs WHERE record IS NOT NULL AND state IN ('done', 'failed') ORDER BY id")]
+    finally:
+        connection.close()
+
+    return state_count_dict, record_list
+
+
+def run_batch_queue(db_path: str, max_workers: int = None, retry_failed: bool = False):
+    """
+    Run or resume the batch of a queue with local worker processes and write the results
+
+    The jobs left ``running`` by dead workers are put back to ``pending`` first, so an 
+    interrupted batch continues where it stopped instead of restarting from zero.
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path created by ``create_batch_queue``
+        max_workers: `int`
+            The number of worker processes. If 1, the jobs run in the current process.
+        retry_failed: `bool`
+            If True, the failed jobs are retried
+    Returns
+    -------
+        record_list: `list`
+            The records of the done and failed jobs
+    """
+
+    reset_stale_jobs(db_path, retry_failed)
+    connection = connect_batch_queue(db_path)
+    try:
+        output_dir = json.loads(connection.execute("SELECT value FROM config WHERE key = 'output_dir'").fetchone()[0])
+    finally:
+        connection.close()
+    os.makedirs(output_dir, exist_ok=True)
+
+    if max_workers == 1:
+        queue_worker(db_path)
+    else:
+        num_workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(queue_worker, db_path) for _ in range(num_workers)]
+            for future in futures:
+                future.result()
+
+    _, record_list = get_queue_records(db_path)
+    write_batch_results(record_list, output_dir)
+
+    return record_list
@@ -0,0 +1,285 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+import xmf
+from xmf.layer_02_generation import RegularGrid, generate_1d_height, generate_1d_slope
+from xmf.layer_03_optimization import OptParamsDict
+from xmf.layer_04_fit import get_fit_model, get_fit_function
+
+
+def hash_fit_inputs(model, x, y, v, input_params_dict: dict, opt_or_tol_dict: dict, fit_options: dict):
+    """
+    Hash the inputs of a fit with the xmf version
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function or its name
+        x: `numpy.ndarray` or `RegularGrid`
+            The x coordinates or the grid
+        y: `numpy.ndarray`
+            The y coordinates, None for a grid or a 1D profile
+        v: `numpy.ndarray`
+            The measured height or slope
+        input_params_dict: `dict`
+            The initial parameters
+        opt_or_tol_dict: `dict`
+            The optimization flags or tolerances
+        fit_options: `dict`
+            The additional options passed to the fitting function
+    Returns
+    -------
+        key: `str`
+            The hexadecimal BLAKE2b digest of the inputs
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+
+    def update_array(array):
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.view(np.uint8))
+
+    name = get_fit_function(model).__name__
+    header = {'xmf_version': xmf.__version__, 'model': name,
+              'input_params': {key: float(val) for key, val in input_params_dict.items()},
+              'opt_or_tol_dict': {key: val if isinstance(val, bool) else [float(tol) for tol in np.ravel(val)] for key, val in opt_or_tol_dict.items()},
+              'fit_options': fit_options}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+    for array in (x, y, v):
+        if isinstance(array, RegularGrid):
+            digest.update(b'RegularGrid')
+            update_array(array.x_axis)
+            update_array(array.y_axis)
+        elif array is None:
+            digest.update(b'None')
+        else:
+            update_array(array)
+
+    return digest.hexdigest()
+
+
+class FitCache:
+    """
+    A content-addressed on-disk cache of the fitting results
+
+    An entry is keyed by the hash of the input arrays, the fitting model, ``input_params_dict``, 
+    ``opt_or_tol_dict``, the fitting options and the xmf version, so a changed input or a new 
+    xmf version never gives a stale result. Each entry is a directory with ``v_res.npy``, 
+    ``v_fit.npy`` and ``result.json``; the stored maps are loaded as copy-on-write memory maps. 
+    The least recently used entries are evicted when the cache exceeds ``max_bytes``.
+
+    Parameters
+    ----------
+        cache_dir: `str`
+            The cache directory, created if needed
+        max_bytes: `int`
+            The size limit of the cache in bytes, None for no limit
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fit(self, model, x, y, v, input_params_dict: dict, opt_or_tol_dict: dict, **kwargs):
+        """
+        Get the fitting result from the cache, or fit and store it
+
+        Parameters
+        ----------
+            model: `function` or `str`
+                The fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+            x: `numpy.ndarray` or `RegularGrid`
+                The x coordinates or the grid
+            y: `numpy.ndarray`
+                The y coordinates, None for a grid or a 1D profile
+            v: `numpy.ndarray`
+                The measured height or slope
+            input_params_dict: `dict`
+                The initial parameters
+            opt_or_tol_dict: `dict`
+                The optimization flags or tolerances
+            kwargs:
+                The additional options passed to the fitting function. The fits with a 
+                ``callback``, and the fits stopped by ``max_time``, are not cached.
+        Returns
+        -------
+            v_res: `numpy.ndarray`
+                The residual
+            v_fit: `numpy.ndarray`
+                The fitting result
+            opt_params_dict: `dict`
+                The optimized parameters in dictionary
+            opt_params_ci_dict: `dict`
+                The confidence intervals of the optimized parameters in dictionary
+            init_params_dict: `dict`
+                The used initial parameters
+        """
+
+        fit_function = get_fit_function(model)
+        surface_generation_function, _ = get_fit_model(model)
+        if surface_generation_function in (generate_1d_height, generate_1d_slope):
+            args = (x, v, input_params_dict, opt_or_tol_dict)
+        else:
+            args = (x, y, v, input_params_dict, opt_or_tol_dict)
+
+        if kwargs.get('callback') is not None:
+            return fit_function(*args, **kwargs)
+
+        key = hash_fit_inputs(fit_function, x, y, v, input_params_dict, opt_or_tol_dict, kwargs)
+        result = self.load(key)
+        if result is not None:
+            return result
+
+        result = fit_function(*args, **kwargs)
+        if getattr(result[2], 'status', 'converged') not in ('max_time', 'callback'): # Not reproducible
+            self.store(key, result)
+        return result
+
+    def load(self, key: str):
+        """
+        Load an entry and mark it as recently used
+
+        Parameters
+        ----------
+            key: `str`
+                The key from ``hash_fit_inputs``
+        Returns
+        -------
+            result: `tuple`
+                The ``v_res``, ``v_fit``, ``opt_params_dict``, ``opt_params_ci_dict`` and 
+                ``init_params_dict``, None if the entry does not exist
+        """
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'result.json')) as file:
+                fields = json.load(file)
+            v_res = np.load(os.path.join(entry_dir, 'v_res.npy'), mmap_mode='c')
+            v_fit = np.load(os.path.join(entry_dir, 'v_fit.npy'), mmap_mode='c')
+            os.utime(os.path.join(entry_dir, 'result.json'))
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        opt_params_dict = OptParamsDict(fields['opt_params_dict'])
+        opt_params_dict.status = fields.get('status', 'converged')
+        opt_params_ci_dict = {name: np.array(ci) for name, ci in fields['opt_params_ci_dict'].items()}
+        return v_res, v_fit, opt_params_dict, opt_params_ci_dict, fields['init_params_dict']
+
+    def store(self, key: str, result: tuple):
+        """
+        Store an entry and evict the least recently used entries beyond ``max_bytes``
+
+        Parameters
+        ----------
+            key: `str`
+                The key from ``hash_fit_inputs``
+            result: `tuple`
+                The ``v_res``, ``v_fit``, ``opt_params_dict``, ``opt_params_ci_dict`` and ``init_params_dict``
+        """
+
+        v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict = result
+        fields = {'status': getattr(opt_params_dict, 'status', 'converged'),
+                  'opt_params_dict': {name: float(val) for name, val in opt_params_dict.items()},
+                  'opt_params_ci_dict': {name: np.asarray(ci, dtype=float).tolist() for name, ci in opt_params_ci_dict.items()},
+                  'init_params_dict': {name: float(val) for name, val in init_params_dict.items()}}
+
+        # Write in a temporary directory renamed at the end, so a reader never sees a partial entry
+        temp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=self.cache_dir)
+        try:
+            np.save(os.path.join(temp_dir, 'v_res.npy'), v_res)
+            np.save(os.path.join(temp_dir, 'v_fit.npy'), v_fit)
+            with open(os.path.join(temp_dir, 'result.json'), 'w') as file:
+                json.dump(fields, file)
+            os.rename(temp_dir, os.path.join(self.cache_dir, key))
+        except OSError: # The entry is stored by another process meanwhile
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def get_entry_list(self):
+        """
+        List the entries from the least to the most recently used
+
+        Returns
+        -------
+            entry_list: `list`
+                The ``(key, last_used, nbytes)`` of each entry
+        """
+
+        entry_list = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if key.startswith('.tmp_') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(entry_dir, 'result.json'))
+                nbytes = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            except OSError: # Incomplete or removed meanwhile
+                continue
+            entry_list.append((key, last_used, nbytes))
+        return sorted(entry_list, key=lambda entry: entry[1])
+
+    def evict(self, max_bytes: int):
+        """
+        Remove the least recently used entries until the cache size is within ``max_bytes``
+
+        Parameters
+        ----------
+            max_bytes: `int`
+                The size limit in bytes
+        """
+
+        entry_list = self.get_entry_list()
+        total_bytes = sum(entry[2] for entry in entry_list)
+        for key, _, nbytes in entry_list:
+            if total_bytes <= max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total_bytes -= nbytes
+
+    def clear(self):
+        """
+        Remove all the entries
+        """
+
+        self.evict(0)
@@ -0,0 +1,147 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import os
+import sys
+
+from xmf.batch import load_fit_config, find_measurement_files, run_batch, create_batch_queue, run_batch_queue
+
+
+def fit_main(argv: list = None):
+    """
+    Entry point of ``xmf-fit``: fit a batch of measurement files
+
+    Parameters
+    ----------
+        argv: `list`
+            The command-line arguments. If None, ``sys.argv[1:]`` is used.
+    Returns
+    -------
+        exit_code: `int`
+            0 if all the files are fitted, 1 otherwise
+    """
+
+    parser = argparse.ArgumentParser(prog='xmf-fit', description='Fit a batch of X-ray mirror measurement files.')
+    parser.add_argument('source', help='directory of measurement files, or manifest file with one path per line')
+    parser.add_argument('-c', '--config', required=True, help='JSON or TOML file with the opt_dict or tol_dict')
+    parser.add_argument('-m', '--model', help='fitting model, e.g. concave_ellipsoid_height (overrides the config)')
+    parser.add_argument('-o', '--output-dir', default='xmf_results', help='directory of the results and residual maps')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-q', '--queue', help='SQLite file of a resumable job queue; running again resumes the batch')
+    parser.add_argument('--retry-failed', action='store_true', help='retry the failed jobs of the queue')
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_fit_config(args.config)
+        model = args.model or config['model']
+        if model is None:
+            parser.error('the model must be given with --model or in the config')
+
+        path_list = find_measurement_files(args.source)
+        if not path_list:
+            parser.error(f'no measurement files found in {args.source}')
+
+        if args.queue:
+            create_batch_queue(args.queue, path_list, model, config['opt_or_tol_dict'], os.path.abspath(args.output_dir),
+                               config['input_params'], config['fit_options'])
+            record_list = run_batch_queue(args.queue, args.workers, args.retry_failed)
+        else:
+            record_list = run_batch(path_list, model, config['opt_or_tol_dict'], args.output_dir,
+                                    config['input_params'], config['fit_options'], args.workers)
+    except (ValueError, OSError) as err:
+        parser.error(str(err))
+
+    num_failed = 0
+    for record in record_list:
+        if record['status'] == 'done':
+            print(f"{record['file']}: residual RMS {record['rms']:.4g} in {record['time_total']:.2f} s")
+        else:
+            num_failed += 1
+            print(f"{record['file']}: failed, {record['error']}", file=sys.stderr)
+    print(f"{len(record_list) - num_failed} of {len(record_list)} files fitted, results in {args.output_dir}")
+
+    return 1 if num_failed else 0
+
+
+def serve_main(argv: list = None):
+    """
+    Entry point of ``xmf serve``: run the local fitting service
+
+    Parameters
+    ----------
+        argv: `list`
+            The command-line arguments. If None, ``sys.argv[1:]`` is used.
+    Returns
+    -------
+        exit_code: `int`
+            0 when the service is stopped
+    """
+
+    from xmf.serve import serve
+
+    parser = argparse.ArgumentParser(prog='xmf serve', description='Run the local fitting service with warm worker processes.')
+    parser.add_argument('--host', default='127.0.0.1', help='host address (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8765, help='TCP port (default: 8765)')
+    parser.add_argument('-u', '--unix-socket', help='Unix socket path, used instead of the TCP port')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-d', '--data-root', help='directory of the measurement files the clients may request by path (default: none, arrays only)')
+    args = parser.parse_args(argv)
+
+    try:
+        serve(args.host, args.port, args.unix_socket, args.workers, args.data_root)
+    except FileExistsError as err:
+        parser.error(str(err))
+
+    return 0
+
+
+def main(argv: list = None):
+    """
+    Entry point of ``xmf``: run the ``fit`` or ``serve`` command
+
+    Parameters
+    ----------
+        argv: `list`
+            The command-line arguments. If None, ``sys.argv[1:]`` is used.
+    Returns
+    -------
+        exit_code: `int`
+            The exit code of the command
+    """
+
+    argv = sys.argv[1:] if argv is None else argv
+    command_dict = {'fit': fit_main, 'serve': serve_main}
+    if not argv or argv[0] not in command_dict:
+        print("usage: xmf {fit,serve} ...\n\n"
+              "  fit    fit a batch of measurement files, see xmf fit --help\n"
+              "  serve  run the local fitting service, see xmf serve --help", file=sys.stderr)
+        return 0 if argv and argv[0] in ('-h', '--help') else 2
+
+    return command_dict[argv[0]](argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
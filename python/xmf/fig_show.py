@@ -27,9 +27,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 import re
+import time
 from scipy.interpolate import interp1d
 from mpl_toolkits import axes_grid1
 
+from xmf.layer_02_generation import RegularGrid, resolve_grid
+from xmf.layer_03_optimization import check_input_params, check_opt_dict, check_tol_dict, generate_surface_with_params
+from xmf.layer_04_fit import get_fit_model
+
 
 def add_colorbar(im: plt.cm.ScalarMappable,
                  title: str = None,
@@ -86,16 +91,39 @@ def reg_exp_rep(s):
     s = re.sub(r'e-0*(\d+)', r'\\times10^{-\1}', s)
     return s
 
+def grid_in_mm(x2d, y2d):
+    """
+    Convert the coordinates to [mm] for plotting
+
+    Parameters
+    ----------
+        x2d: `numpy.ndarray` or `RegularGrid`
+            2D array of x-coordinates, or the grid of x and y axes
+        y2d: `numpy.ndarray`
+            2D array of y-coordinates, None for a grid
+    Returns
+    -------
+        x_mm: `numpy.ndarray`
+            The x-coordinates in [mm], the 1D axis for a grid
+        y_mm: `numpy.ndarray`
+            The y-coordinates in [mm], the 1D axis for a grid
+    """
+
+    if isinstance(x2d, RegularGrid):
+        return x2d.x_axis * 1e3, x2d.y_axis * 1e3 # pcolormesh accepts the 1D axes
+    return x2d * 1e3, y2d * 1e3
+
+
 def fig_show_2d_map(x2d, y2d, z2d_quad_sln, z2d_expression, str_title):
     """
     Show a 2D map of height data with colorbar
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            2D array of x-coordinates
+        x2d: `numpy.ndarray` or `RegularGrid`
+            2D array of x-coordinates, or the grid of x and y axes
         y2d: `numpy.ndarray`
-            2D array of y-coordinates
+            2D array of y-coordinates, None for a grid
         z2d_quad_sln: `numpy.ndarray`
             2D array of height data from quadratic equation solution
         z2d_expression: `numpy.ndarray`
@@ -107,8 +135,8 @@ def fig_show_2d_map(x2d, y2d, z2d_quad_sln, z2d_expression, str_title):
         None        
     """
 
-    x2d_mm = x2d * 1e3
-    y2d_mm = y2d * 1e3
+    x2d_mm, y2d_mm = grid_in_mm(x2d, y2d)
+    x2d, y2d = resolve_grid(x2d, y2d)
     z2d_quad_sln_um = z2d_quad_sln * 1e6
     z2d_expression_um = z2d_expression * 1e6
     dz2d_nm = (z2d_quad_sln - z2d_expression) * 1e9
@@ -275,16 +303,99 @@ def fig_compare_1d_slope(x1d, sx1d_generation, sx1d_standard, str_title):
     plt.tight_layout()
     plt.show()
     
+
+def parameter_to_string_2d(params_dict, is_optimized_dict=None):
+    """
+    Format the parameters of a 2D fitting as the three lines of the parameter panels
+
+    Parameters
+    ----------
+        params_dict: `dict`
+            Dictionary of parameters
+        is_optimized_dict: `dict`
+            The optimized parameters marked with a hat, None for no hat
+    Returns
+    -------
+        str_list: `list`
+            The three lines of parameters in LaTeX format
+    """
+
+    def get_height_map_string(is_optimized_dict):
+        if is_optimized_dict is None:
+            is_optimized_dict = {'p': False, 'q': False, 'theta': False, 'x_i': False, 'y_i': False, 'z_i': False, 'alpha': False, 'beta': False, 'gamma': False}
+
+        str_p = r'\hat{p}' if is_optimized_dict.get('p', True) else 'p'
+        str_q = r'\hat{q}' if is_optimized_dict.get('q', True) else 'q'
+        str_theta = r'\hat{\theta}' if is_optimized_dict.get('theta', True) else r'\theta'
+        str_x_i = r'\hat{x_i}' if is_optimized_dict.get('x_i', True) else 'x_i'
+        str_y_i = r'\hat{y_i}' if is_optimized_dict.get('y_i', True) else 'y_i'
+        str_z_i = r'\hat{z_i}' if is_optimized_dict.get('z_i', True) else 'z_i'
+        str_alpha = r'\hat{\alpha}' if is_optimized_dict.get('alpha', True) else r'\alpha'
+        str_beta = r'\hat{\beta}' if is_optimized_dict.get('beta', True) else r'\beta'
+        str_gamma = r'\hat{\gamma}' if is_optimized_dict.get('gamma', True) else r'\gamma'
+
+        return str_p, str_q, str_theta, str_x_i, str_y_i, str_z_i, str_alpha, str_beta, str_gamma
+
+    # Helper for 2D parameter string formatting
+    str_p, str_q, str_theta, str_x_i, str_y_i, str_z_i, str_alpha, str_beta, str_gamma = get_height_map_string(is_optimized_dict)
+    if 'y_i' in params_dict:
+        str_1 = r'($%s$, $%s$, $%s$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (str_p, str_q, str_theta, params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
+        str_2 = r'($%s$, $%s$, $%s$) = ($%.4g$ mm, $%.4g$ mm, $%.4g$ mm)' % (str_x_i, str_y_i, str_z_i, params_dict['x_i']*1e3, params_dict['y_i']*1e3, params_dict['z_i']*1e3)
+        str_3 = r'($%s$, $%s$, $%s$) = ($%.4g$ $\mu$rad, $%.4g$ $\mu$rad, $%.4g$ $\mu$rad)' % (str_alpha, str_beta, str_gamma, params_dict['alpha']*1e6, params_dict['beta']*1e6, params_dict['gamma']*1e6)
+    else:
+        str_1 = r'($p$, $q$, $\theta$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
+        str_2 = r'($x_i$, $z_i$) = ($%.4g$ mm, $%.4g$ mm)' % (params_dict['x_i']*1e3, params_dict['z_i']*1e3)
+        str_3 = r'($\alpha$, $\beta$, $\gamma$) = ($%.4g$ $\mu$rad, $%.4g$ $\mu$rad, $%.4g$ $\mu$rad)' % (params_dict['alpha']*1e6, params_dict['beta']*1e6, params_dict['gamma']*1e6)
+    return [reg_exp_rep(str_1), reg_exp_rep(str_2), reg_exp_rep(str_3)]
+
+
+def parameter_to_string_1d(params_dict, is_optimized_dict=None):
+    """
+    Format the parameters of a 1D fitting as the three lines of the parameter panels
+
+    Parameters
+    ----------
+        params_dict: `dict`
+            Dictionary of parameters
+        is_optimized_dict: `dict`
+            The optimized parameters marked with a hat, None for no hat
+    Returns
+    -------
+        str_list: `list`
+            The three lines of parameters in LaTeX format
+    """
+
+    def get_height_string(is_optimized_dict):
+        if is_optimized_dict is None:
+            is_optimized_dict = {'p': False, 'q': False, 'theta': False, 'x_i': False, 'y_i': False, 'z_i': False, 'alpha': False, 'beta': False, 'gamma': False}
+
+        str_p = r'\hat{p}' if is_optimized_dict.get('p', True) else 'p'
+        str_q = r'\hat{q}' if is_optimized_dict.get('q', True) else 'q'
+        str_theta = r'\hat{\theta}' if is_optimized_dict.get('theta', True) else r'\theta'
+        str_x_i = r'\hat{x_i}' if is_optimized_dict.get('x_i', True) else 'x_i'
+        str_z_i = r'\hat{z_i}' if is_optimized_dict.get('z_i', True) else 'z_i'
+        str_beta = r'\hat{\beta}' if is_optimized_dict.get('beta', True) else r'\beta'
+        return str_p, str_q, str_theta, str_x_i, str_z_i, str_beta
+
+    str_p, str_q, str_theta, str_x_i, str_z_i, str_beta = get_height_string(is_optimized_dict)
+
+    # Helper for 1D parameter string formatting
+    str_1 = r'($%s$, $%s$, $%s$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (str_p, str_q, str_theta, params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
+    str_2 = r'($%s$, $%s$) = ($%.4g$ mm, $%.4g$ mm)' % (str_x_i, str_z_i, params_dict['x_i']*1e3, params_dict['z_i']*1e3)
+    str_3 = r'$%s$ = $%.4g$ $\mu$rad' % (str_beta, params_dict['beta']*1e6)
+    return [reg_exp_rep(str_1), reg_exp_rep(str_2), reg_exp_rep(str_3)]
+
+
 def fig_show_2d_fitting_map(x2d, y2d, z2d_measured, z2d_fit, z2d_res, input_params_dict, opt_params_dict, opt_params_ci_dict, str_title):
     """
     Show a 2D fitting map with colorbar, input parameters, Resultant parameters, and residuals
     
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            2D array of x-coordinates
+        x2d: `numpy.ndarray` or `RegularGrid`
+            2D array of x-coordinates, or the grid of x and y axes
         y2d: `numpy.ndarray`
-            2D array of y-coordinates
+            2D array of y-coordinates, None for a grid
         z2d_measured: `numpy.ndarray`
             2D array of measured z-values
         z2d_fit: `numpy.ndarray`
@@ -305,8 +416,8 @@ def fig_show_2d_fitting_map(x2d, y2d, z2d_measured, z2d_fit, z2d_res, input_para
         None
     """
 
-    x2d_mm = x2d * 1e3
-    y2d_mm = y2d * 1e3
+    x2d_mm, y2d_mm = grid_in_mm(x2d, y2d)
+    x2d, y2d = resolve_grid(x2d, y2d)
     z2d_um = z2d_measured * 1e6
     z2d_fit_um = z2d_fit * 1e6
     z2d_res_nm = z2d_res * 1e9
@@ -322,36 +433,6 @@ def fig_show_2d_fitting_map(x2d, y2d, z2d_measured, z2d_fit, z2d_res, input_para
     for str_param_name in str_param_name_list:
         is_optimized_dict[str_param_name] = True if np.all(np.isfinite(opt_params_ci_dict[str_param_name])) else False
         
-    def parameter_to_string_2d(params_dict, is_optimized_dict=None):
-        def get_height_map_string(is_optimized_dict):
-            if is_optimized_dict is None:
-                is_optimized_dict = {'p': False, 'q': False, 'theta': False, 'x_i': False, 'y_i': False, 'z_i': False, 'alpha': False, 'beta': False, 'gamma': False}
-                
-            str_p = r'\hat{p}' if is_optimized_dict.get('p', True) else 'p'
-            str_q = r'\hat{q}' if is_optimized_dict.get('q', True) else 'q'
-            str_theta = r'\hat{\theta}' if is_optimized_dict.get('theta', True) else r'\theta'
-            str_x_i = r'\hat{x_i}' if is_optimized_dict.get('x_i', True) else 'x_i'
-            str_y_i = r'\hat{y_i}' if is_optimized_dict.get('y_i', True) else 'y_i'
-            str_z_i = r'\hat{z_i}' if is_optimized_dict.get('z_i', True) else 'z_i'
-            str_alpha = r'\hat{\alpha}' if is_optimized_dict.get('alpha', True) else r'\alpha'
-            str_beta = r'\hat{\beta}' if is_optimized_dict.get('beta', True) else r'\beta'
-            str_gamma = r'\hat{\gamma}' if is_optimized_dict.get('gamma', True) else r'\gamma'
-
-            return str_p, str_q, str_theta, str_x_i, str_y_i, str_z_i, str_alpha, str_beta, str_gamma
-        
-        # Helper for 2D parameter string formatting
-        str_p, str_q, str_theta, str_x_i, str_y_i, str_z_i, str_alpha, str_beta, str_gamma = get_height_map_string(is_optimized_dict)
-        if 'y_i' in params_dict:
-            str_1 = r'($%s$, $%s$, $%s$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (str_p, str_q, str_theta, params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
-            str_2 = r'($%s$, $%s$, $%s$) = ($%.4g$ mm, $%.4g$ mm, $%.4g$ mm)' % (str_x_i, str_y_i, str_z_i, params_dict['x_i']*1e3, params_dict['y_i']*1e3, params_dict['z_i']*1e3)
-            str_3 = r'($%s$, $%s$, $%s$) = ($%.4g$ $\mu$rad, $%.4g$ $\mu$rad, $%.4g$ $\mu$rad)' % (str_alpha, str_beta, str_gamma, params_dict['alpha']*1e6, params_dict['beta']*1e6, params_dict['gamma']*1e6)
-        else:
-            str_1 = r'($p$, $q$, $\theta$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
-            str_2 = r'($x_i$, $z_i$) = ($%.4g$ mm, $%.4g$ mm)' % (params_dict['x_i']*1e3, params_dict['z_i']*1e3)
-            str_3 = r'($\alpha$, $\beta$, $\gamma$) = ($%.4g$ $\mu$rad, $%.4g$ $\mu$rad, $%.4g$ $\mu$rad)' % (params_dict['alpha']*1e6, params_dict['beta']*1e6, params_dict['gamma']*1e6)
-        return [reg_exp_rep(str_1), reg_exp_rep(str_2), reg_exp_rep(str_3)]
-
-
     fig = plt.figure(figsize=(18, 6))
     gs = gridspec.GridSpec(3, 3, height_ratios=[1, 1, 1], width_ratios=[1, 1, 1], wspace=0.3, hspace=0.3)
 
@@ -462,28 +543,6 @@ def fig_show_1d_fitting_height(x1d, z1d_measured, z1d_fit, z1d_res, input_params
     for str_param_name in str_param_name_list:
         is_optimized_dict[str_param_name] = True if np.all(np.isfinite(opt_params_ci_dict[str_param_name])) else False
        
-    def parameter_to_string_1d(params_dict, is_optimized_dict=None):
-
-        def get_height_string(is_optimized_dict):
-            if is_optimized_dict is None:
-                is_optimized_dict = {'p': False, 'q': False, 'theta': False, 'x_i': False, 'y_i': False, 'z_i': False, 'alpha': False, 'beta': False, 'gamma': False}
-
-            str_p = r'\hat{p}' if is_optimized_dict.get('p', True) else 'p'
-            str_q = r'\hat{q}' if is_optimized_dict.get('q', True) else 'q'
-            str_theta = r'\hat{\theta}' if is_optimized_dict.get('theta', True) else r'\theta'
-            str_x_i = r'\hat{x_i}' if is_optimized_dict.get('x_i', True) else 'x_i'
-            str_z_i = r'\hat{z_i}' if is_optimized_dict.get('z_i', True) else 'z_i'
-            str_beta = r'\hat{\beta}' if is_optimized_dict.get('beta', True) else r'\beta'
-            return str_p, str_q, str_theta, str_x_i, str_z_i, str_beta
-
-        str_p, str_q, str_theta, str_x_i, str_z_i, str_beta = get_height_string(is_optimized_dict)
-
-        # Helper for 1D parameter string formatting
-        str_1 = r'($%s$, $%s$, $%s$) = ($%.4g$ m, $%.4g$ m, $%.4g$ mrad)' % (str_p, str_q, str_theta, params_dict['p'], params_dict['q'], params_dict['theta']*1e3)
-        str_2 = r'($%s$, $%s$) = ($%.4g$ mm, $%.4g$ mm)' % (str_x_i, str_z_i, params_dict['x_i']*1e3, params_dict['z_i']*1e3)
-        str_3 = r'$%s$ = $%.4g$ $\mu$rad' % (str_beta, params_dict['beta']*1e6)
-        return [reg_exp_rep(str_1), reg_exp_rep(str_2), reg_exp_rep(str_3)]
-
     fig = plt.figure(figsize=(15, 6))
     gs = gridspec.GridSpec(3, 3, height_ratios=[1, 1, 1], width_ratios=[1, 1, 1], wspace=0.3, hspace=0.3)
 
@@ -652,10 +711,10 @@ def fig_show_2d_different_fitting_maps(x2d, y2d, z2d_measured, z2d_fit_1, z2d_re
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            2D array of x-coordinates
+        x2d: `numpy.ndarray` or `RegularGrid`
+            2D array of x-coordinates, or the grid of x and y axes
         y2d: `numpy.ndarray`
-            2D array of y-coordinates
+            2D array of y-coordinates, None for a grid
         z2d_measured: `numpy.ndarray`
             2D array of measured height map
         z2d_fit_1: `numpy.ndarray`
@@ -684,8 +743,8 @@ def fig_show_2d_different_fitting_maps(x2d, y2d, z2d_measured, z2d_fit_1, z2d_re
         None
     """
 
-    x2d_mm = x2d*1e3
-    y2d_mm = y2d*1e3
+    x2d_mm, y2d_mm = grid_in_mm(x2d, y2d)
+    x2d, y2d = resolve_grid(x2d, y2d)
     z2d_um = z2d_measured*1e6
     z2d_fit_1_um = z2d_fit_1*1e6
     z2d_res_1_nm = z2d_res_1*1e9
@@ -836,4 +895,475 @@ def fig_show_2d_different_fitting_maps(x2d, y2d, z2d_measured, z2d_fit_1, z2d_re
 
     plt.show()
 
-    
\ No newline at end of file
+    
+
+def get_is_optimized_dict(opt_params_ci_dict=None, opt_or_tol_dict=None, surface_generation_function=None):
+    """
+    Get the optimized parameters to mark with a hat, from the confidence intervals or the optimization settings
+
+    Parameters
+    ----------
+        opt_params_ci_dict: `dict`
+            Dictionary of optimized parameters confidence intervals, finite for the optimized ones
+        opt_or_tol_dict: `dict`
+            The ``opt_dict`` of booleans or the ``tol_dict`` of tolerances, used without confidence intervals
+        surface_generation_function: `function`
+            The generation function of the model, giving the defaults of the parameters missing from ``opt_or_tol_dict``
+    Returns
+    -------
+        is_optimized_dict: `dict`
+            True for the optimized parameters, None if neither dictionary is given
+    """
+
+    str_param_name_list = ['p', 'q', 'theta',
+                           'x_i', 'y_i', 'z_i', 
+                           'alpha', 'beta', 'gamma']
+    if opt_params_ci_dict is not None:
+        return {name: bool(np.all(np.isfinite(opt_params_ci_dict[name]))) for name in str_param_name_list if name in opt_params_ci_dict}
+    if opt_or_tol_dict is not None:
+        # The same flags as the fit, including the defaults of the missing parameters
+        if isinstance(opt_or_tol_dict['p'], bool):
+            opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        else:
+            opt_vector, _ = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+        return dict(zip(str_param_name_list, opt_vector.tolist()))
+    return None
+
+
+class FittingMapViewer:
+    """
+    Live view of a 2D fitting map with the layout of ``fig_show_2d_fitting_map``
+
+    The figure, the images, the colorbars and the texts are created once, and ``update`` 
+    only replaces the data, the color limits and the texts. The view can follow the 
+    optimizer with ``make_fit_callback``, or show each new measurement of a monitoring 
+    screen. The maps are drawn with ``imshow`` on the regular grid and subsampled to the 
+    screen resolution, and ``refresh`` blits the changed artists over the saved background 
+    of the axes, so a 1M-pixel map is redrawn in a few tens of milliseconds.
+
+    Parameters
+    ----------
+        x2d: `numpy.ndarray` or `RegularGrid`
+            2D array of x-coordinates, or the grid of x and y axes
+        y2d: `numpy.ndarray`
+            2D array of y-coordinates, None for a grid
+        input_params_dict: `dict`
+            Dictionary of input parameters, None to show them later. The missing 
+            optional parameters are shown with the defaults of the fitting functions
+        str_title: `str`
+            Title of the plot
+    """
+
+    def __init__(self, x2d, y2d, input_params_dict: dict = None, str_title: str = ''):
+        self.x2d, self.y2d = x2d, y2d
+        x_mm, y_mm = grid_in_mm(x2d, y2d)
+        if np.ndim(x_mm) == 2:
+            x_mm, y_mm = x_mm[0, :], y_mm[:, 0]
+        dx_mm = (x_mm[-1] - x_mm[0]) / max(x_mm.size - 1, 1) / 2
+        dy_mm = (y_mm[-1] - y_mm[0]) / max(y_mm.size - 1, 1) / 2
+        extent = (x_mm[0] - dx_mm, x_mm[-1] + dx_mm, y_mm[0] - dy_mm, y_mm[-1] + dy_mm)
+        self.x_span = abs(x_mm[-1] - x_mm[0]) * 1e-3
+        self.is_optimized_dict = None
+
+        font_size = 14
+        large_font_size = 24
+        marker_size = 14
+        z2d_nan = np.full((y_mm.size, x_mm.size), np.nan)
+
+        self.fig = plt.figure(figsize=(18, 6))
+        gs = gridspec.GridSpec(3, 3, height_ratios=[1, 1, 1], width_ratios=[1, 1, 1], wspace=0.3, hspace=0.3)
+
+        def add_map(ax, str_unit, **kwargs):
+            im = ax.imshow(z2d_nan, extent=extent, origin='lower', aspect='auto', interpolation='nearest', **kwargs)
+            ax.set_xlim(sorted(extent[:2]))
+            ax.set_ylim(sorted(extent[2:]))
+            ax.set_ylabel('y [mm]', fontsize=font_size)
+            add_colorbar(im, str_unit)
+            ax.tick_params(axis='both', labelsize=font_size)
+            return im
+
+        def add_param_texts(ax, str_name):
+            ax.axis('off')
+            ax.text(0, 1, str_name, fontsize=large_font_size, ha='left', va='top', fontweight='bold', color='k', transform=ax.transAxes)
+            return [ax.text(0, 0.7-0.2*i, '', fontsize=font_size, ha='left', va='top', transform=ax.transAxes) for i in range(3)]
+
+        # Data
+        ax1 = plt.subplot(gs[0, 0:2])
+        self.im_measured = add_map(ax1, '[µm]')
+        ax1.set_xticklabels([])
+        ax1.set_title(str_title, fontsize=font_size)
+
+        # Input parameters
+        self.input_text_list = add_param_texts(plt.subplot(gs[0, 2]), 'Input parameters:')
+
+        # Fit
+        ax3 = plt.subplot(gs[1, 0:2])
+        self.im_fit = add_map(ax3, '[µm]')
+        self.marker, = ax3.plot([], [], 'ro', markersize=marker_size, markerfacecolor='r')
+        # Beam direction projection
+        self.quiver = ax3.quiver([np.nan], [np.nan], [0], [0], angles='xy', scale_units='xy', scale=1, color='r', linewidth=0.5)
+        ax3.set_xticklabels([])
+        ax3.set_title('Fitting', fontsize=font_size)
+
+        # Resultant parameters
+        self.opt_text_list = add_param_texts(plt.subplot(gs[1, 2]), 'Resultant parameters:')
+
+        # Residual
+        ax5 = plt.subplot(gs[2, 0:2])
+        self.im_res = add_map(ax5, '[nm]', cmap='coolwarm')
+        ax5.set_xlabel('x [mm]', fontsize=font_size)
+        ax5.set_title('Residual', fontsize=font_size)
+
+        # Residual RMS
+        ax6 = plt.subplot(gs[2, 2])
+        ax6.axis('off')
+        self.rms_text = ax6.text(0.5, 0.5, '', fontsize=large_font_size, fontweight='bold', ha='center', va='center', color='k', transform=ax6.transAxes)
+
+        # The changed artists are drawn over the background saved at each full draw
+        self.animated_artist_list = [self.im_measured, self.im_fit, self.im_res, self.marker, self.quiver, self.rms_text,
+                                     *self.opt_text_list,
+                                     self.im_measured.colorbar.ax, self.im_fit.colorbar.ax, self.im_res.colorbar.ax]
+        for artist in self.animated_artist_list:
+            artist.set_animated(True)
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+        if input_params_dict is not None:
+            self.update(input_params_dict=input_params_dict)
+        plt.show(block=False)
+
+    def on_draw(self, event):
+        """
+        Save the background of a full draw and draw the changed artists over it
+        """
+
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        """
+        Draw the changed artists on the canvas
+        """
+
+        for artist in self.animated_artist_list:
+            self.fig.draw_artist(artist)
+
+    def set_map(self, im, z2d, scale):
+        """
+        Show a map subsampled to the pixels of its axes, with the color limits of the full map
+        """
+
+        bbox = im.axes.get_window_extent()
+        step_y = max(1, z2d.shape[0] // max(int(bbox.height), 1))
+        step_x = max(1, z2d.shape[1] // max(int(bbox.width), 1))
+        im.set_data(z2d[::step_y, ::step_x] * scale)
+        v_min, v_max = np.nanmin(z2d), np.nanmax(z2d)
+        if np.isfinite(v_min):
+            im.set_clim(v_min * scale, v_max * scale)
+
+    def update(self, z2d_measured=None, z2d_fit=None, z2d_res=None, input_params_dict=None, opt_params_dict=None, opt_params_ci_dict=None):
+        """
+        Update the maps and the texts, the arguments left as None keep their current content
+
+        Parameters
+        ----------
+            z2d_measured: `numpy.ndarray`
+                2D array of measured z-values
+            z2d_fit: `numpy.ndarray`
+                2D array of fitted z-values
+            z2d_res: `numpy.ndarray`
+                2D array of residuals
+            input_params_dict: `dict`
+                Dictionary of input parameters
+            opt_params_dict: `dict`
+                Dictionary of optimized parameters
+            opt_params_ci_dict: `dict`
+                Dictionary of optimized parameters confidence intervals
+        """
+
+        if z2d_measured is not None:
+            self.set_map(self.im_measured, z2d_measured, 1e6)
+        if z2d_fit is not None:
+            self.set_map(self.im_fit, z2d_fit, 1e6)
+        if z2d_res is not None:
+            self.set_map(self.im_res, z2d_res, 1e9)
+            self.rms_text.set_text(f'Residual:\n{np.nanstd(z2d_res)*1e9:.2f} nm RMS')
+        if input_params_dict is not None:
+            # Show the missing optional parameters with the defaults of the fitting functions
+            str_param_name_list = ['p', 'q', 'theta',
+                                   'x_i', 'y_i', 'z_i', 
+                                   'alpha', 'beta', 'gamma']
+            x2d, y2d = resolve_grid(self.x2d, self.y2d)
+            input_params_dict = dict(zip(str_param_name_list, check_input_params(input_params_dict, x2d, y2d, np.zeros(np.shape(x2d)))))
+            for text, s in zip(self.input_text_list, parameter_to_string_2d(input_params_dict)):
+                if text.get_text() != s:
+                    # The input parameters are in the background, redrawn in full
+                    text.set_text(s)
+                    self.background = None
+        if opt_params_ci_dict is not None:
+            self.is_optimized_dict = get_is_optimized_dict(opt_params_ci_dict)
+        if opt_params_dict is not None:
+            for text, s in zip(self.opt_text_list, parameter_to_string_2d(opt_params_dict, self.is_optimized_dict)):
+                text.set_text(s)
+            x_i_mm, y_i_mm = opt_params_dict['x_i']*1e3, opt_params_dict.get('y_i', 0)*1e3
+            self.marker.set_data([x_i_mm], [y_i_mm])
+            if 'gamma' in opt_params_dict:
+                proj_x = np.cos(opt_params_dict['gamma']) * self.x_span * 0.08 * 1e3
+                proj_y = np.sin(opt_params_dict['gamma']) * self.x_span * 0.08 * 1e3
+                self.quiver.set_offsets([[x_i_mm - proj_x, y_i_mm - proj_y]])
+                self.quiver.set_UVC([2*proj_x], [2*proj_y])
+
+    def refresh(self):
+        """
+        Redraw the changed artists and process the pending GUI events
+        """
+
+        canvas = self.fig.canvas
+        if not canvas.supports_blit:
+            canvas.draw_idle()
+        elif self.background is None:
+            canvas.draw()  # saves the background in on_draw
+        else:
+            canvas.restore_region(self.background)
+            self.draw_animated()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def make_fit_callback(self, model, z2d_measured, opt_or_tol_dict: dict = None, min_interval: float = 0.1):
+        """
+        Make the ``callback`` of a fitting function to follow the optimizer
+
+        The measured map is shown at once. After each iteration, the fit is generated 
+        with the current ``params_dict`` and the view is refreshed, at most once every 
+        ``min_interval`` seconds. The optimizer does not tell which iteration is the last, 
+        so the last iterations may be skipped: call ``update`` with the returned fit, 
+        residual and parameters, and ``refresh``, to show the final result.
+
+        Parameters
+        ----------
+            model: `function` or `str`
+                The 2D fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+            z2d_measured: `numpy.ndarray`
+                2D array of measured z-values on the grid of the viewer
+            opt_or_tol_dict: `dict`
+                The ``opt_dict`` or ``tol_dict`` of the fit, to mark the optimized parameters
+            min_interval: `float`
+                The minimum time between two refreshes in seconds
+        Returns
+        -------
+            callback: `function`
+                The function to pass as ``callback`` to the fitting function
+        """
+
+        surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+        str_param_name_list = ['p', 'q', 'theta',
+                               'x_i', 'y_i', 'z_i', 
+                               'alpha', 'beta', 'gamma']
+        self.is_optimized_dict = get_is_optimized_dict(opt_or_tol_dict=opt_or_tol_dict, surface_generation_function=surface_generation_function)
+        self.update(z2d_measured=z2d_measured)
+        self.refresh()
+        refresh_state = {'time': -np.inf}
+
+        def callback(intermediate_result):
+            if time.perf_counter() - refresh_state['time'] < min_interval:
+                return
+            params_dict = intermediate_result['params_dict']
+            params = np.array([params_dict[name] for name in str_param_name_list])
+            z2d_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, 
+                                                   self.x2d, self.y2d, params, z2d_measured)
+            self.update(z2d_fit=z2d_fit, z2d_res=z2d_measured - z2d_fit, opt_params_dict=params_dict)
+            self.refresh()
+            refresh_state['time'] = time.perf_counter()
+
+        return callback
+
+    def close(self):
+        """
+        Close the figure
+        """
+
+        plt.close(self.fig)
+
+
+class FittingHeightViewer:
+    """
+    Live view of a 1D height fitting with the layout of ``fig_show_1d_fitting_height``
+
+    The figure, the lines and the texts are created once, and ``update`` only replaces 
+    the data, the axis limits and the texts, see ``FittingMapViewer``.
+
+    Parameters
+    ----------
+        x1d: `numpy.ndarray`
+            1D array of x-coordinates
+        input_params_dict: `dict`
+            Dictionary of input parameters, None to show them later. The missing 
+            optional parameters are shown with the defaults of the fitting functions
+        str_title: `str`
+            Title of the plot
+    """
+
+    def __init__(self, x1d, input_params_dict: dict = None, str_title: str = ''):
+        self.x1d = x1d
+        self.x1d_mm = x1d * 1e3
+        self.is_optimized_dict = None
+        self.z1d_fit_um = None
+
+        font_size = 14
+        large_font_size = 20
+        marker_size = 4
+        line_width = 3
+        z1d_nan = np.full(np.shape(x1d), np.nan)
+
+        self.fig = plt.figure(figsize=(15, 6))
+        gs = gridspec.GridSpec(3, 3, height_ratios=[1, 1, 1], width_ratios=[1, 1, 1], wspace=0.3, hspace=0.3)
+
+        def add_param_texts(ax, str_name, color):
+            ax.axis('off')
+            ax.text(0, 1, str_name, fontsize=large_font_size, ha='left', va='top', fontweight='bold', color=color, transform=ax.transAxes)
+            return [ax.text(0, 0.7-0.2*i, '', fontsize=font_size, ha='left', va='top', transform=ax.transAxes) for i in range(3)]
+
+        # Data
+        self.ax_height = plt.subplot(gs[0:2, 0:2])
+        self.line_measured, = self.ax_height.plot(self.x1d_mm, z1d_nan, 'o', markersize=8, label='Measured')
+        self.line_fit, = self.ax_height.plot(self.x1d_mm, z1d_nan, '-', linewidth=line_width, label='Fit')
+        self.marker, = self.ax_height.plot([], [], 'ro', markersize=marker_size, markerfacecolor='r')
+        self.ax_height.set_xticklabels([])
+        self.ax_height.set_ylabel('z [µm]', fontsize=font_size)
+        self.ax_height.set_title(str_title, fontsize=font_size)
+        self.ax_height.tick_params(axis='both', labelsize=font_size)
+
+        # Input parameters
+        self.input_text_list = add_param_texts(plt.subplot(gs[0, 2]), 'Input parameters:', 'k')
+
+        # Resultant parameters
+        self.opt_text_list = add_param_texts(plt.subplot(gs[1, 2]), 'Resultant parameters:', 'tab:orange')
+
+        # Residual
+        self.ax_res = plt.subplot(gs[2, 0:2])
+        self.ax_res.axhline(0, color='k')
+        self.line_res, = self.ax_res.plot(self.x1d_mm, z1d_nan, 'o-', markersize=marker_size, markerfacecolor='tab:blue', markeredgecolor='tab:blue', color='tab:blue')
+        self.ax_res.set_xlabel('x [mm]', fontsize=font_size)
+        self.ax_res.set_ylabel('Residual [nm]', fontsize=font_size)
+        self.ax_res.tick_params(axis='both', labelsize=font_size)
+
+        # Residual RMS
+        ax5 = plt.subplot(gs[2, 2])
+        ax5.axis('off')
+        self.rms_text = ax5.text(0.5, 0.5, '', fontsize=large_font_size, fontweight='bold', ha='center', va='center', color='tab:blue', transform=ax5.transAxes)
+
+        if input_params_dict is not None:
+            self.update(input_params_dict=input_params_dict)
+        plt.show(block=False)
+
+    def update(self, z1d_measured=None, z1d_fit=None, z1d_res=None, input_params_dict=None, opt_params_dict=None, opt_params_ci_dict=None):
+        """
+        Update the lines and the texts, the arguments left as None keep their current content
+
+        Parameters
+        ----------
+            z1d_measured: `numpy.ndarray`
+                1D array of measured z-values
+            z1d_fit: `numpy.ndarray`
+                1D array of fitted z-values
+            z1d_res: `numpy.ndarray`
+                1D array of residuals
+            input_params_dict: `dict`
+                Dictionary of input parameters
+            opt_params_dict: `dict`
+                Dictionary of optimized parameters
+            opt_params_ci_dict: `dict`
+                Dictionary of optimized parameters confidence intervals
+        """
+
+        if z1d_measured is not None:
+            self.line_measured.set_ydata(z1d_measured * 1e6)
+        if z1d_fit is not None:
+            self.z1d_fit_um = z1d_fit * 1e6
+            self.line_fit.set_ydata(self.z1d_fit_um)
+        if z1d_measured is not None or z1d_fit is not None:
+            self.ax_height.relim()
+            self.ax_height.autoscale_view()
+        if z1d_res is not None:
+            z1d_res_nm = z1d_res * 1e9
+            self.line_res.set_ydata(z1d_res_nm)
+            self.ax_res.relim()
+            self.ax_res.autoscale_view()
+            self.rms_text.set_text(f'Residual:\n{np.nanstd(z1d_res_nm):.2f} nm RMS')
+        if input_params_dict is not None:
+            # Show the missing optional parameters with the defaults of the fitting functions
+            str_param_name_list = ['p', 'q', 'theta',
+                                   'x_i', 'y_i', 'z_i', 
+                                   'alpha', 'beta', 'gamma']
+            input_params_dict = dict(zip(str_param_name_list, check_input_params(input_params_dict, self.x1d, np.zeros_like(self.x1d), np.zeros_like(self.x1d))))
+            for text, s in zip(self.input_text_list, parameter_to_string_1d(input_params_dict)):
+                text.set_text(s)
+        if opt_params_ci_dict is not None:
+            self.is_optimized_dict = get_is_optimized_dict(opt_params_ci_dict)
+        if opt_params_dict is not None:
+            for text, s in zip(self.opt_text_list, parameter_to_string_1d(opt_params_dict, self.is_optimized_dict)):
+                text.set_text(s)
+            if self.z1d_fit_um is not None:
+                # Interpolate for marker at fitted x_i
+                interp_func = interp1d(self.x1d_mm, self.z1d_fit_um, bounds_error=False, fill_value="extrapolate")
+                self.marker.set_data([opt_params_dict['x_i']*1e3], [interp_func(opt_params_dict['x_i']*1e3)])
+
+    def refresh(self):
+        """
+        Redraw the figure and process the pending GUI events
+        """
+
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+    def make_fit_callback(self, model, z1d_measured, opt_or_tol_dict: dict = None, min_interval: float = 0.1):
+        """
+        Make the ``callback`` of a fitting function to follow the optimizer, see ``FittingMapViewer.make_fit_callback``
+
+        The last iterations may be skipped: call ``update`` with the returned fit, residual 
+        and parameters, and ``refresh``, to show the final result.
+
+        Parameters
+        ----------
+            model: `function` or `str`
+                The 1D height fitting function or its name, e.g. ``'concave_ellipse_height'``
+            z1d_measured: `numpy.ndarray`
+                1D array of measured z-values at the x-coordinates of the viewer
+            opt_or_tol_dict: `dict`
+                The ``opt_dict`` or ``tol_dict`` of the fit, to mark the optimized parameters
+            min_interval: `float`
+                The minimum time between two refreshes in seconds
+        Returns
+        -------
+            callback: `function`
+                The function to pass as ``callback`` to the fitting function
+        """
+
+        surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+        str_param_name_list = ['p', 'q', 'theta',
+                               'x_i', 'y_i', 'z_i', 
+                               'alpha', 'beta', 'gamma']
+        self.is_optimized_dict = get_is_optimized_dict(opt_or_tol_dict=opt_or_tol_dict, surface_generation_function=surface_generation_function)
+        self.update(z1d_measured=z1d_measured)
+        self.refresh()
+        refresh_state = {'time': -np.inf}
+
+        def callback(intermediate_result):
+            if time.perf_counter() - refresh_state['time'] < min_interval:
+                return
+            params_dict = intermediate_result['params_dict']
+            params = np.array([params_dict[name] for name in str_param_name_list])
+            z1d_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, 
+                                                   self.x1d, None, params, z1d_measured)
+            self.update(z1d_fit=z1d_fit, z1d_res=z1d_measured - z1d_fit, opt_params_dict=params_dict)
+            self.refresh()
+            refresh_state['time'] = time.perf_counter()
+
+        return callback
+
+    def close(self):
+        """
+        Close the figure
+        """
+
+        plt.close(self.fig)
@@ -0,0 +1,306 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import sqlite3
+import time
+import warnings
+import numpy as np
+
+from xmf.layer_02_generation import (
+    generate_1d_height,
+    generate_1d_slope,
+    resolve_grid,
+)
+
+from xmf.layer_03_optimization import check_input_params, check_opt_dict, check_tol_dict
+from xmf.layer_04_fit import get_fit_model, get_fit_function
+
+str_param_name_list = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
+
+
+def connect_parameter_history(db_path: str):
+    """
+    Connect to the SQLite store of the fitted parameters, creating the table if needed
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+    Returns
+    -------
+        connection: `sqlite3.Connection`
+            The connection in autocommit mode
+    """
+
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.execute("""CREATE TABLE IF NOT EXISTS fits (
+        id INTEGER PRIMARY KEY,
+        mirror_id TEXT,
+        model TEXT,
+        time REAL,
+        params TEXT,
+        params_ci TEXT,
+        rms REAL,
+        drifted INTEGER DEFAULT 0)""")
+    connection.execute("CREATE INDEX IF NOT EXISTS fits_mirror_model ON fits (mirror_id, model, id)")
+    return connection
+
+
+def record_fit_params(db_path: str,
+                      mirror_id: str,
+                      model,
+                      opt_params_dict: dict,
+                      opt_params_ci_dict: dict,
+                      rms: float,
+                      drifted: bool = False):
+    """
+    Add the fitted parameters of a mirror to the store
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+        mirror_id: `str`
+            The mirror ID or serial number
+        model: `function` or `str`
+            The fitting function or its name
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        rms: `float`
+            The residual RMS
+        drifted: `bool`
+            If True, the fit drifted far from the previous one
+    """
+
+    params = {name: float(val) for name, val in opt_params_dict.items()}
+    params_ci = {name: [float(val) for val in np.ravel(ci)] for name, ci in opt_params_ci_dict.items()}
+    connection = connect_parameter_history(db_path)
+    try:
+        connection.execute("INSERT INTO fits (mirror_id, model, time, params, params_ci, rms, drifted) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (str(mirror_id), get_fit_function(model).__name__, time.time(), json.dumps(params), json.dumps(params_ci), float(rms), int(drifted)))
+    finally:
+        connection.close()
+
+
+def get_parameter_history(db_path: str, mirror_id: str, model=None):
+    """
+    Get the fitted parameters of a mirror from the oldest to the latest
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+        mirror_id: `str`
+            The mirror ID or serial number
+        model: `function` or `str`
+            The fitting function or its name. If None, the fits of all the models are returned.
+    Returns
+    -------
+        record_list: `list`
+            The ``model``, ``time``, ``params``, ``params_ci``, ``rms`` and ``drifted`` of each fit
+    """
+
+    connection = connect_parameter_history(db_path)
+    try:
+        query = "SELECT model, time, params, params_ci, rms, drifted FROM fits WHERE mirror_id = ?"
+        args = (str(mirror_id),)
+        if model is not None:
+            query += " AND model = ?"
+            args += (get_fit_function(model).__name__,)
+        rows = connection.execute(query + " ORDER BY id", args).fetchall()
+    finally:
+        connection.close()
+
+    return [{'model': model_name, 'time': fit_time, 'params': json.loads(params), 'params_ci': json.loads(params_ci), 'rms': rms, 'drifted': bool(drifted)}
+            for model_name, fit_time, params, params_ci, rms, drifted in rows]
+
+
+def get_last_fit_params(db_path: str, mirror_id: str, model):
+    """
+    Get the latest fitted parameters of a mirror with a model, skipping the drifted fits
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path
+        mirror_id: `str`
+            The mirror ID or serial number
+        model: `function` or `str`
+            The fitting function or its name
+    Returns
+    -------
+        record: `dict`
+            The latest record, see ``get_parameter_history``, or None if there is none
+    """
+
+    record_list = [record for record in get_parameter_history(db_path, mirror_id, model) if not record['drifted']]
+    return record_list[-1] if record_list else None
+
+
+def find_drifted_params(opt_params_dict: dict, opt_params_ci_dict: dict, record: dict, max_drift: float, name_list: list):
+    """
+    Find the parameters which drift from a previous fit by more than ``max_drift`` combined standard deviations
+
+    Parameters
+    ----------
+        opt_params_dict: `dict`
+            The new optimized parameters
+        opt_params_ci_dict: `dict`
+            The new ±2σ confidence intervals
+        record: `dict`
+            The previous record from ``get_last_fit_params``
+        max_drift: `float`
+            The allowed drift in the combined standard deviations of both fits
+        name_list: `list`
+            The names of the checked parameters
+    Returns
+    -------
+        drifted_name_list: `list`
+            The names of the drifted parameters
+    """
+
+    drifted_name_list = []
+    for name in name_list:
+        sigma_new = np.diff(np.ravel(opt_params_ci_dict[name]))[0] / 4
+        sigma_old = np.diff(record['params_ci'][name])[0] / 4
+        sigma = np.sqrt(sigma_new**2 + sigma_old**2)
+        if np.isfinite(sigma) and abs(opt_params_dict[name] - record['params'][name]) > max_drift * sigma:
+            drifted_name_list.append(name)
+    return drifted_name_list
+
+
+def fit_with_history(db_path: str,
+                     mirror_id: str,
+                     model,
+                     x,
+                     y,
+                     v: np.ndarray,
+                     input_params_dict: dict,
+                     opt_or_tol_dict: dict,
+                     max_drift: float = 10,
+                     record: bool = True,
+                     **kwargs):
+    """
+    Fit a measurement starting from the latest fitted parameters of the same mirror
+
+    The optimized parameters start from the latest fit of the mirror with the same model, 
+    while the fixed ones keep the values of ``input_params_dict``. With a ``tol_dict``, 
+    the tolerances still apply around the design values, and a previous value outside them 
+    is not used. If ``p``, ``q`` or ``theta`` drifts by more than ``max_drift`` combined 
+    standard deviations from the previous fit, the fit is repeated from the design values 
+    and the result with the lower residual RMS is kept, with a warning.
+
+    Parameters
+    ----------
+        db_path: `str`
+            The SQLite file path of the store
+        mirror_id: `str`
+            The mirror ID or serial number
+        model: `function` or `str`
+            The fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+        x: `numpy.ndarray` or `RegularGrid`
+            The x coordinates or the grid
+        y: `numpy.ndarray`
+            The y coordinates, None for a grid or a 1D profile
+        v: `numpy.ndarray`
+            The measured height or slope
+        input_params_dict: `dict`
+            The design parameters
+        opt_or_tol_dict: `dict`
+            The optimization flags or tolerances
+        max_drift: `float`
+            The allowed drift of ``p``, ``q`` and ``theta`` in combined standard deviations
+        record: `bool`
+            If True, the new fit is added to the store
+        kwargs:
+            The additional options passed to the fitting function
+    Returns
+    -------
+        v_res: `numpy.ndarray`
+            The residual
+        v_fit: `numpy.ndarray`
+            The fitting result
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters
+    """
+
+    fit_function = get_fit_function(model)
+    surface_generation_function, _ = get_fit_model(model)
+    is_1d = surface_generation_function in (generate_1d_height, generate_1d_slope)
+
+    def run_fit(params_dict, fit_opt_or_tol_dict):
+        if is_1d:
+            return fit_function(x, v, params_dict, fit_opt_or_tol_dict, **kwargs)
+        return fit_function(x, y, v, params_dict, fit_opt_or_tol_dict, **kwargs)
+
+    last_record = get_last_fit_params(db_path, mirror_id, fit_function)
+    if last_record is None:
+        result = run_fit(input_params_dict, opt_or_tol_dict)
+        drifted_name_list = []
+    else:
+        # Start the optimized parameters from the previous fit
+        x_resolved, y_resolved = resolve_grid(x, x if is_1d else y) # y_i is not used for a 1D profile
+        design_params = check_input_params(input_params_dict, x_resolved, y_resolved, v)
+        params_dict = dict(input_params_dict)
+        if isinstance(opt_or_tol_dict['p'], bool):
+            opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+            for idx, name in enumerate(str_param_name_list):
+                if opt_vector[idx]:
+                    params_dict[name] = last_record['params'][name]
+            warm_opt_or_tol_dict = opt_or_tol_dict
+        else:
+            # Shift the tolerances to keep the same boundaries around the design values
+            opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+            warm_opt_or_tol_dict = {}
+            for idx, name in enumerate(str_param_name_list):
+                shift = last_record['params'][name] - design_params[idx]
+                if opt_vector[idx] and tol_vector[idx, 0] <= shift <= tol_vector[idx, 1]:
+                    params_dict[name] = last_record['params'][name]
+                    warm_opt_or_tol_dict[name] = tol_vector[idx] - shift
+                else:
+                    warm_opt_or_tol_dict[name] = tol_vector[idx]
+        result = run_fit(params_dict, warm_opt_or_tol_dict)
+
+        # Check the shape parameters against the previous fit
+        drifted_name_list = find_drifted_params(result[2], result[3], last_record, max_drift, ['p', 'q', 'theta'])
+        if drifted_name_list:
+            result_design = run_fit(input_params_dict, opt_or_tol_dict)
+            if np.nanstd(result_design[0]) < np.nanstd(result[0]):
+                result = result_design
+            drifted_name_list = find_drifted_params(result[2], result[3], last_record, max_drift, drifted_name_list)
+            if drifted_name_list:
+                warnings.warn(f"The fitted {', '.join(drifted_name_list)} of {mirror_id} drift by more than {max_drift} σ from the previous fit.")
+
+    if record:
+        record_fit_params(db_path, mirror_id, fit_function, result[2], result[3], np.nanstd(result[0]), bool(drifted_name_list))
+
+    return result
@@ -0,0 +1,278 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import numpy as np
+from dataclasses import dataclass, field
+from scipy.io import loadmat
+
+from xmf.layer_02_generation import RegularGrid
+
+# The variable names of the coordinates and the measurement in the sample files
+x_name_list = ['x2d', 'x1d', 'x']
+y_name_list = ['y2d', 'y1d', 'y']
+v_name_list = ['z2d', 'sx2d', 'z1d', 'sx1d', 'v']
+str_param_name_list = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
+
+
+@dataclass
+class Measurement:
+    """
+    A measured height or slope map with its coordinates and target parameters
+
+    Parameters
+    ----------
+        x: `numpy.ndarray`
+            The x coordinates in C order or memory-mapped, 1D for a profile
+        y: `numpy.ndarray`
+            The y coordinates of a 2D map, None for a profile
+        v: `numpy.ndarray`
+            The measured height or slope
+        params_target: `dict`
+            The target ``p``, ``q``, ``theta``, etc. as floats, usable as ``input_params_dict``
+        quantity: `str`
+            ``'height'`` or ``'slope'``
+        path: `str`
+            The file the measurement is loaded from
+    """
+
+    x: np.ndarray
+    y: np.ndarray
+    v: np.ndarray
+    params_target: dict = field(default_factory=dict)
+    quantity: str = 'height'
+    path: str = None
+
+    @property
+    def is_2d(self):
+        """True for a 2D map"""
+        return self.y is not None
+
+    def to_grid(self):
+        """
+        Get the coordinates of a meshgrid map as a ``RegularGrid``
+
+        Returns
+        -------
+            grid: `RegularGrid`
+                The grid with the axes of the map
+        """
+
+        return RegularGrid.from_meshgrid(self.x, self.y)
+
+
+def as_c_array(val, mmap: bool = False):
+    """
+    Convert the loaded array to float64 in C order, keeping memory maps as they are
+
+    Parameters
+    ----------
+        val: `numpy.ndarray`
+            The loaded array
+        mmap: `bool`
+            If True, a memory-mapped array is kept without copy
+    Returns
+    -------
+        val: `numpy.ndarray`
+            The array in C order
+    """
+
+    if mmap and isinstance(val, np.memmap):
+        return val
+    return np.ascontiguousarray(val, dtype=float)
+
+
+def params_from_record(record):
+    """
+    Convert the target parameters in a structured array or a mapping to a dict of floats
+
+    Parameters
+    ----------
+        record: `numpy.ndarray` or `dict`
+            The MATLAB struct loaded by ``scipy.io.loadmat``, a structured array or a dict
+    Returns
+    -------
+        params_dict: `dict`
+            The parameters in the order of ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, 
+            ``alpha``, ``beta``, ``gamma``
+    """
+
+    if isinstance(record, (np.ndarray, np.void)):
+        names = record.dtype.names or ()
+        record = {name: record[name] for name in names}
+    return {name: float(np.ravel(np.asarray(record[name], dtype=float))[0])
+            for name in str_param_name_list if name in record}
+
+
+def measurement_from_arrays(arrays: dict, params_target: dict, path: str, mmap: bool = False):
+    """
+    Pick the coordinates and the measurement from the named arrays of a file
+
+    Parameters
+    ----------
+        arrays: `dict`
+            The arrays by variable name
+        params_target: `dict`
+            The target parameters
+        path: `str`
+            The file path
+        mmap: `bool`
+            If True, the memory-mapped arrays are kept without copy
+    Returns
+    -------
+        measurement: `Measurement`
+            The measurement
+    """
+
+    def pick(name_list):
+        for name in name_list:
+            if name in arrays:
+                return name, arrays[name]
+        return None, None
+
+    _, x = pick(x_name_list)
+    _, y = pick(y_name_list)
+    v_name, v = pick(v_name_list)
+    if x is None or v is None:
+        raise ValueError(f"{path} does not contain the coordinates {x_name_list} and the measurement {v_name_list}.")
+
+    # Profiles saved as column vectors
+    if np.ndim(v) == 2 and 1 in np.shape(v) and y is None:
+        x, v = np.ravel(x), np.ravel(v)
+
+    return Measurement(x=as_c_array(x, mmap),
+                       y=None if y is None else as_c_array(y, mmap),
+                       v=as_c_array(v, mmap),
+                       params_target=params_target,
+                       quantity='slope' if v_name.startswith('s') else 'height',
+                       path=path)
+
+
+def load_measurement(path: str, mmap: bool = True):
+    """
+    Load a measurement from a ``.mat``, ``.npz`` or HDF5 file, or a directory of ``.npy`` files
+
+    The coordinates are named ``x2d``/``y2d`` or ``x1d``, and the measurement ``z2d``, 
+    ``z1d`` or ``sx1d`` as in the sample files. The target parameters are the 
+    ``params_target`` struct (``.mat``), structured array (``.npz``, ``.npy``) or group (HDF5). 
+    The arrays are converted to float64 in C order once here instead of in every 
+    iteration of the fit. The ``.npy`` files are memory-mapped if ``mmap`` is True.
+
+    Parameters
+    ----------
+        path: `str`
+            The file or directory path
+        mmap: `bool`
+            If True, the ``.npy`` files are memory-mapped instead of loaded
+    Returns
+    -------
+        measurement: `Measurement`
+            The measurement
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if os.path.isdir(path):
+        arrays = {}
+        params_target = {}
+        for file_name in sorted(os.listdir(path)):
+            name, file_ext = os.path.splitext(file_name)
+            if file_ext.lower() != '.npy':
+                continue
+            val = np.load(os.path.join(path, file_name), mmap_mode='r' if mmap else None)
+            if name == 'params_target':
+                params_target = params_from_record(np.asarray(val))
+            else:
+                arrays[name] = val
+        return measurement_from_arrays(arrays, params_target, path, mmap)
+
+    if ext == '.mat':
+        mat = loadmat(path)
+        params_target = params_from_record(mat['params_target'][0, 0]) if 'params_target' in mat else {}
+        return measurement_from_arrays(mat, params_target, path)
+
+    if ext == '.npz':
+        with np.load(path) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        params_target = params_from_record(arrays.pop('params_target')) if 'params_target' in arrays else {}
+        return measurement_from_arrays(arrays, params_target, path)
+
+    if ext in ('.h5', '.hdf5'):
+        try:
+            import h5py
+        except ImportError as err:
+            raise ImportError("h5py is required to load HDF5 files.") from err
+        with h5py.File(path, 'r') as h5:
+            arrays = {name: h5[name][()] for name in h5 if isinstance(h5[name], h5py.Dataset)}
+            params_target = {}
+            if 'params_target' in h5:
+                group = h5['params_target']
+                params_target = params_from_record({**group.attrs, **{name: group[name][()] for name in group}})
+        return measurement_from_arrays(arrays, params_target, path)
+
+    raise ValueError(f"Unsupported measurement file: {path}. Use .mat, .npz, .h5, .hdf5 or a directory of .npy files.")
+
+
+def save_measurement(path: str, measurement: Measurement):
+    """
+    Save a measurement to a ``.npz`` or HDF5 file, or a directory of ``.npy`` files
+
+    Parameters
+    ----------
+        path: `str`
+            The ``.npz``, ``.h5`` or ``.hdf5`` file path, or a directory path for ``.npy`` files
+        measurement: `Measurement`
+            The measurement
+    """
+
+    is_slope = measurement.quantity == 'slope'
+    if measurement.is_2d:
+        arrays = {'x2d': measurement.x, 'y2d': measurement.y, 'sx2d' if is_slope else 'z2d': measurement.v}
+    else:
+        arrays = {'x1d': measurement.x, 'sx1d' if is_slope else 'z1d': measurement.v}
+    names = [name for name in str_param_name_list if name in measurement.params_target]
+    params_target = np.array(tuple(measurement.params_target[name] for name in names), dtype=[(name, float) for name in names])
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npz':
+        np.savez(path, params_target=params_target, **arrays)
+    elif ext in ('.h5', '.hdf5'):
+        try:
+            import h5py
+        except ImportError as err:
+            raise ImportError("h5py is required to save HDF5 files.") from err
+        with h5py.File(path, 'w') as h5:
+            for name, val in arrays.items():
+                h5.create_dataset(name, data=val)
+            group = h5.create_group('params_target')
+            for name in names:
+                group.attrs[name] = measurement.params_target[name]
+    elif ext == '':
+        os.makedirs(path, exist_ok=True)
+        for name, val in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(val))
+        np.save(os.path.join(path, 'params_target.npy'), params_target)
+    else:
+        raise ValueError(f"Unsupported measurement file: {path}. Use .npz, .h5, .hdf5 or a directory path.")
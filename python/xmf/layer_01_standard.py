@@ -25,6 +25,45 @@
 
 import numpy as np
 
+from xmf.profiling import profiled
+
+def quad_sln_sign(p, q):
+    """
+    The sign of the square root in the quadratic solution with (``p``, ``q``)
+
+    Parameters
+    ----------
+        p: `float` or `numpy.ndarray`
+            The ``p`` value: the distance from the source to the chief ray intersection
+        q: `float` or `numpy.ndarray`
+            The ``q`` value: the distance from the chief ray intersection to the focus
+    Returns
+    -------
+        sign: `float` or `numpy.ndarray`
+            +1 for the convex shapes, -1 for the concave shapes
+    """
+
+    if np.ndim(p) == 0 and np.ndim(q) == 0:
+        if (p < 0 and q < 0): # Top (convex) quadric
+            return 1.0
+        elif (p > 0 and q > 0): # Bottom (concave) quadric
+            return -1.0
+        elif (p < 0 and q > 0): # Left quadric
+            return 1.0 if abs(p) <= abs(q) else -1.0
+        elif (p > 0 and q < 0): # Right quadric
+            return 1.0 if abs(p) >= abs(q) else -1.0
+        return np.nan
+
+    conditions = [(p < 0) & (q < 0), # Top (convex) quadric
+                  (p > 0) & (q > 0), # Bottom (concave) quadric
+                  (p < 0) & (q > 0), # Left quadric: convex if abs(p) <= abs(q)
+                  (p > 0) & (q < 0)] # Right quadric: convex if abs(p) >= abs(q)
+    choices = [1.0,
+               -1.0,
+               np.where(abs(p) <= abs(q), 1.0, -1.0),
+               np.where(abs(p) >= abs(q), 1.0, -1.0)]
+    return np.select(conditions, choices, np.nan)
+
 def standard_quadrics_height(x2d: np.ndarray,
                              y2d: np.ndarray,
                              p: float,
@@ -68,21 +107,8 @@ def standard_quadrics_height(x2d: np.ndarray,
         # Discriminant
         Delta = B**2 - 4*A*C
 
-        # Check (p, q) conditions
-        if (p < 0 and q < 0): # Top (convex) ellipsoid
-            z2d_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-        elif (p > 0 and q > 0): # Bottom (concave) ellipsoid
-            z2d_quad_sln = (-B - np.sqrt(Delta))/(2*A)
-        elif (p < 0 and q > 0): # Left hyperboloid
-            if (abs(p) <= abs(q)): # Left convex hyperboloid
-                z2d_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-            else: # Left concave hyperboloid
-                z2d_quad_sln = (-B - np.sqrt(Delta))/(2*A)
-        elif (p > 0 and q < 0): # Right hyperboloid
-            if (abs(p) >= abs(q)): # Right convex hyperboloid
-                z2d_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-            else: # Right concave hyperboloid
-                z2d_quad_sln = (-B - np.sqrt(Delta))/(2*A)
+        # Check (p, q) conditions: convex (+) or concave (-) root
+        z2d_quad_sln = (-B + quad_sln_sign(p, q)*np.sqrt(Delta))/(2*A)
 
         z2d_quad_sln[Delta<0] = np.nan
         
@@ -114,10 +140,8 @@ def standard_quadrics_height(x2d: np.ndarray,
                               p: float,
                               q: float,
                               theta: float):
-        if (p*q>0): # Ellipsoid
-            z2d_expression = (p+q)*np.sin(theta)*(-x2d*(p-q)*np.cos(theta) + 2*p*q - np.sqrt(-4*p*q*x2d**2 - 4*p*q*(p-q)*x2d*np.cos(theta) + 4*p**2*q**2 - ((p+q)**2-(p-q)**2*np.sin(theta)**2)*y2d**2/np.sin(theta)**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
-        elif (p*q < 0): # Hyperboloid
-            z2d_expression = (p+q)*np.sin(theta)*(-x2d*(p-q)*np.cos(theta) + 2*p*q + np.sqrt(-4*p*q*x2d**2 - 4*p*q*(p-q)*x2d*np.cos(theta) + 4*p**2*q**2 - ((p+q)**2-(p-q)**2*np.sin(theta)**2)*y2d**2/np.sin(theta)**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
+        # Ellipsoid (p*q>0) or hyperboloid (p*q<0)
+        z2d_expression = (p+q)*np.sin(theta)*(-x2d*(p-q)*np.cos(theta) + 2*p*q - np.sign(p*q)*np.sqrt(-4*p*q*x2d**2 - 4*p*q*(p-q)*x2d*np.cos(theta) + 4*p**2*q**2 - ((p+q)**2-(p-q)**2*np.sin(theta)**2)*y2d**2/np.sin(theta)**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
 
         z2d_expression[np.imag(z2d_expression)!=0] = np.nan
 
@@ -132,6 +156,7 @@ def standard_quadrics_height(x2d: np.ndarray,
         return z2d_quad_sln
 
 
+@profiled
 def standard_convex_ellipsoid_height(x2d: np.ndarray,
                                      y2d: np.ndarray,
                                      abs_p: float,
@@ -167,6 +192,7 @@ def standard_convex_ellipsoid_height(x2d: np.ndarray,
     return standard_quadrics_height(x2d, y2d, p, q, theta, return_z2d_expression_as_extra)
     
     
+@profiled
 def standard_concave_ellipsoid_height(x2d: np.ndarray,
                                       y2d: np.ndarray,
                                       abs_p: float,
@@ -201,6 +227,7 @@ def standard_concave_ellipsoid_height(x2d: np.ndarray,
     q = abs_q
     return standard_quadrics_height(x2d, y2d, p, q, theta, return_z2d_expression_as_extra)
 
+@profiled
 def standard_convex_hyperboloid_height(x2d: np.ndarray,
                                        y2d: np.ndarray,
                                        abs_p: float,
@@ -231,15 +258,12 @@ def standard_convex_hyperboloid_height(x2d: np.ndarray,
     """
 
     # Give the sign to p and q based on mirror type
-    if (abs_p > abs_q):
-        p = abs_p
-        q = - abs_q
-    else:
-        p = - abs_p
-        q = abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), abs_p, - abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), - abs_q, abs_q)
 
     return standard_quadrics_height(x2d, y2d, p, q, theta, return_z2d_expression_as_extra)
 
+@profiled
 def standard_concave_hyperboloid_height(x2d: np.ndarray,
                                         y2d: np.ndarray,
                                         abs_p: float,
@@ -270,12 +294,8 @@ def standard_concave_hyperboloid_height(x2d: np.ndarray,
     """
 
     # Give the sign to p and q based on mirror type
-    if (abs_p > abs_q):
-        p = - abs_p
-        q = abs_q
-    else:
-        p = abs_p
-        q = - abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), - abs_p, abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), abs_q, - abs_q)
 
     return standard_quadrics_height(x2d, y2d, p, q, theta, return_z2d_expression_as_extra)
 
@@ -318,21 +338,7 @@ def standard_quadric_cylinder_height(x: np.ndarray,
         # Discriminant
         Delta = B**2 - 4*A*C
 
-        if (p < 0 and q < 0): # Top (convex) elliptic cylinder
-            z_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-        elif (p > 0 and q > 0): # Bottom (concave) elliptic cylinder
-            z_quad_sln = (-B - np.sqrt(Delta))/(2*A)
-        elif (p < 0 and q > 0): # Left hyperbolic cylinder
-            if (abs(p) <= abs(q)): # Left convex hyperbolic cylinder
-                z_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-            else: # Left concave hyperbolic cylinder
-                z_quad_sln = (-B - np.sqrt(Delta))/(2*A)
-        elif (p > 0 and q < 0): # Right hyperbolic cylinder
-            if (abs(p) >= abs(q)): # Right convex hyperbolic cylinder
-                z_quad_sln = (-B + np.sqrt(Delta))/(2*A)
-            else: # Right concave hyperbolic cylinder
-                z_quad_sln = (-B - np.sqrt(Delta))/(2*A)
-
+        z_quad_sln = (-B + quad_sln_sign(p, q)*np.sqrt(Delta))/(2*A)
         z_quad_sln[Delta<0] = np.nan
 
         return z_quad_sln
@@ -342,10 +348,8 @@ def standard_quadric_cylinder_height(x: np.ndarray,
                    p: float,
                    q: float,
                    theta: float):
-        if (p*q>0): # Elliptical cylinder
-            z_expression = (p+q)*np.sin(theta)*(-x*(p-q)*np.cos(theta) + 2*p*q - np.sqrt(-4*p*q*x**2 - 4*p*q*(p-q)*x*np.cos(theta) + 4*p**2*q**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
-        elif (p*q < 0): # Hyperbolic cylinder
-            z_expression = (p+q)*np.sin(theta)*(-x*(p-q)*np.cos(theta) + 2*p*q + np.sqrt(-4*p*q*x**2 - 4*p*q*(p-q)*x*np.cos(theta) + 4*p**2*q**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
+        # Minus root for elliptical cylinder (p*q > 0), plus root for hyperbolic cylinder (p*q < 0)
+        z_expression = (p+q)*np.sin(theta)*(-x*(p-q)*np.cos(theta) + 2*p*q - np.sign(p*q)*np.sqrt(-4*p*q*x**2 - 4*p*q*(p-q)*x*np.cos(theta) + 4*p**2*q**2))/((p+q)**2-(p-q)**2*np.sin(theta)**2)
 
         z_expression[np.imag(z_expression)!=0] = np.nan
 
@@ -359,6 +363,7 @@ def standard_quadric_cylinder_height(x: np.ndarray,
     else:
         return z_quad_sln
 
+@profiled
 def standard_convex_elliptic_cylinder_height(x: np.ndarray,
                                              abs_p: float,
                                              abs_q: float,
@@ -392,6 +397,7 @@ def standard_convex_elliptic_cylinder_height(x: np.ndarray,
 
     return standard_quadric_cylinder_height(x, p, q, theta, return_z_expression_as_extra)
 
+@profiled
 def standard_concave_elliptic_cylinder_height(x: np.ndarray,
                                               abs_p: float,
                                               abs_q: float,
@@ -424,6 +430,7 @@ def standard_concave_elliptic_cylinder_height(x: np.ndarray,
 
     return standard_quadric_cylinder_height(x, p, q, theta, return_z_expression_as_extra)
 
+@profiled
 def standard_convex_hyperbolic_cylinder_height(x: np.ndarray,
                                                abs_p: float,
                                                abs_q: float,
@@ -449,15 +456,12 @@ def standard_convex_hyperbolic_cylinder_height(x: np.ndarray,
         z2d: `numpy.ndarray`
             The 2D height map
     """
-    if abs(abs_p) > abs(abs_q):
-        p = abs_p
-        q = - abs_q
-    else:
-        p = - abs_p
-        q = abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), abs_p, - abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), - abs_q, abs_q)
 
     return standard_quadric_cylinder_height(x, p, q, theta, return_z_expression_as_extra)
 
+@profiled
 def standard_concave_hyperbolic_cylinder_height(x: np.ndarray,
                                                 abs_p: float,
                                                 abs_q: float,
@@ -484,12 +488,8 @@ def standard_concave_hyperbolic_cylinder_height(x: np.ndarray,
         z2d: `numpy.ndarray`
             The 2D height map
     """
-    if abs(abs_p) > abs(abs_q):
-        p = - abs_p
-        q = abs_q
-    else:
-        p = abs_p
-        q = - abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), - abs_p, abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), abs_q, - abs_q)
 
     return standard_quadric_cylinder_height(x, p, q, theta, return_z_expression_as_extra)
 
@@ -516,14 +516,13 @@ def standard_quadric_cylinder_xslope(x: np.ndarray,
         sx: `numpy.ndarray`
             The x-slope
     """
-    if (p*q>0): # Elliptic cylinder
-        sx = (p+q)*np.sin(theta)/((p+q)**2-(p-q)**2*np.sin(theta)**2)*(-(p-q)*np.cos(theta) + (2*p*q*x + p*q*(p-q)*np.cos(theta))/np.sqrt(-p*q*x**2 - p*q*(p-q)*x*np.cos(theta) + p**2*q**2))
-    elif (p*q<0): # Hyperbolic cylinder
-        sx = (p+q)*np.sin(theta)/((p+q)**2-(p-q)**2*np.sin(theta)**2)*(-(p-q)*np.cos(theta) - (2*p*q*x + p*q*(p-q)*np.cos(theta))/np.sqrt(-p*q*x**2 - p*q*(p-q)*x*np.cos(theta) + p**2*q**2))
+    # Plus sign for elliptic cylinder (p*q > 0), minus sign for hyperbolic cylinder (p*q < 0)
+    sx = (p+q)*np.sin(theta)/((p+q)**2-(p-q)**2*np.sin(theta)**2)*(-(p-q)*np.cos(theta) + np.sign(p*q)*(2*p*q*x + p*q*(p-q)*np.cos(theta))/np.sqrt(-p*q*x**2 - p*q*(p-q)*x*np.cos(theta) + p**2*q**2))
     sx[np.imag(sx)!=0] = np.nan
 
     return sx
 
+@profiled
 def standard_convex_elliptic_cylinder_xslope(x: np.ndarray,
                                              abs_p: float,
                                              abs_q: float,
@@ -553,6 +552,7 @@ def standard_convex_elliptic_cylinder_xslope(x: np.ndarray,
     sx_expression_quadrics = standard_quadric_cylinder_xslope(x, p, q, theta)
     return sx_expression_quadrics
 
+@profiled
 def standard_concave_elliptic_cylinder_xslope(x: np.ndarray,
                                               abs_p: float,
                                               abs_q: float,
@@ -582,6 +582,7 @@ def standard_concave_elliptic_cylinder_xslope(x: np.ndarray,
     sx_expression_quadrics = standard_quadric_cylinder_xslope(x, p, q, theta)
     return sx_expression_quadrics
 
+@profiled
 def standard_convex_hyperbolic_cylinder_xslope(x: np.ndarray,
                                                abs_p: float,
                                                abs_q: float,
@@ -605,16 +606,13 @@ def standard_convex_hyperbolic_cylinder_xslope(x: np.ndarray,
         sx: `numpy.ndarray`
             The x-slope
     """
-    if abs(abs_p) > abs(abs_q):
-        p = abs_p
-        q = - abs_q
-    else:
-        p = - abs_p
-        q = abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), abs_p, - abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), - abs_q, abs_q)
 
     sx_expression_quadrics = standard_quadric_cylinder_xslope(x, p, q, theta)
     return sx_expression_quadrics
 
+@profiled
 def standard_concave_hyperbolic_cylinder_xslope(x: np.ndarray,
                                                 abs_p: float,
                                                 abs_q: float,
@@ -638,17 +636,14 @@ def standard_concave_hyperbolic_cylinder_xslope(x: np.ndarray,
         sx: `numpy.ndarray`
             The x-slope
     """
-    if abs(abs_p) > abs(abs_q):
-        p = - abs_p
-        q = abs_q
-    else:
-        p = abs_p
-        q = - abs_q
+    p = np.where(abs(abs_p) > abs(abs_q), - abs_p, abs_p)
+    q = np.where(abs(abs_p) > abs(abs_q), abs_q, - abs_q)
 
     sx_expression_quadrics = standard_quadric_cylinder_xslope(x, p, q, theta)
     return sx_expression_quadrics
 
 
+@profiled
 def standard_sag_col_diaboloid_height(x2d: np.ndarray,
                                       y2d: np.ndarray,
                                       abs_p: float,
@@ -692,6 +687,7 @@ def standard_sag_col_diaboloid_height(x2d: np.ndarray,
     return z_quad_sln
 
 
+@profiled
 def standard_tan_col_diaboloid_height(x2d: np.ndarray,
                                       y2d: np.ndarray,
                                       abs_p: float,
@@ -756,4 +752,123 @@ def standard_tan_col_diaboloid_height(x2d: np.ndarray,
     # S[np.logical_not(mask)] = S2[np.logical_not(mask)]
     
     z2d = -b/4 - S + 0.5*np.sqrt(-4*S**2 - 2*k + m/S)
-    return z2d
\ No newline at end of file
+    return z2d
+
+class StandardHeightSurrogate:
+    """
+    The bicubic spline surrogate of a standard 2D height function with fixed (``abs_p``, ``abs_q``, ``theta``)
+
+    The spline is built once over the footprint in standard mirror coordinates,
+    refining the nodes until the maximum difference to the exact function at the
+    cell centres, where the interpolation error is the largest, is below ``tol``.
+    The surrogate has the same signature as the standard 2D height functions, and
+    the exact function is used for the points outside the footprint or for 
+    different (``abs_p``, ``abs_q``, ``theta``).
+
+    Parameters
+    ----------
+        standard_height_function: `function`
+            The standard 2D height function
+        x_range: `tuple`
+            The minimum and maximum x coordinates of the footprint
+        y_range: `tuple`
+            The minimum and maximum y coordinates of the footprint
+        abs_p: `float`
+            The ``abs_p`` value: the absolute value of the distance between the source and the chief ray intersection
+        abs_q: `float`
+            The ``abs_q`` value: the absolute value of the distance between the chief ray intersection and the focus
+        theta: `float`
+            The grazing angle
+        tol: `float`
+            The maximum allowed difference to the exact function
+        max_num_nodes: `int`
+            The maximum number of spline nodes
+    """
+
+    def __init__(self,
+                 standard_height_function,
+                 x_range: tuple,
+                 y_range: tuple,
+                 abs_p: float,
+                 abs_q: float,
+                 theta: float,
+                 tol: float = 1e-11,
+                 max_num_nodes: int = 2**20):
+
+        from scipy.interpolate import RectBivariateSpline
+
+        self.standard_height_function = standard_height_function
+        self.x_range = (float(np.min(x_range)), float(np.max(x_range)))
+        self.y_range = (float(np.min(y_range)), float(np.max(y_range)))
+        self.params = (abs_p, abs_q, theta)
+        self.tol = tol
+
+        # Start with the node spacing ratio of the footprint
+        x_num = 65
+        y_num = max(9, int(np.ceil(x_num * (self.y_range[1] - self.y_range[0]) / (self.x_range[1] - self.x_range[0]))))
+        while True:
+            x1d = np.linspace(*self.x_range, x_num)
+            y1d = np.linspace(*self.y_range, y_num)
+            z2d = np.real(standard_height_function(*np.meshgrid(x1d, y1d, indexing='ij'), abs_p, abs_q, theta))
+            if not np.all(np.isfinite(z2d)):
+                raise ValueError("The standard height function is not defined over the whole footprint.")
+            spline = RectBivariateSpline(x1d, y1d, z2d, kx=3, ky=3, s=0)
+
+            # Check the error at the cell centres
+            x2d_c, y2d_c = np.meshgrid((x1d[:-1] + x1d[1:])/2, (y1d[:-1] + y1d[1:])/2, indexing='ij')
+            z2d_c = np.real(standard_height_function(x2d_c, y2d_c, abs_p, abs_q, theta))
+            max_abs_error = np.max(np.abs(spline.ev(x2d_c, y2d_c) - z2d_c))
+            if max_abs_error <= tol:
+                break
+
+            # The error of the bicubic spline is reduced by 16 times when the nodes are doubled
+            num_doubling = max(1, int(np.ceil(np.log(max_abs_error / tol) / np.log(16))))
+            if ((x_num - 1) * 2**num_doubling + 1) * ((y_num - 1) * 2**num_doubling + 1) > max_num_nodes:
+                raise ValueError(f"The surrogate error {max_abs_error:.3g} cannot reach the tolerance {tol:.3g} with the maximum number of nodes.")
+            x_num = 2*x_num - 1
+            y_num = 2*y_num - 1
+
+        self.spline = spline
+        self.shape = (x_num, y_num)
+        self.max_abs_error = max_abs_error
+
+    def __call__(self,
+                 x2d: np.ndarray,
+                 y2d: np.ndarray,
+                 abs_p: float,
+                 abs_q: float,
+                 theta: float):
+        """
+        The surrogate 2D height with (``abs_p``, ``abs_q``, ``theta``)
+
+        Parameters
+        ----------
+            x2d: `numpy.ndarray`
+                The 2D x coordinates
+            y2d: `numpy.ndarray`
+                The 2D y coordinates
+            abs_p: `float`
+                The ``abs_p`` value: the absolute value of the distance between the source and the chief ray intersection
+            abs_q: `float`
+                The ``abs_q`` value: the absolute value of the distance between the chief ray intersection and the focus
+            theta: `float`
+                The grazing angle
+        Returns
+        -------
+            z2d: `numpy.ndarray`
+                The 2D height map
+        """
+
+        if (abs_p, abs_q, theta) != self.params:
+            return self.standard_height_function(x2d, y2d, abs_p, abs_q, theta)
+
+        x2d, y2d = np.broadcast_arrays(x2d, y2d)
+        is_inside = ((x2d >= self.x_range[0]) & (x2d <= self.x_range[1]) &
+                     (y2d >= self.y_range[0]) & (y2d <= self.y_range[1]))
+
+        z2d = np.full(x2d.shape, np.nan)
+        z2d[is_inside] = self.spline.ev(x2d[is_inside], y2d[is_inside])
+        if not np.all(is_inside):
+            is_outside = np.logical_not(is_inside)
+            z2d[is_outside] = np.real(self.standard_height_function(x2d[is_outside], y2d[is_outside], abs_p, abs_q, theta))
+        return z2d
@@ -23,8 +23,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
+import contextlib
+import functools
+import inspect
+import threading
+import tracemalloc
 import types
+import weakref
 import numpy as np
+from scipy.interpolate import CubicSpline
+
+from xmf.profiling import profiled, add_profile_count
 
 
 def compose_transformation_matrix(alpha: float,
@@ -56,19 +66,155 @@ def compose_transformation_matrix(alpha: float,
             The x-slope"
     """
 
-    R_x = np.array([1, 0, 0, 0, np.cos(alpha), -np.sin(alpha), 0, np.sin(alpha), np.cos(alpha)]).reshape(3, 3)
-    R_y = np.array([np.cos(beta), 0, np.sin(beta), 0, 1, 0, -np.sin(beta), 0, np.cos(beta)]).reshape(3, 3)
-    R_z = np.array([np.cos(gamma), -np.sin(gamma), 0, np.sin(gamma), np.cos(gamma), 0, 0, 0, 1]).reshape(3, 3)
+    if all(np.ndim(val) == 0 for val in (alpha, beta, gamma, x_i, y_i, z_i)):
+        R_x = np.array([1, 0, 0, 0, np.cos(alpha), -np.sin(alpha), 0, np.sin(alpha), np.cos(alpha)]).reshape(3, 3)
+        R_y = np.array([np.cos(beta), 0, np.sin(beta), 0, 1, 0, -np.sin(beta), 0, np.cos(beta)]).reshape(3, 3)
+        R_z = np.array([np.cos(gamma), -np.sin(gamma), 0, np.sin(gamma), np.cos(gamma), 0, 0, 0, 1]).reshape(3, 3)
+        R = R_z @ R_y @ R_x
+
+        t = np.array([x_i, y_i, z_i]).reshape(3, 1)
+
+        Rt = np.hstack((R, t))
+        T = np.vstack((Rt, [0, 0, 0, 1]))
+
+        return T
+
+    # Parameter arrays give a stack of transformation matrices in shape of (..., 4, 4)
+    alpha, beta, gamma, x_i, y_i, z_i = np.broadcast_arrays(alpha, beta, gamma, x_i, y_i, z_i)
+    batch_shape = alpha.shape
+    zero = np.zeros(batch_shape)
+    one = np.ones(batch_shape)
+
+    R_x = np.stack([one, zero, zero, zero, np.cos(alpha), -np.sin(alpha), zero, np.sin(alpha), np.cos(alpha)], axis=-1).reshape(batch_shape + (3, 3))
+    R_y = np.stack([np.cos(beta), zero, np.sin(beta), zero, one, zero, -np.sin(beta), zero, np.cos(beta)], axis=-1).reshape(batch_shape + (3, 3))
+    R_z = np.stack([np.cos(gamma), -np.sin(gamma), zero, np.sin(gamma), np.cos(gamma), zero, zero, zero, one], axis=-1).reshape(batch_shape + (3, 3))
     R = R_z @ R_y @ R_x
 
-    t = np.array([x_i, y_i, z_i]).reshape(3, 1)
+    t = np.stack([x_i, y_i, z_i], axis=-1).reshape(batch_shape + (3, 1))
 
-    Rt = np.hstack((R, t))
-    T = np.vstack((Rt, [0, 0, 0, 1]))
+    Rt = np.concatenate((R, t), axis=-1)
+    T = np.concatenate((Rt, np.broadcast_to([0., 0., 0., 1.], batch_shape + (1, 4))), axis=-2)
 
     return T
 
 
+@functools.lru_cache(maxsize=None)
+def is_2d_signature(standard_height_function):
+    """
+    Check if a module-level standard function takes both x and y coordinates, cached per function
+    """
+
+    return 'y2d' in inspect.signature(standard_height_function).parameters
+
+
+def is_2d_standard_function(standard_height_function):
+    """
+    Check if the standard function takes both x and y coordinates
+
+    Only the plain functions are cached: the callable objects, e.g. the 
+    ``StandardHeightSurrogate`` instances, would be kept alive by the cache.
+
+    Parameters
+    ----------
+        standard_height_function: `function`
+            The standard height function
+    Returns
+    -------
+        is_2d: `bool`
+            True for the 2D curved shapes, False for the 1D or cylinder shapes
+    """
+
+    if inspect.isfunction(standard_height_function):
+        return is_2d_signature(standard_height_function)
+    return 'y2d' in inspect.signature(standard_height_function).parameters
+
+
+def broadcast_params(*params):
+    """
+    Broadcast the parameters to arrays in shape of (N,) if any of them is an array
+
+    Parameters
+    ----------
+        params: `float` or `numpy.ndarray`
+            The parameters
+    Returns
+    -------
+        params: `tuple`
+            The parameters, unchanged if they are all scalars
+    """
+
+    if all(np.ndim(val) == 0 for val in params):
+        return params
+    return tuple(np.atleast_1d(val).astype(float) for val in np.broadcast_arrays(*params))
+
+
+# The working set of the generation kernels per point in bytes, measured with tracemalloc as
+# at most 44 float64 temporaries per point (for the complex tan-col diaboloid), with a margin
+generation_bytes_per_point = 48 * 8
+
+# The memory budget of the generation kernels in each thread, None for no budget
+generation_memory_state = threading.local()
+
+
+def get_max_chunk_points():
+    """
+    Get the number of points generated at once within the memory budget of this thread
+
+    Returns
+    -------
+        max_chunk_points: `int`
+            The maximum number of points, None if there is no budget
+    """
+
+    max_memory = getattr(generation_memory_state, 'max_memory', None)
+    if max_memory is None:
+        return None
+    return max(1024, int(max_memory // generation_bytes_per_point))
+
+
+@contextlib.contextmanager
+def memory_budget(max_memory: int, track_peak: bool = True):
+    """
+    Bound the working set of the generation kernels in the ``with`` block of this thread
+
+    The points of a map are generated in chunks so the temporaries of the iterations and the 
+    standard functions stay within ``max_memory``. The input, output and Jacobian arrays of a fit 
+    are not chunked and come on top of it. The peak is measured with ``tracemalloc``, which 
+    counts the allocations of all the threads of the process.
+
+    Parameters
+    ----------
+        max_memory: `int`
+            The memory budget in bytes
+        track_peak: `bool`
+            If True, measure the peak memory allocated in the block
+    Returns
+    -------
+        report: `dict`
+            The ``max_memory`` and, at the end of the block, the ``peak`` memory in bytes above 
+            the memory in use at the start of the block
+    """
+
+    previous_max_memory = getattr(generation_memory_state, 'max_memory', None)
+    generation_memory_state.max_memory = max_memory
+    report = {'max_memory': max_memory, 'peak': None}
+    if track_peak:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base_memory = tracemalloc.get_traced_memory()[0]
+    try:
+        yield report
+    finally:
+        generation_memory_state.max_memory = previous_max_memory
+        if track_peak:
+            report['peak'] = tracemalloc.get_traced_memory()[1] - base_memory
+            if started_tracing:
+                tracemalloc.stop()
+
+
+@profiled
 def iter_generate_height(standard_height_function,
                           x2d: np.ndarray,
                           y2d: np.ndarray,
@@ -98,7 +244,7 @@ def iter_generate_height(standard_height_function,
         theta: `float`
             The grazing angle
         tf: `numpy.ndarray`
-            The transformation matrix
+            The transformation matrix, or a stack of matrices in shape of (N, 4, 4) for N parameter sets
         z2d_measured: `numpy.ndarray`
             The measured height map
         thr_rms_dxy: `float`
@@ -109,12 +255,28 @@ def iter_generate_height(standard_height_function,
             The height map
     """
 
+    if tf.ndim > 2:
+        return iter_generate_batch_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured, thr_rms_dxy,
+                                          get_max_chunk_points() or 2**22)
+
     if z2d_measured is None:
         z2d_measured = np.zeros(x2d.shape)
 
+    # Generate the points in chunks within the memory budget, each converged to the threshold
+    max_chunk_points = get_max_chunk_points()
+    if max_chunk_points is not None and np.size(x2d) > max_chunk_points:
+        x1d, y1d, z1d_measured = np.ravel(x2d), np.ravel(y2d), np.ravel(z2d_measured)
+        z1d = np.empty(x1d.size)
+        for start in range(0, x1d.size, max_chunk_points):
+            chunk = slice(start, start + max_chunk_points)
+            z1d[chunk] = iter_generate_height(standard_height_function, x1d[chunk], y1d[chunk], p, q, theta, tf, z1d_measured[chunk], thr_rms_dxy)
+        return z1d.reshape(np.shape(x2d))
+
     # Initialization
     z2d = z2d_measured
     rms_dxy = np.inf
+    num_iter = 0
+    is_2d_function = is_2d_standard_function(standard_height_function)
 
     # Use while loop to make sure the transformation makes sense as
     # (x2d_s, y2d_s, z2d_s) --- tf ---> (x2d, y2d, z2d) and
@@ -130,12 +292,10 @@ def iter_generate_height(standard_height_function,
         x2d_s = m_s[0].reshape(x2d.shape)
         y2d_s = m_s[1].reshape(y2d.shape)
 
-        try:
+        if is_2d_function:
             z2d_s = np.real(standard_height_function(x2d_s, y2d_s, p, q, theta)) # 2D curved shape
-        except ValueError:
+        else:
             z2d_s = np.real(standard_height_function(x2d_s, p, q, theta)) # 1D or 2D cylinder
-        except:
-            raise
 
         s = np.vstack((x2d_s.flatten(), y2d_s.flatten(), z2d_s.flatten(), np.ones(z2d_s.size)))
 
@@ -149,10 +309,530 @@ def iter_generate_height(standard_height_function,
         dx2d = x2d - x2d_s_in_m
         dy2d = y2d - y2d_s_in_m
         rms_dxy = np.sqrt(np.nanmean((dx2d.flatten()**2 + dy2d.flatten()**2)))
+        num_iter += 1
+
+    add_profile_count('iter_generate_height iterations', num_iter)
+    return z2d
+
+
+@profiled
+def iter_generate_batch_height(standard_height_function,
+                                x2d: np.ndarray,
+                                y2d: np.ndarray,
+                                p: np.ndarray,
+                                q: np.ndarray,
+                                theta: np.ndarray,
+                                tf: np.ndarray,
+                                z2d_measured: np.ndarray = None,
+                                thr_rms_dxy: float = 1e-9,
+                                max_chunk_elements: int = 2**22):
+    """
+    The height generation with iterations for N parameter sets at once
+
+    The parameter sets are processed in chunks of at most ``max_chunk_elements`` 
+    points, which bounds the memory of the intermediate arrays.
+
+    Parameters
+    ----------
+        standard_height_function:
+            The standard height function
+        x2d: `numpy.ndarray`
+            The 2D x coordinates
+        y2d: `numpy.ndarray`
+            The 2D y coordinates
+        p: `numpy.ndarray`
+            The ``p`` values in shape of (N,) or a scalar
+        q: `numpy.ndarray`
+            The ``q`` values in shape of (N,) or a scalar
+        theta: `numpy.ndarray`
+            The grazing angles in shape of (N,) or a scalar
+        tf: `numpy.ndarray`
+            The transformation matrices in shape of (N, 4, 4)
+        z2d_measured: `numpy.ndarray`
+            The measured height map, in shape of x2d or (N,) + x2d.shape
+        thr_rms_dxy: `float`
+            The threshold of RMS, required for each of the parameter sets
+        max_chunk_elements: `int`
+            The maximum number of points of the parameter sets processed at once
+    Returns
+    -------
+        z2d: `numpy.ndarray`
+            The height maps in shape of (N,) + x2d.shape
+    """
+
+    # The standard functions broadcast the parameters over the grid axes
+    batch_shape = tf.shape[:-2]
+    grid_shape = np.shape(x2d)
+    map_shape = batch_shape + grid_shape
+
+    if z2d_measured is None:
+        z2d_measured = np.zeros(map_shape)
+
+    # Split the parameter sets into chunks to bound the memory
+    chunk_size = max(1, max_chunk_elements // max(1, np.size(x2d)))
+    if len(batch_shape) == 1 and batch_shape[0] > chunk_size:
+        z2d = np.empty(map_shape)
+        z2d_measured = np.broadcast_to(z2d_measured, map_shape)
+        for start in range(0, batch_shape[0], chunk_size):
+            chunk = slice(start, start + chunk_size)
+            p_chunk, q_chunk, theta_chunk = [val[chunk] if np.ndim(val) > 0 else val for val in (p, q, theta)]
+            z2d[chunk] = iter_generate_batch_height(standard_height_function, x2d, y2d, p_chunk, q_chunk, theta_chunk, tf[chunk], z2d_measured[chunk], thr_rms_dxy, max_chunk_elements)
+        return z2d
+
+    p, q, theta = [np.reshape(val, np.shape(val) + (1,)*len(grid_shape)) if np.ndim(val) > 0 else val for val in (p, q, theta)]
+
+    # Initialization
+    z2d = np.broadcast_to(z2d_measured, map_shape)
+    rms_dxy = np.inf
+    is_2d_function = is_2d_standard_function(standard_height_function)
+    tf_inv = np.linalg.inv(tf)
+    x1d_m = np.broadcast_to(np.ravel(x2d), batch_shape + (np.size(x2d),))
+    y1d_m = np.broadcast_to(np.ravel(y2d), batch_shape + (np.size(y2d),))
+    one1d = np.ones(batch_shape + (np.size(x2d),))
+    num_iter = 0
+
+    while rms_dxy > thr_rms_dxy:
+
+        # Points in metrology coordinates, transformed back to standard mirror coordinates
+        m = np.stack((x1d_m, y1d_m, z2d.reshape(batch_shape + (-1,)), one1d), axis=-2)
+        m_s = tf_inv @ m # X_m = tansform * X_s
+
+        # Use standard function to generate shape in standard mirror coordinates
+        x2d_s = m_s[..., 0, :].reshape(map_shape)
+        y2d_s = m_s[..., 1, :].reshape(map_shape)
+
+        if is_2d_function:
+            z2d_s = np.real(standard_height_function(x2d_s, y2d_s, p, q, theta)) # 2D curved shape
+        else:
+            z2d_s = np.real(standard_height_function(x2d_s, p, q, theta)) # 1D or 2D cylinder
+
+        s = np.stack((m_s[..., 0, :], m_s[..., 1, :], z2d_s.reshape(batch_shape + (-1,)), one1d), axis=-2)
+
+        # Transform to metrology coodinates to update the shape
+        s_m = tf @ s # X_m = tansform * X_s
+        z2d = s_m[..., 2, :].reshape(map_shape)
 
+        # Check the distances in lateral coordiantes for the worst parameter set
+        dx2d = x1d_m - s_m[..., 0, :]
+        dy2d = y1d_m - s_m[..., 1, :]
+        rms_dxy = np.nanmax(np.sqrt(np.nanmean((dx2d**2 + dy2d**2), axis=-1)))
+        num_iter += 1
+
+    add_profile_count('iter_generate_batch_height iterations', num_iter)
     return z2d
 
 
+class RegularGrid:
+    """
+    A regular grid kept as its x and y axes
+
+    The 2D coordinates are read-only broadcast views of the axes, so they take no memory, 
+    and the maps are generated tile by tile. A ``RegularGrid`` can be passed as ``x2d`` 
+    (with ``y2d`` as None) to the 2D generation, fitting and figure functions.
+
+    Parameters
+    ----------
+        x_axis: `numpy.ndarray`
+            The x coordinates of the columns
+        y_axis: `numpy.ndarray`
+            The y coordinates of the rows
+    """
+
+    def __init__(self, x_axis: np.ndarray, y_axis: np.ndarray):
+        self.x_axis = np.ravel(np.asarray(x_axis, dtype=float))
+        self.y_axis = np.ravel(np.asarray(y_axis, dtype=float))
+        self.shape = (self.y_axis.size, self.x_axis.size)
+        self.size = self.y_axis.size * self.x_axis.size
+        self.ndim = 2
+
+    @classmethod
+    def from_meshgrid(cls, x2d: np.ndarray, y2d: np.ndarray):
+        """
+        Create the grid from the x2d and y2d of a meshgrid with x along the columns
+
+        Parameters
+        ----------
+            x2d: `numpy.ndarray`
+                The 2D x coordinates
+            y2d: `numpy.ndarray`
+                The 2D y coordinates
+        Returns
+        -------
+            grid: `RegularGrid`
+                The grid with the axes of the meshgrid
+        """
+
+        if not is_xy_meshgrid(x2d, y2d):
+            raise ValueError("x2d and y2d are not a meshgrid with x along the columns and y along the rows.")
+        return cls(x2d[0], y2d[:, 0])
+
+    @property
+    def x2d(self):
+        """The 2D x coordinates as a read-only view"""
+        return np.broadcast_to(self.x_axis, self.shape)
+
+    @property
+    def y2d(self):
+        """The 2D y coordinates as a read-only view"""
+        return np.broadcast_to(self.y_axis[:, np.newaxis], self.shape)
+
+    def tiles(self, max_tile_elements: int = 2**22):
+        """
+        Iterate over the tiles of whole rows
+
+        Parameters
+        ----------
+            max_tile_elements: `int`
+                The maximum number of points in a tile
+        Returns
+        -------
+            tiles: `generator`
+                The row slice, x2d and y2d views of each tile
+        """
+
+        num_rows = max(1, max_tile_elements // max(1, self.x_axis.size))
+        for start in range(0, self.y_axis.size, num_rows):
+            rows = slice(start, start + num_rows)
+            yield rows, self.x2d[rows], self.y2d[rows]
+
+    def __repr__(self):
+        return f"RegularGrid(x_axis: {self.x_axis.size} points in [{self.x_axis[0]}, {self.x_axis[-1]}], y_axis: {self.y_axis.size} points in [{self.y_axis[0]}, {self.y_axis[-1]}])"
+
+
+def resolve_grid(x2d, y2d):
+    """
+    Get the 2D coordinates from a ``RegularGrid`` or the arrays
+
+    Parameters
+    ----------
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The 2D x coordinates or the grid
+        y2d: `numpy.ndarray`
+            The 2D y coordinates, ignored for a grid
+    Returns
+    -------
+        x2d: `numpy.ndarray`
+            The 2D x coordinates, as a view for a grid
+        y2d: `numpy.ndarray`
+            The 2D y coordinates, as a view for a grid
+    """
+
+    if isinstance(x2d, RegularGrid):
+        return x2d.x2d, x2d.y2d
+    return x2d, y2d
+
+
+def generate_on_grid_tiles(generation_function, standard_height_function, grid, params, z2d_measured, **kwargs):
+    """
+    Generate the height map on a ``RegularGrid`` tile by tile
+
+    Parameters
+    ----------
+        generation_function: `function`
+            The 2D generation function
+        standard_height_function: `function`
+            The standard height function
+        grid: `RegularGrid`
+            The grid
+        params: `tuple`
+            The parameters of the generation function after ``y2d``
+        z2d_measured: `numpy.ndarray`
+            The measured height map
+    Returns
+    -------
+        z2d: `numpy.ndarray`
+            The height map
+    """
+
+    z2d = None
+    for rows, x2d_tile, y2d_tile in grid.tiles():
+        if rows.start == 0 and rows.stop >= grid.shape[0]: # One tile for the whole grid
+            return generation_function(standard_height_function, x2d_tile, y2d_tile, *params, z2d_measured, **kwargs)
+        z2d_tile = generation_function(standard_height_function, x2d_tile, y2d_tile, *params, None if z2d_measured is None else z2d_measured[..., rows, :], **kwargs)
+        if z2d is None:
+            z2d = np.empty(z2d_tile.shape[:-2] + grid.shape)
+        z2d[..., rows, :] = z2d_tile
+    return z2d
+
+
+class GenerationMemo:
+    """
+    A least-recently-used memo of the generated surfaces within a memory budget
+
+    An entry is keyed by the generation and standard functions, the exact parameter 
+    values, and the identity of the coordinate arrays or ``RegularGrid`` and of the 
+    measured map, so the arrays must not be modified in place while they are memoized. 
+    The surfaces are stored without copy and returned as read-only views.
+
+    Parameters
+    ----------
+        max_bytes: `int`
+            The memory budget of the memoized surfaces in bytes, 0 to disable the memo
+    """
+
+    def __init__(self, max_bytes: int = 2**27):
+        self.max_bytes = max_bytes
+        self.entry_dict = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def make_key(self, generation_function: types.FunctionType, arguments: dict):
+        """
+        Make the key of a generation call
+
+        Parameters
+        ----------
+            generation_function: `function`
+                The generation function
+            arguments: `dict`
+                The bound arguments of the call
+        Returns
+        -------
+            key: `tuple`
+                The key, None if the call is not memoized, e.g. with parameter arrays
+            ref_list: `list`
+                The weak references to the arrays in the key
+        """
+
+        key = [generation_function]
+        ref_list = []
+        for name, val in arguments.items():
+            if name in generation_params_name_set:
+                if np.ndim(val) != 0:
+                    return None, None
+                key.append(float(val))
+            elif isinstance(val, (np.ndarray, RegularGrid)):
+                key.append(id(val))
+                ref_list.append(weakref.ref(val))
+            else:
+                key.append(val)
+        return tuple(key), ref_list
+
+    def get(self, key: tuple):
+        """
+        Get the memoized surface
+
+        Parameters
+        ----------
+            key: `tuple`
+                The key from ``make_key``
+        Returns
+        -------
+            v: `numpy.ndarray`
+                A read-only view of the surface, None if it is not memoized
+        """
+
+        with self.lock:
+            entry = self.entry_dict.get(key)
+            if entry is not None and any(ref() is None for ref in entry[1]): # An array of the key is freed and its id may be reused
+                self.discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entry_dict.move_to_end(key)
+            self.hits += 1
+            return read_only_view(entry[0])
+
+    def put(self, key: tuple, ref_list: list, v: np.ndarray):
+        """
+        Memoize the surface and evict the least recently used ones beyond the budget
+
+        Parameters
+        ----------
+            key: `tuple`
+                The key from ``make_key``
+            ref_list: `list`
+                The weak references to the arrays in the key
+            v: `numpy.ndarray`
+                The generated surface, not to be modified afterwards
+        """
+
+        if v.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            self.discard(key)
+            self.entry_dict[key] = (v, ref_list)
+            self.nbytes += v.nbytes
+            while self.nbytes > self.max_bytes:
+                self.discard(next(iter(self.entry_dict)))
+
+    def discard(self, key: tuple):
+        """
+        Remove an entry if it exists, with the lock held
+
+        Parameters
+        ----------
+            key: `tuple`
+                The key from ``make_key``
+        """
+
+        entry = self.entry_dict.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[0].nbytes
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters
+        """
+
+        with self.lock:
+            self.entry_dict.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def read_only_view(v: np.ndarray):
+    """
+    Get a read-only view of an array
+
+    Parameters
+    ----------
+        v: `numpy.ndarray`
+            The array
+    Returns
+    -------
+        v_view: `numpy.ndarray`
+            The read-only view
+    """
+
+    v_view = v.view()
+    v_view.flags.writeable = False
+    return v_view
+
+
+# The memo shared by the generation functions, disabled until a budget is set with set_generation_memo_budget
+generation_memo = GenerationMemo(max_bytes=0)
+
+# The names of the surface parameters in the generation functions
+generation_params_name_set = {'p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma'}
+
+# The nesting depth of the generation calls in each thread, so only the outermost call is memoized
+generation_memo_state = threading.local()
+
+
+def memoize_generation(generation_function: types.FunctionType):
+    """
+    Decorate a generation function with ``generation_memo``
+
+    The surfaces are memoized only for scalar parameters, and only once a budget is set 
+    with ``set_generation_memo_budget``; the memoized surfaces are returned as read-only 
+    views. The calls made inside another generation call, e.g. for the tiles of a 
+    ``RegularGrid``, are not memoized.
+
+    Parameters
+    ----------
+        generation_function: `function`
+            The generation function
+    Returns
+    -------
+        memoized_function: `function`
+            The generation function returning the memoized surfaces
+    """
+
+    signature = inspect.signature(generation_function)
+
+    @functools.wraps(generation_function)
+    def memoized_function(*args, **kwargs):
+        depth = getattr(generation_memo_state, 'depth', 0)
+        key = None
+        if depth == 0 and generation_memo.max_bytes > 0:
+            key, ref_list = generation_memo.make_key(generation_function, signature.bind(*args, **kwargs).arguments)
+            if key is not None:
+                v = generation_memo.get(key)
+                if v is not None:
+                    return v
+
+        generation_memo_state.depth = depth + 1
+        try:
+            v = generation_function(*args, **kwargs)
+        finally:
+            generation_memo_state.depth = depth
+
+        if key is not None:
+            generation_memo.put(key, ref_list, v)
+            return read_only_view(v)
+        return v
+
+    return memoized_function
+
+
+def get_generation_memo_info():
+    """
+    Get the counters and the memory use of the generation memo
+
+    Returns
+    -------
+        info: `dict`
+            The ``hits``, ``misses``, ``entries``, ``nbytes`` and ``max_bytes`` of the memo
+    """
+
+    with generation_memo.lock:
+        return {'hits': generation_memo.hits, 'misses': generation_memo.misses, 'entries': len(generation_memo.entry_dict),
+                'nbytes': generation_memo.nbytes, 'max_bytes': generation_memo.max_bytes}
+
+
+def set_generation_memo_budget(max_bytes: int):
+    """
+    Set the memory budget of the generation memo
+
+    Parameters
+    ----------
+        max_bytes: `int`
+            The memory budget in bytes, e.g. ``2**27`` to serve the re-evaluation after a fit 
+            and the regeneration for plotting, 0 (the default) to disable the memo and free the entries
+    """
+
+    generation_memo.max_bytes = max_bytes
+    with generation_memo.lock:
+        while generation_memo.nbytes > max(max_bytes, 0):
+            generation_memo.discard(next(iter(generation_memo.entry_dict)))
+
+
+def clear_generation_memo():
+    """
+    Free the memoized surfaces and reset the hit and miss counters
+    """
+
+    generation_memo.clear()
+
+
+def find_y_mirror_axis(x2d: np.ndarray, y2d: np.ndarray, y_i: float):
+    """
+    Find the grid axis along which the grid is mirror symmetric about ``y = y_i``
+
+    The pixels at index ``j`` and ``n-1-j`` along the axis have the same x and 
+    opposite ``y - y_i``, e.g. for a meshgrid with y symmetric about ``y_i``.
+
+    Parameters
+    ----------
+        x2d: `numpy.ndarray`
+            The 2D x coordinates
+        y2d: `numpy.ndarray`
+            The 2D y coordinates
+        y_i: `float`
+            The y-position of the chief ray intersection
+    Returns
+    -------
+        axis: `int`
+            The mirror axis (0 or 1), or None if the grid is not symmetric
+    """
+
+    if np.ndim(y2d) != 2:
+        return None
+    atol = 1e-9 * np.ptp(y2d)
+    for axis in (0, 1):
+        if y2d.shape[axis] > 1 and np.array_equal(x2d, np.flip(x2d, axis)) and \
+           np.allclose(y2d - y_i, y_i - np.flip(y2d, axis), rtol=0, atol=atol):
+            return axis
+    return None
+
+
+@profiled
+@memoize_generation
 def generate_2d_curved_surface_height(standard_height_function: types.FunctionType,
                                         x2d: np.ndarray,
                                         y2d: np.ndarray,
@@ -165,19 +845,28 @@ def generate_2d_curved_surface_height(standard_height_function: types.FunctionTy
                                         alpha: float,
                                         beta: float,
                                         gamma: float,
-                                        z2d_measured: np.ndarray = None):
+                                        z2d_measured: np.ndarray = None,
+                                        use_y_symmetry: bool = None):
 
     """
     Geneate 2D curved surface height map with (``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``)
 
+    The parameters can also be arrays in shape of (N,) to generate N maps at once
+    in shape of (N,) + x2d.shape.
+
+    The standard 2D shapes only depend on ``y2d**2``. When ``alpha`` and ``gamma`` are 0 and 
+    the grid is mirror symmetric about ``y_i``, only the unique half of the grid is 
+    evaluated and mirrored. Within a ``memory_budget``, the symmetry is only used if 
+    ``use_y_symmetry`` is True.
+
     Parameters
     ----------
         standard_height_function: `function`
             The standard height function
-        x2d: `numpy.ndarray`
-            The 2D x coordinates
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The 2D x coordinates, or the grid generated tile by tile
         y2d: `numpy.ndarray`
-            The 2D y coordinates
+            The 2D y coordinates, None for a grid
         p: `float`
             The ``p`` value: the distance from the source to the chief ray intersection
         q: `float`
@@ -198,6 +887,9 @@ def generate_2d_curved_surface_height(standard_height_function: types.FunctionTy
             z-translation in the conversion from standard mirror coordinates to metrology coordinates, also revealing the z-position of chief ray intersection in metrology coordinates
         z2d_measured: `numpy.ndarray`
             The measured height map
+        use_y_symmetry: `bool`
+            If None, detect the mirror symmetry of the grid about ``y_i``. If True, the grid is 
+            assumed to be symmetric along the first axis. If False, evaluate the full grid.
 
     Returns
     -------
@@ -205,16 +897,72 @@ def generate_2d_curved_surface_height(standard_height_function: types.FunctionTy
             The height map
     """
 
+    if isinstance(x2d, RegularGrid):
+        return generate_on_grid_tiles(generate_2d_curved_surface_height, standard_height_function, x2d, (p, q, theta, x_i, y_i, z_i, alpha, beta, gamma), z2d_measured, use_y_symmetry=use_y_symmetry)
+
     if z2d_measured is None:
         z2d_measured = np.zeros(x2d.shape)
 
+    p, q, theta, x_i, y_i, z_i, alpha, beta, gamma = broadcast_params(p, q, theta, x_i, y_i, z_i, alpha, beta, gamma)
+
     tf = compose_transformation_matrix(alpha, beta, gamma, x_i, y_i, z_i)
-    z2d = iter_generate_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured)
+
+    # Check the mirror symmetry about y_i without rotations mixing x and y. The detection compares 
+    # full-size temporaries, so it is skipped within a memory budget.
+    mirror_axis = None
+    if use_y_symmetry is not False and np.all(alpha == 0) and np.all(gamma == 0) and np.ptp(y_i) == 0:
+        if use_y_symmetry:
+            mirror_axis = 0
+        elif get_max_chunk_points() is None:
+            mirror_axis = find_y_mirror_axis(x2d, y2d, np.ravel(y_i)[0])
+
+    if mirror_axis is None:
+        z2d = iter_generate_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured)
+    else:
+        # Evaluate the unique half on slice views, with the initial heights from either side
+        num = x2d.shape[mirror_axis]
+        num_half = (num + 1) // 2
+        axis = mirror_axis - 2 # The grid axis in the (batched) height maps
+        def along_axis(index):
+            return (Ellipsis, index) + (slice(None),) * (-1 - axis)
+        z2d_init = z2d_measured[along_axis(slice(0, num_half))]
+        if not np.all(np.isfinite(z2d_init)):
+            z2d_init = np.where(np.isfinite(z2d_init), z2d_init, np.flip(z2d_measured, axis)[along_axis(slice(0, num_half))])
+        z2d_half = iter_generate_height(standard_height_function, x2d[along_axis(slice(0, num_half))], y2d[along_axis(slice(0, num_half))], p, q, theta, tf, z2d_init)
+
+        # Mirror the half and keep the invalid points of the measured height map
+        shape = list(z2d_half.shape)
+        shape[axis] = num
+        z2d = np.empty(shape)
+        z2d[along_axis(slice(0, num_half))] = z2d_half
+        z2d[along_axis(slice(num_half, None))] = np.flip(z2d_half[along_axis(slice(0, num - num_half))], axis)
+        np.copyto(z2d, np.nan, where=np.isnan(z2d_measured))
 
     return z2d
 
 
 
+def is_xy_meshgrid(x2d: np.ndarray, y2d: np.ndarray):
+    """
+    Check if the grid is a meshgrid with x along the columns and y along the rows
+
+    Parameters
+    ----------
+        x2d: `numpy.ndarray`
+            The 2D x coordinates
+        y2d: `numpy.ndarray`
+            The 2D y coordinates
+    Returns
+    -------
+        is_meshgrid: `bool`
+            True if every row of x2d is the same and every column of y2d is the same
+    """
+
+    return np.ndim(x2d) == 2 and np.array_equal(x2d, np.broadcast_to(x2d[:1], x2d.shape)) and np.array_equal(y2d, np.broadcast_to(y2d[:, :1], y2d.shape))
+
+
+@profiled
+@memoize_generation
 def generate_2d_cylinder_height(standard_height_function: types.FunctionType,
                                 x2d: np.ndarray,
                                 y2d: np.ndarray,
@@ -226,20 +974,33 @@ def generate_2d_cylinder_height(standard_height_function: types.FunctionType,
                                 alpha: float,
                                 beta: float,
                                 gamma: float,
-                                z2d_measured: np.ndarray = None):
+                                z2d_measured: np.ndarray = None,
+                                use_profile_broadcast: bool = None):
 
     """
     Geneate 2D cylinder surface height map with (``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``)
 
+    The parameters can also be arrays in shape of (N,) to generate N maps at once
+    in shape of (N,) + x2d.shape.
+
+    The cylinder is invariant along its axis ``d = R @ [0, 1, 0]`` in metrology coordinates, 
+    so on a meshgrid only one profile at ``y_ref`` is solved, and each row is this profile 
+    shifted by ``d_x/d_y*(y-y_ref)`` in x and by ``d_z/d_y*(y-y_ref)`` in z. Without ``gamma`` 
+    the rows are the profile itself plus the z correction. With ``gamma``, the rows are 
+    interpolated from the profile with cubic splines. This is not exact: within a pixel of 
+    shift, the error to the full solve stays below about 1e-15 m on a 401x101 elliptic 
+    cylinder. Larger shifts extrapolate the profile past its ends, with errors up to about 
+    1e-10 m at ``gamma`` = 0.3, so they are only used when ``use_profile_broadcast`` is True.
+
 
     Parameters
     ----------
         standard_height_function: `function`
             The standard height function
-        x2d: `numpy.ndarray`
-            The 2D x coordinates
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The 2D x coordinates, or the grid generated tile by tile
         y2d: `numpy.ndarray`
-            The 2D y coordinates
+            The 2D y coordinates, None for a grid
         p: `float`
             The ``p`` value: the distance from the source to the chief ray intersection
         q: `float`
@@ -258,6 +1019,9 @@ def generate_2d_cylinder_height(standard_height_function: types.FunctionType,
             z-translation in the conversion from standard mirror coordinates to metrology coordinates, also revealing the z-position of chief ray intersection in metrology coordinates
         z2d_measured: `numpy.ndarray`
             The measured height map
+        use_profile_broadcast: `bool`
+            If None, use the profile for a meshgrid when the rows are shifted by at most a pixel. 
+            If True, the grid is assumed to be a meshgrid. If False, solve every pixel.
 
     Returns
     -------
@@ -265,15 +1029,70 @@ def generate_2d_cylinder_height(standard_height_function: types.FunctionType,
             The height map
     """
 
+    if isinstance(x2d, RegularGrid):
+        return generate_on_grid_tiles(generate_2d_cylinder_height, standard_height_function, x2d, (p, q, theta, x_i, z_i, alpha, beta, gamma), z2d_measured, use_profile_broadcast=use_profile_broadcast)
+
     if z2d_measured is None:
         z2d_measured = np.zeros(x2d.shape)
 
+    p, q, theta, x_i, z_i, alpha, beta, gamma = broadcast_params(p, q, theta, x_i, z_i, alpha, beta, gamma)
+
     y_i = 0 # No need to consider y-position of the chief ray intersection for cylinders
     tf = compose_transformation_matrix(alpha, beta, gamma, x_i, y_i, z_i)
-    z2d = iter_generate_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured)
+
+    # Direction of the cylinder axis in metrology coordinates
+    d = tf[..., :3, 1]
+    is_auto = use_profile_broadcast is None
+    if is_auto:
+        use_profile_broadcast = np.all(np.abs(d[..., 1]) > 0.5) and is_xy_meshgrid(x2d, y2d) and x2d.shape[1] > 1
+
+    if use_profile_broadcast:
+        # Shifts of the rows along the cylinder axis from y_ref
+        x1d = x2d[0]
+        y1d = y2d[:, 0]
+        row_ref = len(y1d) // 2
+        y_ref = y1d[row_ref]
+        dy = (y1d - y_ref)[:, np.newaxis]
+        x_shift = (d[..., 0] / d[..., 1])[..., np.newaxis, np.newaxis] * dy
+        z_shift = (d[..., 2] / d[..., 1])[..., np.newaxis, np.newaxis] * dy
+        if is_auto and np.any(x_shift != 0):
+            # The profile interpolation only pays off with enough rows, and the shifted profile 
+            # is only extrapolated within a pixel past its ends
+            use_profile_broadcast = x2d.shape[0] >= 64 and np.max(np.abs(x_shift)) <= np.min(np.abs(np.diff(x1d)))
+
+    if not use_profile_broadcast:
+        z2d = iter_generate_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured)
+        return z2d
+
+    # Solve one profile at y_ref, with the initial heights from the nearest row
+    z1d_init = np.nan_to_num(z2d_measured[..., row_ref:row_ref+1, :])
+    z1d_ref = iter_generate_height(standard_height_function, x1d[np.newaxis], np.full((1, x1d.size), y_ref), p, q, theta, tf, z1d_init)
+
+    # Move the profile along the cylinder axis to each row
+    # The splines are built on the increasing x axis, a decreasing one is reversed
+    x_order = slice(None, None, -1) if x1d[-1] < x1d[0] else slice(None)
+    is_interpolable = np.all(np.diff(x1d[x_order]) > 0) and np.all(np.isfinite(z1d_ref))
+    if np.all(x_shift == 0):
+        z2d = z1d_ref + z_shift
+    elif is_interpolable and np.max(np.abs(x_shift)) <= np.min(np.abs(np.diff(x1d))):
+        # Shifts within a pixel: Taylor expansion with the profile derivatives
+        spline = CubicSpline(x1d[x_order], z1d_ref[..., x_order], axis=-1)
+        z2d = z1d_ref - x_shift*spline(x1d, 1) + x_shift**2/2*spline(x1d, 2) - x_shift**3/6*spline(x1d, 3) + z_shift
+    elif is_interpolable:
+        z1d_ref = z1d_ref.reshape(-1, x1d.size)
+        x_shift = np.broadcast_to(x_shift, (z1d_ref.shape[0],) + x2d.shape)
+        z2d = np.array([CubicSpline(x1d[x_order], z1d[x_order])(x1d - dx) for z1d, dx in zip(z1d_ref, x_shift)]).reshape(z_shift.shape[:-2] + x2d.shape) + z_shift
+    else: # The profile cannot be interpolated
+        z2d = iter_generate_height(standard_height_function, x2d, y2d, p, q, theta, tf, z2d_measured)
+        return z2d
+
+    # Keep the invalid points of the measured height map
+    z2d = np.where(np.isnan(z2d_measured), np.nan, z2d)
 
     return z2d
 
+@profiled
+@memoize_generation
 def generate_1d_height(standard_height_function: types.FunctionType,
                         x1d: np.array,
                         p: float,
@@ -286,6 +1105,9 @@ def generate_1d_height(standard_height_function: types.FunctionType,
     """
     Geneate 1D height map with (``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``)
 
+    The parameters can also be arrays in shape of (N,) to generate N profiles at once
+    in shape of (N, x1d.size).
+
 
     Parameters
     ----------
@@ -321,6 +1143,8 @@ def generate_1d_height(standard_height_function: types.FunctionType,
     if z1d_measured is None:
         z1d_measured = np.zeros_like(x1d)
 
+    p, q, theta, x_i, z_i, beta = broadcast_params(p, q, theta, x_i, z_i, beta)
+
     y_i = 0 # No need to consider y-position of the chief ray intersection for cylinders
     alpha = 0 # No need to consider rotation along x-axis for 1D case
     gamma = 0 # No need to consider rotation along z-axis for 1D case
@@ -330,6 +1154,8 @@ def generate_1d_height(standard_height_function: types.FunctionType,
     z1d = iter_generate_height(standard_height_function, x1d, y1d, p, q, theta, tf, z1d_measured)
     return z1d
 
+@profiled
+@memoize_generation
 def generate_1d_slope(standard_slope_function: types.FunctionType, 
                       x1d: np.array, 
                       p: float, 
@@ -340,6 +1166,9 @@ def generate_1d_slope(standard_slope_function: types.FunctionType,
     """
     Generate 1D slope map with (``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``)
 
+    The parameters can also be arrays in shape of (N,) to generate N profiles at once
+    in shape of (N, x1d.size).
+
     Parameters
     ----------
         standard_slope_function: `function`
@@ -369,6 +1198,11 @@ def generate_1d_slope(standard_slope_function: types.FunctionType,
             The slope map
     """
 
+    p, q, theta, x_i, beta = broadcast_params(p, q, theta, x_i, beta)
+    if np.ndim(p) > 0:
+        # Parameters along the first axis for N profiles
+        p, q, theta, x_i, beta = [val[:, np.newaxis] for val in (p, q, theta, x_i, beta)]
+
     x1d = x1d - x_i
     sx1d = standard_slope_function(x1d, p, q, theta)
     sx1d = sx1d - np.tan(beta) # Note: the direction of beta
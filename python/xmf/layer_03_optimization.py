@@ -23,15 +23,26 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+import time
 import types
+import warnings
 import numpy as np
-from scipy.optimize import least_squares
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares, lsq_linear, OptimizeResult
+from scipy.sparse import issparse, lil_matrix
+
+from xmf.layer_01_standard import StandardHeightSurrogate
+from xmf.profiling import profiled
 
 from xmf.layer_02_generation import (
     generate_1d_height,
     generate_1d_slope,
     generate_2d_curved_surface_height,
     generate_2d_cylinder_height,
+    RegularGrid,
+    resolve_grid,
+    memory_budget,
 )
 
 def check_input_params(input_params_dict: dict, x: np.ndarray, y: np.ndarray, v: np.ndarray):
@@ -57,6 +68,8 @@ def check_input_params(input_params_dict: dict, x: np.ndarray, y: np.ndarray, v:
         init_params: `numpy.ndarray`
             The used initial parameters.
     """
+
+    x, y = resolve_grid(x, y)
     
     if 'p' in input_params_dict:
         p = input_params_dict['p'] # [m]
@@ -108,6 +121,601 @@ def check_input_params(input_params_dict: dict, x: np.ndarray, y: np.ndarray, v:
 
     return init_params
 
+def check_opt_dict(opt_dict: dict, surface_generation_function: types.FunctionType):
+    """
+    Function to convert the optimization flags to a boolean vector.
+
+    Parameters
+    ----------
+        opt_dict: `dict`
+            The structure to set whether optimization is needed for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+
+    Returns
+    -------
+        opt_vector: `numpy.ndarray`
+            The boolean optimization flags in the order of 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+    """
+
+    opt_vector = np.zeros(9, dtype=bool)
+
+    if surface_generation_function == generate_2d_curved_surface_height:
+        opt_vector[3:] = True # x_i, y_i, z_i, alpha, beta, gamma
+    elif surface_generation_function == generate_2d_cylinder_height:
+        opt_vector[3] = True # x_i
+        opt_vector[5] = True # z_i
+        opt_vector[6:] = True # alpha, beta, gamma
+    elif surface_generation_function == generate_1d_height:
+        opt_vector[3] = True # x_i
+        opt_vector[5] = True # z_i
+        opt_vector[7] = True # beta
+    elif surface_generation_function == generate_1d_slope:
+        opt_vector[3] = True # x_i
+        opt_vector[7] = True # beta
+
+    # Update the user defined optimization flags
+    if 'p' in opt_dict: opt_vector[0] = opt_dict['p']
+    if 'q' in opt_dict: opt_vector[1] = opt_dict['q']
+    if 'theta' in opt_dict: opt_vector[2] = opt_dict['theta']
+    if 'x_i' in opt_dict: opt_vector[3] = opt_dict['x_i']
+    if 'y_i' in opt_dict: opt_vector[4] = opt_dict['y_i']
+    if 'z_i' in opt_dict: opt_vector[5] = opt_dict['z_i']
+    if 'alpha' in opt_dict: opt_vector[6] = opt_dict['alpha']
+    if 'beta' in opt_dict: opt_vector[7] = opt_dict['beta']
+    if 'gamma' in opt_dict: opt_vector[8] = opt_dict['gamma']
+
+    return opt_vector
+
+def check_tol_dict(tol_dict: dict, surface_generation_function: types.FunctionType):
+    """
+    Function to convert the tolerances to a boolean vector and two boundaries.
+
+    Parameters
+    ----------
+        tol_dict: `dict`
+            The structure to set the tolerances for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+
+    Returns
+    -------
+        opt_vector: `numpy.ndarray`
+            The boolean optimization flags
+        tol_vector: `numpy.ndarray`
+            The lower and upper tolerances in shape of (9, 2)
+    """
+
+    opt_vector = check_opt_dict({}, surface_generation_function)
+
+    keys = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
+    tol_vector = np.zeros((9, 2))
+
+    def unify_tol_struct_format(tol_dict, str_key, is_opt):
+        unified_tol_dict = tol_dict.copy()
+        # If the field exists
+        if str_key in unified_tol_dict:
+            val = unified_tol_dict[str_key]
+            if np.isscalar(val):
+                unified_tol_dict[str_key] = np.array([-1, 1]) * val
+            else:
+                assert np.size(val) <= 2
+                unified_tol_dict[str_key] = np.array(val)
+        else:
+            if is_opt:
+                unified_tol_dict[str_key] = np.array([-np.inf, np.inf])
+            else:
+                unified_tol_dict[str_key] = np.array([0, 0])
+        return unified_tol_dict
+    # Check the tolerance structure and unify the format
+    for num in range(9):
+        # Unify the tolerance structure format as two boundaries
+        unified_tol_dict = unify_tol_struct_format(tol_dict, keys[num], opt_vector[num])
+        # Update the user defined optimization flags
+        opt_vector[num] = not np.all(np.array(unified_tol_dict[keys[num]]) == 0)
+        # Update the tolerance vector
+        tol_vector[num, :] = unified_tol_dict[keys[num]]
+
+    return opt_vector, tol_vector
+
+def generate_surface_with_params(surface_generation_function: types.FunctionType,
+                                 standard_surface_shape_function: types.FunctionType,
+                                 x: np.ndarray,
+                                 y: np.ndarray,
+                                 params: np.ndarray,
+                                 v: np.ndarray = None):
+    """
+    Function to generate the surface with a full parameter vector.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x: `numpy.ndarray`
+            The measured x-coordinate in in unit of [m] as a suggestion
+        y: `numpy.ndarray`
+            The measured y-coordinate in in unit of [m] as a suggestion
+        params: `numpy.ndarray`
+            The ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma`` parameters
+        v: `numpy.ndarray`
+            The measured slope or height in [rad] or [m] as a suggestion
+
+    Returns
+    -------
+        v_fit: `numpy.ndarray`
+            The generated surface (1D or 2D)
+    """
+
+    # Release the input parameters.............................................
+    p, q, theta, x_i, y_i, z_i, alpha, beta, gamma = params
+
+    # Generate surface height with (p, q, theta),
+    # considering tranformation with x_i, y_i, z_i, alpha, beta, gamma.........
+    if surface_generation_function == generate_2d_curved_surface_height:
+        v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, y_i, z_i, alpha, beta, gamma, v)
+    elif surface_generation_function == generate_2d_cylinder_height:
+        v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, z_i, alpha, beta, gamma, v)
+    elif surface_generation_function == generate_1d_height:
+        v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, z_i, beta, v)
+    elif surface_generation_function == generate_1d_slope:
+        v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, beta)
+
+    return v_fit
+
+@profiled
+def common_cost_function_for_optimization(surface_generation_function: types.FunctionType,
+                                          standard_surface_shape_function: types.FunctionType,
+                                          x: np.ndarray,
+                                          y: np.ndarray,
+                                          v: np.ndarray,
+                                          param_fix: np.ndarray,
+                                          param: np.ndarray):
+    """
+    Common cost function for optimization.
+
+    ``param_fix`` is the list of fixed parameters, and ``param`` is the list of
+    parametres to optimize. It is important to have them always in the same
+    order as ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+    The optimized parameters are those set as NaN in ``param_fix``.
+
+    Returns
+    -------
+        v1d_valid_res: `numpy.ndarray`
+            The valid residuals
+        v_fit: `numpy.ndarray`
+            The fitting result (1D or 2D)
+        v_res: `numpy.ndarray`
+            The residual (1D or 2D)
+    """
+
+    # Update parameters which need optimization................................
+    param_update = param_fix.copy()
+    param_update[np.isnan(param_fix)] = param
+
+    v_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, param_update, v)
+
+    # Calculte the valid residual height as the output of the cost function....
+    v_res = v - v_fit
+    v1d_valid_res = v_res[np.isfinite(v_res)]
+
+    return v1d_valid_res, v_fit, v_res
+
+@profiled
+def calculate_ci_95(result):
+    """
+    Function to calculate the 95.45% confidence intervals (±2σ) from the Jacobian.
+
+    Parameters
+    ----------
+        result: `scipy.optimize.OptimizeResult`
+            The optimization result with ``x``, ``jac`` and ``fun``
+
+    Returns
+    -------
+        ci: `numpy.ndarray`
+            The confidence intervals in shape of (n_params, 2)
+    """
+
+    # Step 1: Extract information
+    J = result.jac                     # Jacobian matrix (m x n)
+    residuals = result.fun             # residual vector (m,)
+    n_params = len(result.x)           # number of parameters
+    dof = max(1, len(residuals) - n_params)  # degrees of freedom
+
+    # Step 2: Estimate residual variance
+    s_sq = np.sum(residuals**2) / dof
+
+    # Step 3: Estimate parameter covariance matrix
+    JtJ = J.T @ J
+    if issparse(JtJ): # Jacobian with jac_sparsity
+        JtJ = JtJ.toarray()
+    pcov = np.linalg.inv(JtJ) * s_sq
+
+    # Step 4: Standard deviation (1σ) of each parameter
+    perr = np.sqrt(np.diag(pcov))
+
+    # Step 5: Compute 95.45% confidence intervals (±2σ)
+    ci_lower = result.x - 2 * perr
+    ci_upper = result.x + 2 * perr
+    ci = np.vstack((ci_lower, ci_upper)).T  # Shape (n_params, 2)
+    return ci
+
+def release_params_dicts(init_params: np.ndarray,
+                         param_fix: np.ndarray,
+                         param_result: np.ndarray,
+                         param_ci_result: np.ndarray,
+                         opt_vector: np.ndarray):
+    """
+    Function to release the parameter vectors as dictionaries.
+
+    Returns
+    -------
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters.
+    """
+
+    str_param_name_list = ['p', 'q', 'theta',
+                           'x_i', 'y_i', 'z_i', 
+                           'alpha', 'beta', 'gamma']
+    init_params_dict = {}
+    opt_params_dict = {}
+    opt_params_ci_dict = {}
+    for idx, str_param_name in enumerate(str_param_name_list):
+        init_params_dict[str_param_name] = init_params[idx] if opt_vector[idx] else param_fix[idx]
+        opt_params_dict[str_param_name] = param_result[idx] if opt_vector[idx] else param_fix[idx]
+        opt_params_ci_dict[str_param_name] = param_ci_result[idx] if opt_vector[idx] else np.full(2, np.nan)
+
+    return opt_params_dict, opt_params_ci_dict, init_params_dict
+
+def estimate_residual_block_shape(v_res: np.ndarray):
+    """
+    Function to estimate the block shape for the block bootstrap from the residual correlation.
+
+    The block length along each axis is twice the lag where the mean autocorrelation 
+    of the residual drops below 1/e.
+
+    Parameters
+    ----------
+        v_res: `numpy.ndarray`
+            The residual (1D or 2D)
+
+    Returns
+    -------
+        block_shape: `tuple`
+            The block length along each axis
+    """
+
+    res = np.where(np.isfinite(v_res), v_res - np.nanmean(v_res), 0)
+    block_shape = []
+    for axis in range(res.ndim):
+        n = res.shape[axis]
+        spectrum = np.fft.rfft(res, n=2*n, axis=axis)
+        acf = np.fft.irfft(np.abs(spectrum)**2, axis=axis)
+        acf = np.moveaxis(acf, axis, -1)[..., :n].reshape(-1, n).sum(axis=0)
+        below = np.flatnonzero(acf < acf[0] / np.e) if acf[0] > 0 else np.array([0])
+        lag = below[0] if below.size > 0 else n
+        block_shape.append(int(np.clip(2 * lag, 1, max(1, n // 4))))
+    return tuple(block_shape)
+
+def resample_residual_blocks(v_res: np.ndarray, block_shape: tuple, rng: np.random.Generator):
+    """
+    Function to resample the residual with moving blocks (1D or 2D).
+
+    Parameters
+    ----------
+        v_res: `numpy.ndarray`
+            The residual (1D or 2D)
+        block_shape: `tuple`
+            The block length along each axis
+        rng: `numpy.random.Generator`
+            The random generator
+
+    Returns
+    -------
+        v_res_resampled: `numpy.ndarray`
+            The resampled residual
+    """
+
+    # Tile the output with blocks copied from random positions of the residual
+    num_tiles = [int(np.ceil(n / b)) for n, b in zip(v_res.shape, block_shape)]
+    starts = [rng.integers(0, n - b + 1, size=num_tiles) for n, b in zip(v_res.shape, block_shape)]
+    tile_grid = np.ix_(*[np.arange(n) // b for n, b in zip(v_res.shape, block_shape)])
+    index = []
+    for axis, (n, b) in enumerate(zip(v_res.shape, block_shape)):
+        offset = np.reshape(np.arange(n) % b, [-1 if k == axis else 1 for k in range(v_res.ndim)])
+        index.append(starts[axis][tile_grid] + offset)
+    return v_res[tuple(index)]
+
+def bootstrap_refit_worker(surface_generation_function: types.FunctionType,
+                           standard_surface_shape_function: types.FunctionType,
+                           x: np.ndarray,
+                           y: np.ndarray,
+                           v_res: np.ndarray,
+                           v_fit: np.ndarray,
+                           param_fix: np.ndarray,
+                           param_start: np.ndarray,
+                           bounds: np.ndarray,
+                           block_shape: tuple,
+                           num_replicates: int,
+                           seed,
+                           deadline: float = None):
+    """
+    Function to refit the resampled measurements, used by ``bootstrap_ci``.
+
+    Each refit is a bounded ``least_squares`` warm-started from ``param_start``, without 
+    the confidence intervals of ``optimize_parameters``. The residuals are normalized by 
+    the residual RMS of the fit and the parameters scaled by the Jacobian, so the tolerances 
+    hold whatever the units. A relative cost change below ``ftol=1e-6`` is far below the 
+    fluctuation of the cost between replicates, so the refits stop there instead of 
+    drifting along poorly constrained directions.
+
+    Returns
+    -------
+        params: `numpy.ndarray`
+            The refitted parameters in shape of (num_done, 9)
+    """
+
+    res_rms = np.nanstd(v_res) or 1.0
+
+    def cost_func_of_least_squares(param, v):
+        valid_res, _, _ = common_cost_function_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, param_fix, param)
+        return valid_res / res_rms
+
+    is_opt = np.isnan(param_fix)
+    rng = np.random.default_rng(seed)
+    params = []
+    for _ in range(num_replicates):
+        if deadline is not None and time.time() > deadline:
+            break
+        v_resampled = v_fit + resample_residual_blocks(v_res, block_shape, rng)
+        v_resampled[np.isnan(v_fit) | np.isnan(v_res)] = np.nan
+        result = least_squares(cost_func_of_least_squares, param_start, bounds=(bounds[:, 0], bounds[:, 1]), args=(v_resampled,), 
+                               method='trf', x_scale='jac', ftol=1e-6)
+        param = param_fix.copy()
+        param[is_opt] = result.x
+        params.append(param)
+    return np.array(params).reshape(-1, 9)
+
+@profiled
+def bootstrap_ci(surface_generation_function: types.FunctionType,
+                 standard_surface_shape_function: types.FunctionType,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 v_res: np.ndarray,
+                 v_fit: np.ndarray,
+                 opt_params_dict: dict,
+                 init_params_dict: dict,
+                 opt_or_tol_dict: dict,
+                 n_bootstrap: int = 100,
+                 block_shape: tuple = None,
+                 max_time: float = None,
+                 max_workers: int = None,
+                 seed: int = None):
+    """
+    Function to calculate the 95.45% confidence intervals with the block bootstrap.
+
+    The fitting residual is resampled in blocks to keep its spatial correlation, added back 
+    to the fitted surface and refitted. The refits are warm-started from the optimized 
+    parameters, bounded by the tolerances of a ``tol_dict``, and run in parallel worker 
+    processes until ``n_bootstrap`` refits are done or ``max_time`` is reached. The intervals 
+    are the 2.275 and 97.725 percentiles of the refitted parameters, comparable to the ±2σ 
+    intervals of ``calculate_ci_95``.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x: `numpy.ndarray` or `RegularGrid`
+            The measured x-coordinate in in unit of [m] as a suggestion, or the grid of a 2D map
+        y: `numpy.ndarray`
+            The measured y-coordinate in in unit of [m] as a suggestion, None for a grid
+        v_res: `numpy.ndarray`
+            The fitting residual (1D or 2D)
+        v_fit: `numpy.ndarray`
+            The fitting result (1D or 2D)
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters in dictionary
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        n_bootstrap: `int`
+            The number of the bootstrap refits
+        block_shape: `tuple`
+            The block length along each axis. If None, it is estimated from the residual correlation.
+        max_time: `float`
+            The time budget in seconds. If None, all the refits are done.
+        max_workers: `int`
+            The number of worker processes. If 1, the refits run in the current process.
+        seed: `int`
+            The seed of the random generator
+
+    Returns
+    -------
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+    """
+
+    str_param_name_list = ['p', 'q', 'theta',
+                           'x_i', 'y_i', 'z_i', 
+                           'alpha', 'beta', 'gamma']
+    v_res = np.asarray(v_res, dtype=float)
+    if block_shape is None:
+        block_shape = estimate_residual_block_shape(v_res)
+    block_shape = tuple(np.broadcast_to(block_shape, (v_res.ndim,)).astype(int))
+
+    # Warm start from the optimized parameters, within the tolerance boundaries of 
+    # optimize_parameters_with_tol, which are around the shifted initial parameters
+    if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
+        opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        bounds = np.tile([-np.inf, np.inf], (9, 1))
+    else: # Use tol_dict
+        opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+        bounds = (np.array([init_params_dict[key] for key in str_param_name_list]) + 1e-6)[:, np.newaxis] + tol_vector
+    bounds = bounds[opt_vector]
+    param_opt = np.array([opt_params_dict[key] for key in str_param_name_list], dtype=float)
+    param_fix = param_opt.copy()
+    param_fix[opt_vector] = np.nan
+    param_start = np.clip(param_opt[opt_vector], bounds[:, 0], bounds[:, 1])
+
+    # Split the refits over the workers, each with an independent random stream
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, n_bootstrap))
+    num_replicates = np.diff(np.linspace(0, n_bootstrap, max_workers + 1).astype(int))
+    seeds = np.random.SeedSequence(seed).spawn(max_workers)
+    deadline = None if max_time is None else time.time() + max_time
+    args = (surface_generation_function, standard_surface_shape_function, x, y, v_res, v_fit, param_fix, param_start, bounds, block_shape)
+
+    if max_workers == 1:
+        params = bootstrap_refit_worker(*args, n_bootstrap, seeds[0], deadline)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(bootstrap_refit_worker, *args, num, seq, deadline) for num, seq in zip(num_replicates, seeds)]
+            params = np.concatenate([future.result() for future in futures])
+
+    if params.shape[0] < n_bootstrap:
+        warnings.warn(f"Only {params.shape[0]} of {n_bootstrap} bootstrap refits are done within the time budget.")
+
+    opt_params_ci_dict = {}
+    for idx, key in enumerate(str_param_name_list):
+        if opt_vector[idx] and params.shape[0] >= 2:
+            opt_params_ci_dict[key] = np.percentile(params[:, idx], [2.275, 97.725])
+        else:
+            opt_params_ci_dict[key] = np.full(2, np.nan)
+    return opt_params_ci_dict
+
+@profiled
+def build_surrogate_for_optimization(surface_generation_function: types.FunctionType,
+                                     standard_surface_shape_function: types.FunctionType,
+                                     x: np.ndarray,
+                                     y: np.ndarray,
+                                     v: np.ndarray,
+                                     init_params: np.ndarray,
+                                     opt_vector: np.ndarray):
+    """
+    Function to build the surrogate of the standard shape for the coarse iterations.
+
+    The surrogate is only built for 2D curved surfaces with fixed ``p``, ``q`` and ``theta``.
+    The footprint covers the valid measured points relative to (``x_i``, ``y_i``) with a margin.
+
+    Returns
+    -------
+        surrogate: `StandardHeightSurrogate`
+            The surrogate, or None if it is not applicable
+    """
+
+    if surface_generation_function != generate_2d_curved_surface_height or np.any(opt_vector[:3]):
+        return None
+
+    x, y = resolve_grid(x, y)
+    is_valid = np.isfinite(v)
+    x_s = x[is_valid] - init_params[3]
+    y_s = y[is_valid] - init_params[4]
+    x_margin = 0.05 * (np.max(x_s) - np.min(x_s))
+    y_margin = 0.05 * (np.max(y_s) - np.min(y_s))
+    p, q, theta = init_params[:3]
+
+    try:
+        surrogate = StandardHeightSurrogate(standard_surface_shape_function,
+                                            (np.min(x_s) - x_margin, np.max(x_s) + x_margin),
+                                            (np.min(y_s) - y_margin, np.max(y_s) + y_margin),
+                                            p, q, theta)
+    except ValueError as err:
+        warnings.warn(f"{err} The exact standard function is used instead.")
+        surrogate = None
+
+    return surrogate
+
+class OptParamsDict(dict):
+    """
+    The optimized parameters in dictionary, with the ``status`` of the optimization
+
+    The ``status`` is ``'converged'`` when the ``least_squares`` tolerances are met, 
+    ``'max_nfev'`` when its number of evaluations is exceeded, or ``'target_rms'``, 
+    ``'max_time'`` or ``'callback'`` when the fit is stopped early with the best 
+    parameters so far.
+    """
+
+    status = 'converged'
+
+
+def make_fit_callback(callback: types.FunctionType,
+                      max_time: float,
+                      target_rms: float,
+                      param_fix: np.ndarray,
+                      opt_vector: np.ndarray):
+    """
+    Function to make the ``least_squares`` callback for the progress and the early stopping.
+
+    The intermediate ``OptimizeResult`` passed to ``callback`` has the iteration number 
+    ``nit``, the ``cost``, the residual ``rms`` (standard deviation of the valid residuals) 
+    and the current parameters ``params_dict`` in addition to ``x`` and ``fun``. 
+    ``callback`` can raise ``StopIteration`` to stop the fit.
+
+    Parameters
+    ----------
+        callback: `function`
+            The user function called after each iteration, or None
+        max_time: `float`
+            The time budget of the optimization in seconds, or None
+        target_rms: `float`
+            The residual RMS to stop at, or None
+        param_fix: `numpy.ndarray`
+            The fixed parameters, NaN for the optimized ones
+        opt_vector: `numpy.ndarray`
+            The boolean optimization flags
+
+    Returns
+    -------
+        fit_callback: `function`
+            The callback for ``least_squares``, or None if no option is given
+        stop_state: `dict`
+            The ``status`` set to the reason of an early stop
+    """
+
+    stop_state = {'status': None}
+    if callback is None and max_time is None and target_rms is None:
+        return None, stop_state
+
+    str_param_name_list = ['p', 'q', 'theta',
+                           'x_i', 'y_i', 'z_i', 
+                           'alpha', 'beta', 'gamma']
+    time_start = time.perf_counter()
+
+    def fit_callback(intermediate_result):
+        params = param_fix.copy()
+        params[opt_vector] = intermediate_result.x
+        intermediate_result['params_dict'] = dict(zip(str_param_name_list, params))
+        intermediate_result['rms'] = float(np.std(intermediate_result.fun))
+        if callback is not None:
+            try:
+                callback(intermediate_result)
+            except StopIteration:
+                stop_state['status'] = 'callback'
+                raise
+        if target_rms is not None and intermediate_result['rms'] <= target_rms:
+            stop_state['status'] = 'target_rms'
+            raise StopIteration
+        if max_time is not None and time.perf_counter() - time_start >= max_time:
+            stop_state['status'] = 'max_time'
+            raise StopIteration
+
+    return fit_callback, stop_state
+
+@profiled
 def optimize_parameters(surface_generation_function: types.FunctionType,  
                         standard_surface_shape_function: types.FunctionType, 
                         x: np.ndarray, 
@@ -115,6 +723,13 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
                         v: np.ndarray, 
                         input_params_dict: dict, 
                         opt_or_tol_dict: dict,
+                        use_surrogate: bool = False,
+                        ci_method: str = 'jacobian',
+                        bootstrap_options: dict = None,
+                        callback: types.FunctionType = None,
+                        max_memory: int = None,
+                        max_time: float = None,
+                        target_rms: float = None,
                         ):
     """
     Basic function to provide a convenient way to optimize the surface parameters.
@@ -125,10 +740,10 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
             The function to generate surface (1D or 2D, slope or height)
         standard_surface_shape_function: `function` 
             The function handle for a standard surface shape 
-        x: `numpy.ndarray`
-            The measured x-coordinate in in unit of [m] as a suggestion
+        x: `numpy.ndarray` or `RegularGrid`
+            The measured x-coordinate in in unit of [m] as a suggestion, or the grid of a 2D map
         y: `numpy.ndarray`
-            The measured y-coordinate in in unit of [m] as a suggestion
+            The measured y-coordinate in in unit of [m] as a suggestion, None for a grid
         v: `numpy.ndarray`
             The measured slope or height in [rad] or [m] as a suggestion
         input_params_dict: `dict`
@@ -139,6 +754,24 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        use_surrogate: `bool` or `StandardHeightSurrogate`
+            If True, use a surrogate of the standard shape for the coarse iterations 
+            when ``p``, ``q`` and ``theta`` are fixed, or the given surrogate built beforehand
+        ci_method: `str`
+            ``'jacobian'`` for the ±2σ intervals from the Jacobian, or ``'bootstrap'`` 
+            for the block bootstrap intervals robust to correlated residuals
+        bootstrap_options: `dict`
+            The options passed to ``bootstrap_ci``, e.g. ``n_bootstrap`` or ``max_time``
+        callback: `function`
+            The function called after each iteration with the intermediate ``OptimizeResult``, 
+            see ``make_fit_callback``; ``StopIteration`` stops the fit, other exceptions abort it
+        max_memory: `int`
+            The memory budget in bytes of the generation kernels, see ``memory_budget``. 
+            A warning is issued if the measured peak memory of the fit exceeds it.
+        max_time: `float`
+            The time budget of the optimization in seconds, after which the best parameters so far are returned
+        target_rms: `float`
+            The residual RMS at which the fit stops with the current parameters
 
     Returns
     -------
@@ -146,14 +779,26 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
             The residual (1D or 2D)
         v_fit: `numpy.ndarray`
             The fitting result (1D or 2D)
-        opt_params_dict: `dict`
-            The optimized parameters in dictionary
+        opt_params_dict: `OptParamsDict`
+            The optimized parameters in dictionary, with the ``status`` of the optimization
         opt_params_ci_dict: `dict`
             The confidence intervals of the optimized parameters in dictionary
         init_params: `numpy.ndarray`
             The used initial parameters.
     """
 
+    if ci_method not in ('jacobian', 'bootstrap'):
+        raise ValueError(f"Unknown ci_method: {ci_method}. Use 'jacobian' or 'bootstrap'.")
+
+    if max_memory is not None:
+        with memory_budget(max_memory) as report:
+            result = optimize_parameters(surface_generation_function, standard_surface_shape_function, x, y, v, input_params_dict, opt_or_tol_dict,
+                                         use_surrogate, ci_method, bootstrap_options, callback, None, max_time, target_rms)
+        if report['peak'] > max_memory:
+            warnings.warn(f"The peak memory of the fit is {report['peak'] / 2**20:.1f} MiB, above the budget of {max_memory / 2**20:.1f} MiB "
+                          "because of the input, output and Jacobian arrays.")
+        return result
+
     if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
 
         v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict = optimize_parameters_with_opt(
@@ -161,7 +806,11 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
             standard_surface_shape_function,
             x, y, v,
             input_params_dict,
-            opt_or_tol_dict)
+            opt_or_tol_dict,
+            use_surrogate,
+            callback,
+            max_time,
+            target_rms)
 
     else:  # Use tol_dict
 
@@ -170,7 +819,16 @@ def optimize_parameters(surface_generation_function: types.FunctionType,
             standard_surface_shape_function,
             x, y, v,
             input_params_dict,
-            opt_or_tol_dict)
+            opt_or_tol_dict,
+            use_surrogate,
+            callback,
+            max_time,
+            target_rms)
+
+    if ci_method == 'bootstrap':
+        opt_params_ci_dict = bootstrap_ci(surface_generation_function, standard_surface_shape_function, 
+                                          x, y, v_res, v_fit, opt_params_dict, init_params_dict, opt_or_tol_dict, 
+                                          **(bootstrap_options or {}))
 
     return v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
 
@@ -181,6 +839,10 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
                                  v: np.ndarray, 
                                  input_params_dict: dict, 
                                  opt_dict: dict,
+                                 use_surrogate: bool = False,
+                                 callback: types.FunctionType = None,
+                                 max_time: float = None,
+                                 target_rms: float = None,
                                  ):
     """
     Basic function to provide a convenient way to optimize the surface parameters with optimization flag.
@@ -191,10 +853,10 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
             The function to generate surface (1D or 2D, slope or height)
         standard_surface_shape_function: `function` 
             The function handle for a standard surface shape 
-        x: `numpy.ndarray`
-            The measured x-coordinate in in unit of [m] as a suggestion
+        x: `numpy.ndarray` or `RegularGrid`
+            The measured x-coordinate in in unit of [m] as a suggestion, or the grid of a 2D map
         y: `numpy.ndarray`
-            The measured y-coordinate in in unit of [m] as a suggestion
+            The measured y-coordinate in in unit of [m] as a suggestion, None for a grid
         v: `numpy.ndarray`
             The measured slope or height in [rad] or [m] as a suggestion
         input_params_dict: `dict`
@@ -205,6 +867,16 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
         opt_dict: `dict`
             The structure to set whether optimization is needed for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        use_surrogate: `bool` or `StandardHeightSurrogate`
+            If True, use a surrogate of the standard shape for the coarse iterations 
+            when ``p``, ``q`` and ``theta`` are fixed, or the given surrogate built beforehand
+        callback: `function`
+            The function called after each iteration with the intermediate ``OptimizeResult``, 
+            see ``make_fit_callback``
+        max_time: `float`
+            The time budget of the optimization in seconds
+        target_rms: `float`
+            The residual RMS at which the fit stops
 
     Returns
     -------
@@ -212,45 +884,14 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
             The residual (1D or 2D)
         v_fit: `numpy.ndarray`
             The fitting result (1D or 2D)
-        opt_params_dict: `dict`
-            The optimized parameters in dictionary
+        opt_params_dict: `OptParamsDict`
+            The optimized parameters in dictionary, with the ``status`` of the optimization
         opt_params_ci_dict: `dict`
             The confidence intervals of the optimized parameters in dictionary
         init_params_dict: `dict`
             The used initial parameters.
     """ 
 
-    def check_opt_dict(opt_dict, surface_generation_function): 
-        
-        opt_vector = np.zeros(9, dtype=bool)
-
-        if surface_generation_function == generate_2d_curved_surface_height:
-            opt_vector[3:] = True # x_i, y_i, z_i, alpha, beta, gamma
-        elif surface_generation_function == generate_2d_cylinder_height:
-            opt_vector[3] = True # x_i
-            opt_vector[5] = True # z_i
-            opt_vector[6:] = True # alpha, beta, gamma
-        elif surface_generation_function == generate_1d_height:
-            opt_vector[3] = True # x_i
-            opt_vector[5] = True # z_i
-            opt_vector[7] = True # beta
-        elif surface_generation_function == generate_1d_slope:
-            opt_vector[3] = True # x_i
-            opt_vector[7] = True # beta
-
-        # Update the user defined optimization flags
-        if 'p' in opt_dict: opt_vector[0] = opt_dict['p']
-        if 'q' in opt_dict: opt_vector[1] = opt_dict['q']
-        if 'theta' in opt_dict: opt_vector[2] = opt_dict['theta']
-        if 'x_i' in opt_dict: opt_vector[3] = opt_dict['x_i']
-        if 'y_i' in opt_dict: opt_vector[4] = opt_dict['y_i']
-        if 'z_i' in opt_dict: opt_vector[5] = opt_dict['z_i']
-        if 'alpha' in opt_dict: opt_vector[6] = opt_dict['alpha']
-        if 'beta' in opt_dict: opt_vector[7] = opt_dict['beta']
-        if 'gamma' in opt_dict: opt_vector[8] = opt_dict['gamma']
-
-        return opt_vector
-
     # Initial values
     init_params = check_input_params(input_params_dict, x, y, v)
 
@@ -260,43 +901,8 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
     # Use NaN to identify the parameters which are required to optimize
     param_fix = init_params.copy()
     param_fix[opt_vector] = np.nan
-    param = init_params[opt_vector] # Only optimize parameters required to optimize
-
-    # Common cost function for optimization...........................................
-    def common_cost_function_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, param_fix, param):
-        #
-        # param_fix is the list of fixed parameters, and param is the list of
-        # parametres to optimize. It is important to have them always in the same
-        # order as p, q, theta, x_i, y_i, z_i, alpha, beta, gamma.
-        # The optimized parameters are those set as NaN.
-
-        # returns v1d_valid_res, v_fit, v_res
-
-        # Update parameters which need optimization................................
-        param_update = param_fix.copy()
-        param_update[np.isnan(param_fix)] = param
-
-        # Release the input parameters.............................................
-        p, q, theta, x_i, y_i, z_i, alpha, beta, gamma = param_update
-
-        # Generate surface height with (p, q, theta),
-        # considering tranformation with x_i, y_i, z_i, alpha, beta, gamma.........
-        if surface_generation_function == generate_2d_curved_surface_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, y_i, z_i, alpha, beta, gamma, v)
-        elif surface_generation_function == generate_2d_cylinder_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, z_i, alpha, beta, gamma, v)
-        elif surface_generation_function == generate_1d_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, z_i, beta, v)
-        elif surface_generation_function == generate_1d_slope:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, beta)
-
-        # Calculte the valid residual height as the output of the cost function....
-        v_res = v - v_fit
-        v1d_valid_res = v_res[np.isfinite(v_res)]
-
-        return v1d_valid_res, v_fit, v_res
-        
-    def cost_func_of_least_squares(param, x, y, v, param_fix):
+
+    def cost_func_of_least_squares(param, x, y, v, param_fix, standard_function):
         """
         Cost function to use scipy.optimize.least_squares module
 
@@ -308,6 +914,8 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
                 The measurement data.
             param_fix: `numpy.ndarray`
                 The fixed parameters
+            standard_function: `function`
+                The standard surface shape function or its surrogate
 
         Returns
         -------
@@ -316,14 +924,30 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
         """
 
         # Calculate the valid residuals
-        valid_res, _, _ = common_cost_function_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, param_fix, param)
+        valid_res, _, _ = common_cost_function_for_optimization(surface_generation_function, standard_function, x, y, v, param_fix, param)
         return valid_res
 
     # Only optimize the parameters which are required
     param = init_params[opt_vector] + np.ones_like(init_params[opt_vector]) * 1e-6 # Add a small value to the initial parameters
 
-    # Optimize with the least squares method
-    result = least_squares(cost_func_of_least_squares, param, args=(x, y, v, param_fix), method='trf')
+    # Progress callback and early stopping, over the coarse and the final iterations
+    fit_callback, stop_state = make_fit_callback(callback, max_time, target_rms, param_fix, opt_vector)
+
+    # Coarse iterations with the surrogate of the standard shape
+    surrogate = None
+    if isinstance(use_surrogate, StandardHeightSurrogate): # Built beforehand, e.g. by a FitSession
+        surrogate = use_surrogate if not np.any(opt_vector[:3]) else None
+    elif use_surrogate:
+        surrogate = build_surrogate_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, init_params, opt_vector)
+    if surrogate is not None:
+        param = least_squares(cost_func_of_least_squares, param, args=(x, y, v, param_fix, surrogate), method='trf', ftol=1e-5, xtol=1e-5, gtol=1e-5, callback=fit_callback).x
+
+    # Optimize with the least squares method, or only evaluate the exact residual and Jacobian 
+    # at the point where the coarse iterations were stopped
+    if stop_state['status'] is None:
+        result = least_squares(cost_func_of_least_squares, param, args=(x, y, v, param_fix, standard_surface_shape_function), method='trf', callback=fit_callback)
+    else:
+        result = least_squares(cost_func_of_least_squares, param, args=(x, y, v, param_fix, standard_surface_shape_function), method='trf', max_nfev=1)
     
     # Re-calculate the fitting and residual
     param_opt = result.x
@@ -335,46 +959,14 @@ def optimize_parameters_with_opt(surface_generation_function: types.FunctionType
     param_result = np.copy(param_fix)
     param_result[opt_vector] = result.x # Optimization result
 
-    def calculate_ci_95(result):
-        
-        # Step 1: Extract information
-        J = result.jac                      # Jacobian matrix (m x n)
-        residuals = result.fun             # residual vector (m,)
-        n_params = len(result.x)           # number of parameters
-        dof = max(1, len(residuals) - n_params)  # degrees of freedom
-
-        # Step 2: Estimate residual variance
-        s_sq = np.sum(residuals**2) / dof
-
-        # Step 3: Estimate parameter covariance matrix
-        pcov = np.linalg.inv(J.T @ J) * s_sq
-
-        # Step 4: Standard deviation (1σ) of each parameter
-        perr = np.sqrt(np.diag(pcov))
-
-        # Step 5: Compute 95.45% confidence intervals (±2σ)
-        ci_lower = result.x - 2 * perr
-        ci_upper = result.x + 2 * perr
-        ci = np.vstack((ci_lower, ci_upper)).T  # Shape (n_params, 2)
-        return ci
-    
     # Get 95% confidence intervals
     param_ci_result = np.zeros((param_fix.size, 2))
     param_ci_result[opt_vector] = calculate_ci_95(result)
 
-
-    str_param_name_list = ['p', 'q', 'theta',
-                            'x_i', 'y_i', 'z_i', 
-                            'alpha', 'beta', 'gamma']
-
-    init_params_dict = {}
-    opt_params_dict = {}
-    opt_params_ci_dict = {}
     # Release the initial and optimized values
-    for idx, str_param_name in enumerate(str_param_name_list):
-        init_params_dict[str_param_name] = init_params[idx] if opt_vector[idx] else param_fix[idx]
-        opt_params_dict[str_param_name] = param_result[idx] if opt_vector[idx] else param_fix[idx]
-        opt_params_ci_dict[str_param_name] = param_ci_result[idx] if opt_vector[idx] else np.full(2, np.nan)
+    opt_params_dict, opt_params_ci_dict, init_params_dict = release_params_dicts(init_params, param_fix, param_result, param_ci_result, opt_vector)
+    opt_params_dict = OptParamsDict(opt_params_dict)
+    opt_params_dict.status = stop_state['status'] or ('converged' if result.status > 0 else 'max_nfev')
         
     return v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
 
@@ -385,6 +977,10 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
                                  v: np.ndarray, 
                                  input_params_dict: dict, 
                                  tol_dict: dict,
+                                 use_surrogate: bool = False,
+                                 callback: types.FunctionType = None,
+                                 max_time: float = None,
+                                 target_rms: float = None,
                                  ):
     """
     Basic function to provide a convenient way to optimize the surface parameters with tolerances.
@@ -395,10 +991,10 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
             The function to generate surface (1D or 2D, slope or height)
         standard_surface_shape_function: `function` 
             The function handle for a standard surface shape 
-        x: `numpy.ndarray`
-            The measured x-coordinate in in unit of [m] as a suggestion
+        x: `numpy.ndarray` or `RegularGrid`
+            The measured x-coordinate in in unit of [m] as a suggestion, or the grid of a 2D map
         y: `numpy.ndarray`
-            The measured y-coordinate in in unit of [m] as a suggestion
+            The measured y-coordinate in in unit of [m] as a suggestion, None for a grid
         v: `numpy.ndarray`
             The measured slope or height in [rad] or [m] as a suggestion
         input_params_dict: `dict`
@@ -409,6 +1005,16 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
         tol_dict: `dict`
             The structure to set the tolerances for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        use_surrogate: `bool` or `StandardHeightSurrogate`
+            If True, use a surrogate of the standard shape for the coarse iterations 
+            when ``p``, ``q`` and ``theta`` are fixed, or the given surrogate built beforehand
+        callback: `function`
+            The function called after each iteration with the intermediate ``OptimizeResult``, 
+            see ``make_fit_callback``
+        max_time: `float`
+            The time budget of the optimization in seconds
+        target_rms: `float`
+            The residual RMS at which the fit stops
 
     Returns
     -------
@@ -416,62 +1022,14 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
             The residual (1D or 2D)
         v_fit: `numpy.ndarray`
             The fitting result (1D or 2D)
-        opt_params_dict: `dict`
-            The optimized parameters in dictionary
+        opt_params_dict: `OptParamsDict`
+            The optimized parameters in dictionary, with the ``status`` of the optimization
         opt_params_ci_dict: `dict`
             The confidence intervals of the optimized parameters in dictionary
         init_params_dict: `dict`
             The used initial parameters.
     """
 
-    def check_tol_dict(tol_dict, surface_generation_function): 
-        
-        opt_vector = np.zeros(9, dtype=bool)
-
-        if surface_generation_function == generate_2d_curved_surface_height:
-            opt_vector[3:] = True # x_i, y_i, z_i, alpha, beta, gamma
-        elif surface_generation_function == generate_2d_cylinder_height:
-            opt_vector[3] = True # x_i
-            opt_vector[5] = True # z_i
-            opt_vector[6:] = True # alpha, beta, gamma
-        elif surface_generation_function == generate_1d_height:
-            opt_vector[3] = True # x_i
-            opt_vector[5] = True # z_i
-            opt_vector[7] = True # beta
-        elif surface_generation_function == generate_1d_slope:
-            opt_vector[3] = True # x_i
-            opt_vector[7] = True # beta
-
-        keys = ['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']
-        tol_vector = np.zeros((9, 2))
-
-        def unify_tol_struct_format(tol_dict, str_key, is_opt):
-            unified_tol_dict = tol_dict.copy()
-            # If the field exists
-            if str_key in unified_tol_dict:
-                val = unified_tol_dict[str_key]
-                if np.isscalar(val):
-                    unified_tol_dict[str_key] = np.array([-1, 1]) * val
-                else:
-                    assert np.size(val) <= 2
-                    unified_tol_dict[str_key] = np.array(val)
-            else:
-                if is_opt:
-                    unified_tol_dict[str_key] = np.array([-np.inf, np.inf])
-                else:
-                    unified_tol_dict[str_key] = np.array([0, 0])
-            return unified_tol_dict
-        # Check the tolerance structure and unify the format
-        for num in range(9):
-            # Unify the tolerance structure format as two boundaries
-            unified_tol_dict = unify_tol_struct_format(tol_dict, keys[num], opt_vector[num])
-            # Update the user defined optimization flags
-            opt_vector[num] = not np.all(np.array(unified_tol_dict[keys[num]]) == 0)
-            # Update the tolerance vector
-            tol_vector[num, :] = unified_tol_dict[keys[num]]
-
-        return opt_vector, tol_vector
-
     # Initial values
     init_params = check_input_params(input_params_dict, x, y, v)
 
@@ -481,43 +1039,8 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
     # Use NaN to identify the parameters which are required to optimize
     param_fix = init_params.copy()
     param_fix[opt_vector] = np.nan
-    param = init_params[opt_vector] # Only optimize parameters required to optimize
-
-    # Common cost function for optimization...........................................
-    def common_cost_function_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, param_fix, param):
-        #
-        # param_fix is the list of fixed parameters, and param is the list of
-        # parametres to optimize. It is important to have them always in the same
-        # order as p, q, theta, x_i, y_i, z_i, alpha, beta, gamma.
-        # The optimized parameters are those set as NaN.
-
-        # returns v1d_valid_res, v_fit, v_res
-
-        # Update parameters which need optimization................................
-        param_update = param_fix.copy()
-        param_update[np.isnan(param_fix)] = param
-
-        # Release the input parameters.............................................
-        p, q, theta, x_i, y_i, z_i, alpha, beta, gamma = param_update
-
-        # Generate surface height with (p, q, theta),
-        # considering tranformation with x_i, y_i, z_i, alpha, beta, gamma.........
-        if surface_generation_function == generate_2d_curved_surface_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, y_i, z_i, alpha, beta, gamma, v)
-        elif surface_generation_function == generate_2d_cylinder_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, y, p, q, theta, x_i, z_i, alpha, beta, gamma, v)
-        elif surface_generation_function == generate_1d_height:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, z_i, beta, v)
-        elif surface_generation_function == generate_1d_slope:
-            v_fit = surface_generation_function(standard_surface_shape_function, x, p, q, theta, x_i, beta)
-
-        # Calculte the valid residual height as the output of the cost function....
-        v_res = v - v_fit
-        v1d_valid_res = v_res[np.isfinite(v_res)]
-
-        return v1d_valid_res, v_fit, v_res
-        
-    def cost_func_of_least_squares(param, x, y, v, param_fix):
+
+    def cost_func_of_least_squares(param, x, y, v, param_fix, standard_function):
         """
         Cost function to use scipy.optimize.least_squares module
 
@@ -529,6 +1052,8 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
                 The measurement data.
             param_fix: `numpy.ndarray`
                 The fixed parameters
+            standard_function: `function`
+                The standard surface shape function or its surrogate
 
         Returns
         -------
@@ -537,7 +1062,7 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
         """
 
         # Calculate the valid residuals
-        valid_res, _, _ = common_cost_function_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, param_fix, param)
+        valid_res, _, _ = common_cost_function_for_optimization(surface_generation_function, standard_function, x, y, v, param_fix, param)
         return valid_res
 
     # Only optimize the parameters which are required
@@ -547,8 +1072,24 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
     lb = param + tol_vector[opt_vector, 0]
     ub = param + tol_vector[opt_vector, 1]
 
-    # Optimize with the least squares method
-    result = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], args=(x, y, v, param_fix), method='trf')
+    # Progress callback and early stopping, over the coarse and the final iterations
+    fit_callback, stop_state = make_fit_callback(callback, max_time, target_rms, param_fix, opt_vector)
+
+    # Coarse iterations with the surrogate of the standard shape
+    surrogate = None
+    if isinstance(use_surrogate, StandardHeightSurrogate): # Built beforehand, e.g. by a FitSession
+        surrogate = use_surrogate if not np.any(opt_vector[:3]) else None
+    elif use_surrogate:
+        surrogate = build_surrogate_for_optimization(surface_generation_function, standard_surface_shape_function, x, y, v, init_params, opt_vector)
+    if surrogate is not None:
+        param = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], args=(x, y, v, param_fix, surrogate), method='trf', ftol=1e-5, xtol=1e-5, gtol=1e-5, callback=fit_callback).x
+
+    # Optimize with the least squares method, or only evaluate the exact residual and Jacobian 
+    # at the point where the coarse iterations were stopped
+    if stop_state['status'] is None:
+        result = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], args=(x, y, v, param_fix, standard_surface_shape_function), method='trf', callback=fit_callback)
+    else:
+        result = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], args=(x, y, v, param_fix, standard_surface_shape_function), method='trf', max_nfev=1)
 
     # Re-calculate the fitting and residual
     param_opt = result.x
@@ -560,44 +1101,834 @@ def optimize_parameters_with_tol(surface_generation_function: types.FunctionType
     param_result = np.copy(param_fix)
     param_result[opt_vector] = result.x # Optimization result
 
-    def calculate_ci_95(result):
-        
-        # Step 1: Extract information
-        J = result.jac                     # Jacobian matrix (m x n)
-        residuals = result.fun             # residual vector (m,)
-        n_params = len(result.x)           # number of parameters
-        dof = max(1, len(residuals) - n_params)  # degrees of freedom
-
-        # Step 2: Estimate residual variance
-        s_sq = np.sum(residuals**2) / dof
-
-        # Step 3: Estimate parameter covariance matrix
-        pcov = np.linalg.inv(J.T @ J) * s_sq
-
-        # Step 4: Standard deviation (1σ) of each parameter
-        perr = np.sqrt(np.diag(pcov))
-
-        # Step 5: Compute 95.45% confidence intervals (±2σ)
-        ci_lower = result.x - 2 * perr
-        ci_upper = result.x + 2 * perr
-        ci = np.vstack((ci_lower, ci_upper)).T  # Shape (n_params, 2)
-        return ci
-    
     # Get 95% confidence intervals
     param_ci_result = np.zeros((param_fix.size, 2))
     param_ci_result[opt_vector] = calculate_ci_95(result)
 
+    # Release the initial and optimized values
+    opt_params_dict, opt_params_ci_dict, init_params_dict = release_params_dicts(init_params, param_fix, param_result, param_ci_result, opt_vector)
+    opt_params_dict = OptParamsDict(opt_params_dict)
+    opt_params_dict.status = stop_state['status'] or ('converged' if result.status > 0 else 'max_nfev')
+
+    return v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
+
+def compute_sensitivity_maps(surface_generation_function: types.FunctionType,
+                             standard_surface_shape_function: types.FunctionType,
+                             x: np.ndarray,
+                             y: np.ndarray,
+                             nominal_params_dict: dict,
+                             step_dict: dict = None,
+                             ):
+    """
+    Precompute the nominal surface and its derivative maps with respect to every parameter.
+
+    The result only depends on the design and the grid, so it can be saved with
+    ``save_sensitivity_maps`` and reused to fit all mirrors of the same design
+    with ``optimize_parameters_linearized``.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x: `numpy.ndarray`
+            The x-coordinate in in unit of [m] as a suggestion
+        y: `numpy.ndarray`
+            The y-coordinate in in unit of [m] as a suggestion
+        nominal_params_dict: `dict`
+            The nominal ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) parameters, suggested in unit of 
+            [m] [m] [rad] [m] [m] [m] [rad] [rad] [rad]
+        step_dict: `dict`
+            The central difference steps for some of the parameters (optional)
+
+    Returns
+    -------
+        sensitivity_dict: `dict`
+            The ``v_nominal`` surface, the ``jac_maps`` derivative maps stacked along 
+            the first axis, the ``nominal_params``, the ``map_vector`` flags of the 
+            parameters with derivative maps, the grid and the functions.
+    """
+
+    x, y = resolve_grid(x, y)
+    nominal_params = check_input_params(nominal_params_dict, x, y, np.zeros(np.shape(x)))
+
+    # All parameters which take effect in the surface generation
+    map_vector = check_opt_dict({'p': True, 'q': True, 'theta': True}, surface_generation_function)
+
+    # Default steps for central differences
+    step_vector = np.array([1e-6*abs(nominal_params[0]), 1e-6*abs(nominal_params[1]), 1e-7, # p, q, theta
+                            1e-6, 1e-6, 1e-9, # x_i, y_i, z_i
+                            1e-7, 1e-7, 1e-7]) # alpha, beta, gamma
+    if step_dict is not None:
+        for idx, str_param_name in enumerate(['p', 'q', 'theta', 'x_i', 'y_i', 'z_i', 'alpha', 'beta', 'gamma']):
+            if str_param_name in step_dict:
+                step_vector[idx] = step_dict[str_param_name]
+
+    v_nominal = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, nominal_params)
+
+    jac_maps = np.zeros((np.count_nonzero(map_vector),) + v_nominal.shape)
+    for num, idx in enumerate(np.flatnonzero(map_vector)):
+        params_plus = nominal_params.copy()
+        params_minus = nominal_params.copy()
+        params_plus[idx] += step_vector[idx]
+        params_minus[idx] -= step_vector[idx]
+        v_plus = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, params_plus)
+        v_minus = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x, y, params_minus)
+        jac_maps[num] = (v_plus - v_minus) / (2*step_vector[idx])
+
+    sensitivity_dict = {
+        'surface_generation_function': surface_generation_function,
+        'standard_surface_shape_function': standard_surface_shape_function,
+        'x': x,
+        'y': y,
+        'nominal_params': nominal_params,
+        'map_vector': map_vector,
+        'v_nominal': v_nominal,
+        'jac_maps': jac_maps,
+    }
+
+    return sensitivity_dict
+
+def save_sensitivity_maps(file_path: str, sensitivity_dict: dict):
+    """
+    Save the sensitivity maps to a ``.npz`` file to reuse them for the same design.
+
+    Parameters
+    ----------
+        file_path: `str`
+            The file path
+        sensitivity_dict: `dict`
+            The sensitivity maps from ``compute_sensitivity_maps``
+    """
+
+    np.savez(file_path,
+             surface_generation_function=sensitivity_dict['surface_generation_function'].__name__,
+             standard_surface_shape_function=sensitivity_dict['standard_surface_shape_function'].__name__,
+             x=sensitivity_dict['x'],
+             y=sensitivity_dict['y'],
+             nominal_params=sensitivity_dict['nominal_params'],
+             map_vector=sensitivity_dict['map_vector'],
+             v_nominal=sensitivity_dict['v_nominal'],
+             jac_maps=sensitivity_dict['jac_maps'])
+
+def load_sensitivity_maps(file_path: str):
+    """
+    Load the sensitivity maps saved by ``save_sensitivity_maps``.
+
+    Parameters
+    ----------
+        file_path: `str`
+            The file path
+
+    Returns
+    -------
+        sensitivity_dict: `dict`
+            The sensitivity maps
+    """
+
+    from xmf import layer_01_standard, layer_02_generation
+
+    with np.load(file_path) as data:
+        sensitivity_dict = {key: data[key] for key in data.files}
+
+    sensitivity_dict['surface_generation_function'] = getattr(layer_02_generation, str(sensitivity_dict['surface_generation_function']))
+    sensitivity_dict['standard_surface_shape_function'] = getattr(layer_01_standard, str(sensitivity_dict['standard_surface_shape_function']))
+
+    return sensitivity_dict
+
+@profiled
+def optimize_parameters_linearized(sensitivity_dict: dict,
+                                   v: np.ndarray,
+                                   opt_or_tol_dict: dict,
+                                   n_gauss_newton: int = 0,
+                                   ):
+    """
+    Optimize the surface parameters with a linear solve on the precomputed sensitivity maps.
+
+    The measured surface is modelled as ``v_nominal + sum(jac_maps[k] * dparam[k])``.
+    With ``n_gauss_newton`` > 0, the surface is regenerated at the current parameters
+    and the residual is solved again with the same sensitivity maps.
+
+    Parameters
+    ----------
+        sensitivity_dict: `dict`
+            The sensitivity maps from ``compute_sensitivity_maps`` or ``load_sensitivity_maps``
+        v: `numpy.ndarray`
+            The measured slope or height in [rad] or [m] as a suggestion
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        n_gauss_newton: `int`
+            The number of Gauss-Newton corrections with surface regeneration
+
+    Returns
+    -------
+        v_res: `numpy.ndarray`
+            The residual (1D or 2D)
+        v_fit: `numpy.ndarray`
+            The fitting result (1D or 2D)
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters.
+    """
+
+    surface_generation_function = sensitivity_dict['surface_generation_function']
+    standard_surface_shape_function = sensitivity_dict['standard_surface_shape_function']
+    init_params = np.asarray(sensitivity_dict['nominal_params'], dtype=float)
+    map_vector = np.asarray(sensitivity_dict['map_vector'], dtype=bool)
+    v_nominal = sensitivity_dict['v_nominal']
+    jac_maps = sensitivity_dict['jac_maps']
+
+    if v.shape != v_nominal.shape:
+        raise ValueError("The measured data must have the same shape as the sensitivity maps.")
+
+    # Optimization flags and boundaries relative to the nominal parameters
+    if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
+        opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        tol_vector = np.tile([-np.inf, np.inf], (9, 1))
+    else: # Use tol_dict
+        opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+
+    if np.any(opt_vector & ~map_vector):
+        raise ValueError("The sensitivity maps do not cover all the parameters to optimize.")
+
+    param_fix = init_params.copy()
+    param_fix[opt_vector] = np.nan
+
+    # Design matrix of the valid pixels with normalized columns
+    A = jac_maps[opt_vector[map_vector]].reshape(np.count_nonzero(opt_vector), -1).T
+    is_valid = np.isfinite(v.ravel()) & np.isfinite(v_nominal.ravel()) & np.all(np.isfinite(A), axis=1)
+    A = A[is_valid]
+    col_norm = np.linalg.norm(A, axis=0)
+    col_norm[col_norm == 0] = 1
+    lb = tol_vector[opt_vector, 0] * col_norm
+    ub = tol_vector[opt_vector, 1] * col_norm
+
+    # Linear solve around the nominal surface
+    b = (v - v_nominal).ravel()[is_valid]
+    dparam = lsq_linear(A / col_norm, b, bounds=(lb, ub)).x / col_norm
+
+    # Gauss-Newton corrections with the same sensitivity maps
+    for _ in range(n_gauss_newton):
+        param_update = init_params.copy()
+        param_update[opt_vector] += dparam
+        v_gen = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, sensitivity_dict['x'], sensitivity_dict['y'], param_update, v)
+        b = (v - v_gen).ravel()[is_valid]
+        b[~np.isfinite(b)] = 0
+        dparam += lsq_linear(A / col_norm, b, bounds=(lb - dparam*col_norm, ub - dparam*col_norm)).x / col_norm
+
+    param_result = np.copy(param_fix)
+    param_result[opt_vector] = init_params[opt_vector] + dparam
+
+    # Use the linear model unless the surface is regenerated
+    if n_gauss_newton > 0:
+        v_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, sensitivity_dict['x'], sensitivity_dict['y'], param_result, v)
+    else:
+        v_fit = v_nominal + np.tensordot(dparam, jac_maps[opt_vector[map_vector]], axes=1)
+        v_fit = np.where(np.isfinite(v), v_fit, np.nan)
+    v_res = v - v_fit
+
+    # Get 95% confidence intervals
+    residuals = v_res.ravel()[is_valid]
+    residuals[~np.isfinite(residuals)] = 0
+    result = OptimizeResult(x=param_result[opt_vector], jac=A, fun=residuals)
+    param_ci_result = np.zeros((param_fix.size, 2))
+    param_ci_result[opt_vector] = calculate_ci_95(result)
+
+    # Release the initial and optimized values
+    opt_params_dict, opt_params_ci_dict, init_params_dict = release_params_dicts(init_params, param_fix, param_result, param_ci_result, opt_vector)
+
+    return v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
+
+@profiled
+def optimize_stacked_1d_parameters(surface_generation_function: types.FunctionType,
+                                   standard_surface_shape_function: types.FunctionType,
+                                   x1d: np.ndarray,
+                                   v2d: np.ndarray,
+                                   input_params_dict: dict,
+                                   opt_or_tol_dict: dict,
+                                   max_iter: int = 100,
+                                   ftol: float = 1e-8,
+                                   xtol: float = 1e-8,
+                                   ):
+    """
+    Optimize the parameters of K 1D profiles simultaneously.
+
+    The profiles share the x coordinates and are stacked along the first axis of ``v2d``.
+    The parameters are shaped (K, n_params), and each Levenberg-Marquardt iteration runs 
+    on all the unconverged profiles at once with the block-diagonal Jacobian, which is 
+    evaluated with one batched surface generation per parameter. The profiles which cannot 
+    be fitted, e.g. all-NaN scan lines outside the aperture or singular normal equations, 
+    get NaN parameters, confidence intervals and fits without stopping the others.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate 1D surface (``generate_1d_height`` or ``generate_1d_slope``)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x1d: `numpy.ndarray`
+            The measured x-coordinate in in unit of [m] as a suggestion
+        v2d: `numpy.ndarray`
+            The K measured slope or height profiles in shape of (K, x1d.size)
+        input_params_dict: `dict`
+            The ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) target parameters, as scalars or arrays in shape of (K,)
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        max_iter: `int`
+            The maximum number of iterations
+        ftol: `float`
+            The tolerance for the relative change of the cost function
+        xtol: `float`
+            The tolerance for the relative change of the parameters
+
+    Returns
+    -------
+        v2d_res: `numpy.ndarray`
+            The residuals in shape of (K, x1d.size)
+        v2d_fit: `numpy.ndarray`
+            The fitting results in shape of (K, x1d.size)
+        opt_params_dict: `dict`
+            The optimized parameters in arrays of shape (K,)
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in arrays of shape (K, 2)
+        init_params_dict: `dict`
+            The used initial parameters in arrays of shape (K,)
+    """
+
+    v2d = np.atleast_2d(v2d)
+    num_profiles = v2d.shape[0]
+    y1d = np.zeros_like(x1d)
+
+    # Initial values for each profile
+    init_params = np.array([check_input_params({key: np.broadcast_to(val, (num_profiles,))[k] for key, val in input_params_dict.items()}, x1d, y1d, v2d[k]) for k in range(num_profiles)])
+
+    # Optimization flags and boundaries, shared by all the profiles
+    if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
+        opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        tol_vector = np.tile([-np.inf, np.inf], (9, 1))
+    else: # Use tol_dict
+        opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+
+    param = init_params[:, opt_vector] + 1e-6 # Add a small value to the initial parameters
+    lb = param + tol_vector[opt_vector, 0]
+    ub = param + tol_vector[opt_vector, 1]
+    num_params = param.shape[1]
+    is_valid = np.isfinite(v2d)
+    # The profiles which cannot be fitted, e.g. scan lines outside the aperture, get NaN parameters
+    is_degenerate = (np.sum(is_valid, axis=1) < num_params) | ~np.all(np.isfinite(param), axis=1)
+
+    def is_invertible(A):
+        # The finite and well-conditioned matrices of a stack in shape of (k, n_params, n_params)
+        is_ok = np.all(np.isfinite(A), axis=(1, 2))
+        if np.any(is_ok):
+            is_ok[is_ok] = np.linalg.cond(A[is_ok]) < 1 / np.finfo(float).eps
+        return is_ok
+
+    def stacked_residuals(param, idx):
+        # Residuals of the selected profiles, with zeros at the invalid points
+        param_update = init_params[idx].copy()
+        param_update[:, opt_vector] = param
+        v_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x1d, y1d, param_update.T, v2d[idx])
+        v_res = v2d[idx] - v_fit
+        return np.where(is_valid[idx] & np.isfinite(v_res), v_res, 0), v_fit
+
+    def stacked_jacobian(param, res, idx):
+        # Forward differences of all the selected profiles at once, in shape of (k, x1d.size, n_params)
+        jac = np.zeros(res.shape + (num_params,))
+        for j in range(num_params):
+            step = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(param[:, j]))
+            param_step = param.copy()
+            param_step[:, j] += step
+            res_step, _ = stacked_residuals(param_step, idx)
+            jac[:, :, j] = (res_step - res) / step[:, np.newaxis]
+        return jac
+
+    res, _ = stacked_residuals(param, np.arange(num_profiles))
+    cost = 0.5 * np.sum(res**2, axis=1)
+    damping = np.full(num_profiles, 1e-3)
+    is_active = ~is_degenerate
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(is_active)
+        if idx.size == 0:
+            break
+
+        # Levenberg-Marquardt step for each of the active profiles
+        jac = stacked_jacobian(param[idx], res[idx], idx)
+        JtJ = np.einsum('kmi,kmj->kij', jac, jac)
+        Jtr = np.einsum('kmi,km->ki', jac, res[idx])
+        diag_JtJ = np.einsum('kii->ki', JtJ)
+        A = JtJ + (damping[idx, np.newaxis] * np.maximum(diag_JtJ, np.finfo(float).tiny))[:, :, np.newaxis] * np.eye(num_params)
+        # Freeze the singular profiles instead of failing the whole stack
+        is_solvable = is_invertible(A)
+        is_degenerate[idx[~is_solvable]] = True
+        is_active[idx[~is_solvable]] = False
+        idx, A, Jtr = idx[is_solvable], A[is_solvable], Jtr[is_solvable]
+        if idx.size == 0:
+            break
+        step = -np.linalg.solve(A, Jtr[:, :, np.newaxis])[:, :, 0]
+        param_trial = np.clip(param[idx] + step, lb[idx], ub[idx])
+
+        res_trial, _ = stacked_residuals(param_trial, idx)
+        cost_trial = 0.5 * np.sum(res_trial**2, axis=1)
+
+        # Accept the improved profiles and adapt the damping
+        is_better = cost_trial < cost[idx]
+        is_converged = (is_better & (cost[idx] - cost_trial <= ftol * cost[idx])) | \
+                       (np.linalg.norm(param_trial - param[idx], axis=1) <= xtol * (xtol + np.linalg.norm(param[idx], axis=1)))
+        accepted = idx[is_better]
+        param[accepted] = param_trial[is_better]
+        res[accepted] = res_trial[is_better]
+        cost[accepted] = cost_trial[is_better]
+        damping[idx] = np.where(is_better, damping[idx] / 10, damping[idx] * 10)
+        is_active[idx[is_converged]] = False
+
+    # Re-calculate the fitting and residual
+    param[is_degenerate] = np.nan
+    all_idx = np.arange(num_profiles)
+    _, v2d_fit = stacked_residuals(param, all_idx)
+    v2d_res = v2d - v2d_fit
+
+    # Get 95% confidence intervals of each profile
+    res = np.where(is_valid, v2d_res, 0)
+    jac = stacked_jacobian(param, res, all_idx)
+    dof = np.maximum(1, np.sum(is_valid, axis=1) - num_params)
+    s_sq = np.sum(res**2, axis=1) / dof
+    JtJ = np.einsum('kmi,kmj->kij', jac, jac)
+    is_solvable = ~is_degenerate & is_invertible(JtJ)
+    pcov = np.full(JtJ.shape, np.nan)
+    pcov[is_solvable] = np.linalg.inv(JtJ[is_solvable]) * s_sq[is_solvable, np.newaxis, np.newaxis]
+    perr = np.sqrt(np.einsum('kii->ki', pcov))
 
-    # Release the optimized values
     str_param_name_list = ['p', 'q', 'theta',
                            'x_i', 'y_i', 'z_i', 
                            'alpha', 'beta', 'gamma']
+    param_result = init_params.copy()
+    param_result[:, opt_vector] = param
+    param_ci_result = np.full((num_profiles, 9, 2), np.nan)
+    param_ci_result[:, opt_vector, 0] = param - 2 * perr
+    param_ci_result[:, opt_vector, 1] = param + 2 * perr
+
     init_params_dict = {}
     opt_params_dict = {}
     opt_params_ci_dict = {}
     for idx, str_param_name in enumerate(str_param_name_list):
-        init_params_dict[str_param_name] = init_params[idx] if opt_vector[idx] else param_fix[idx]
-        opt_params_dict[str_param_name] = param_result[idx] if opt_vector[idx] else param_fix[idx]
-        opt_params_ci_dict[str_param_name] = param_ci_result[idx] if opt_vector[idx] else np.full(2, np.nan)
+        init_params_dict[str_param_name] = init_params[:, idx]
+        opt_params_dict[str_param_name] = param_result[:, idx]
+        opt_params_ci_dict[str_param_name] = param_ci_result[:, idx]
+
+    return v2d_res, v2d_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
+
+@profiled
+def optimize_joint_parameters(surface_generation_function: types.FunctionType,
+                              standard_surface_shape_function: types.FunctionType,
+                              x_list: list,
+                              y_list: list,
+                              v_list: list,
+                              input_params_dict: dict,
+                              opt_or_tol_dict: dict,
+                              tr_solver: str = 'exact',
+                              ):
+    """
+    Optimize the parameters of K subapertures jointly, with shared ``p``, ``q``, ``theta``.
 
-    return v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict
+    Each subaperture has its own ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma`` 
+    in its own metrology coordinates. All the subapertures are solved as one least-squares 
+    problem with a block-sparse Jacobian: the rows of a subaperture only depend on the 
+    shared parameters and its own parameters. The finite differences are grouped by this 
+    structure, so a Jacobian takes as many surface generations as for one subaperture. 
+    The structure can also be passed to ``least_squares`` as ``jac_sparsity`` with the 
+    ``lsmr`` trust-region solver for a large number of subapertures.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x_list: `list`
+            The measured x-coordinates of the subapertures in in unit of [m] as a suggestion
+        y_list: `list`
+            The measured y-coordinates of the subapertures in in unit of [m] as a suggestion, 
+            or None for 1D profiles
+        v_list: `list`
+            The measured slopes or heights of the subapertures in [rad] or [m] as a suggestion
+        input_params_dict: `dict`
+            The shared ``p``, ``q``, ``theta`` and the ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) as scalars or sequences of length K
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``, 
+            applied to every subaperture.
+        tr_solver: `str`
+            ``'exact'`` to solve the trust-region subproblems with the grouped finite-difference 
+            Jacobian, or ``'lsmr'`` with ``jac_sparsity``, which is cheaper per iteration but 
+            may stop earlier on ill-conditioned problems
+
+    Returns
+    -------
+        v_res_list: `list`
+            The residuals of the subapertures
+        v_fit_list: `list`
+            The fitting results of the subapertures
+        opt_params_dict: `dict`
+            The optimized parameters, the shared ones as scalars and the others in arrays of shape (K,)
+        opt_params_ci_dict: `dict`
+            The confidence intervals, the shared ones in shape of (2,) and the others in shape of (K, 2)
+        init_params_dict: `dict`
+            The used initial parameters, the shared ones as scalars and the others in arrays of shape (K,)
+    """
+
+    num_subapertures = len(v_list)
+    if y_list is None:
+        y_list = [np.zeros_like(x) for x in x_list]
+
+    # Initial values for each subaperture, with shared p, q and theta
+    init_params = np.array([check_input_params({key: val if key in ('p', 'q', 'theta') else np.broadcast_to(val, (num_subapertures,))[k] for key, val in input_params_dict.items()}, x_list[k], y_list[k], v_list[k]) for k in range(num_subapertures)])
+
+    # Optimization flags and boundaries
+    if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
+        opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        tol_vector = np.tile([-np.inf, np.inf], (9, 1))
+    else: # Use tol_dict
+        opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+    shared_vector = opt_vector & np.array([True]*3 + [False]*6)
+    local_vector = opt_vector & np.array([False]*3 + [True]*6)
+    num_shared = np.sum(shared_vector)
+    num_local = np.sum(local_vector)
+
+    # Parameter vector as [shared, local of subaperture 1, ..., local of subaperture K]
+    param = np.concatenate((init_params[0, shared_vector], init_params[:, local_vector].ravel())) + 1e-6 # Add a small value to the initial parameters
+    tol = np.concatenate((tol_vector[shared_vector], np.tile(tol_vector[local_vector], (num_subapertures, 1))))
+    lb = param + tol[:, 0]
+    ub = param + tol[:, 1]
+
+    # Each subaperture depends on the shared parameters and its own local parameters
+    is_valid_list = [np.isfinite(v) for v in v_list]
+    num_valid = [np.sum(val) for val in is_valid_list]
+    row_offsets = np.concatenate(([0], np.cumsum(num_valid)))
+    jac_sparsity = lil_matrix((row_offsets[-1], param.size), dtype=int)
+    for k in range(num_subapertures):
+        rows = slice(row_offsets[k], row_offsets[k+1])
+        jac_sparsity[rows, :num_shared] = 1
+        jac_sparsity[rows, num_shared + k*num_local:num_shared + (k+1)*num_local] = 1
+
+    def subaperture_params(param):
+        params = init_params.copy()
+        params[:, shared_vector] = param[:num_shared]
+        params[:, local_vector] = param[num_shared:].reshape(num_subapertures, num_local)
+        return params
+
+    def cost_func_of_least_squares(param):
+        # Valid residuals of all the subapertures, with zeros where the fitting is invalid
+        params = subaperture_params(param)
+        valid_res = []
+        for k in range(num_subapertures):
+            v_fit = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x_list[k], y_list[k], params[k], v_list[k])
+            v_res = (v_list[k] - v_fit)[is_valid_list[k]]
+            valid_res.append(np.where(np.isfinite(v_res), v_res, 0))
+        return np.concatenate(valid_res)
+
+    def jac_of_least_squares(param):
+        # Forward differences with the columns grouped by the sparsity: each shared parameter 
+        # alone, and each local parameter of all the subapertures at once
+        res = cost_func_of_least_squares(param)
+        jac = np.zeros((res.size, param.size))
+        groups = [[j] for j in range(num_shared)] + [list(num_shared + np.arange(num_subapertures)*num_local + j) for j in range(num_local)]
+        for group in groups:
+            step = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(param[group]))
+            param_step = param.copy()
+            param_step[group] += step
+            res_step = cost_func_of_least_squares(param_step)
+            for k, j in enumerate(group):
+                rows = slice(row_offsets[0], row_offsets[-1]) if len(group) == 1 else slice(row_offsets[k], row_offsets[k+1])
+                jac[rows, j] = (res_step[rows] - res[rows]) / step[k]
+        return jac
+
+    # Optimize with the least squares method
+    if tr_solver == 'lsmr':
+        result = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], method='trf', jac_sparsity=jac_sparsity, tr_solver='lsmr')
+    else:
+        result = least_squares(cost_func_of_least_squares, param, bounds=[lb, ub], method='trf', jac=jac_of_least_squares)
+
+    # Re-calculate the fitting and residual
+    param_result = subaperture_params(result.x)
+    v_fit_list = [generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x_list[k], y_list[k], param_result[k], v_list[k]) for k in range(num_subapertures)]
+    v_res_list = [v - v_fit for v, v_fit in zip(v_list, v_fit_list)]
+
+    # Get 95% confidence intervals
+    ci = calculate_ci_95(result)
+    param_ci_result = np.full((num_subapertures, 9, 2), np.nan)
+    param_ci_result[:, shared_vector] = ci[:num_shared]
+    param_ci_result[:, local_vector] = ci[num_shared:].reshape(num_subapertures, num_local, 2)
+
+    # Release the results, the shared parameters as scalars
+    str_param_name_list = ['p', 'q', 'theta',
+                           'x_i', 'y_i', 'z_i', 
+                           'alpha', 'beta', 'gamma']
+    init_params_dict = {}
+    opt_params_dict = {}
+    opt_params_ci_dict = {}
+    for idx, str_param_name in enumerate(str_param_name_list):
+        if idx < 3:
+            init_params_dict[str_param_name] = init_params[0, idx]
+            opt_params_dict[str_param_name] = param_result[0, idx]
+            opt_params_ci_dict[str_param_name] = param_ci_result[0, idx]
+        else:
+            init_params_dict[str_param_name] = init_params[:, idx]
+            opt_params_dict[str_param_name] = param_result[:, idx]
+            opt_params_ci_dict[str_param_name] = param_ci_result[:, idx]
+
+    return v_res_list, v_fit_list, opt_params_dict, opt_params_ci_dict, init_params_dict
+
+def iter_row_chunks(shape: tuple, chunk_elements: int):
+    """
+    Iterate over the chunks of whole rows along the first axis.
+
+    Parameters
+    ----------
+        shape: `tuple`
+            The shape of the data
+        chunk_elements: `int`
+            The maximum number of points in a chunk
+
+    Returns
+    -------
+        rows: `generator`
+            The row slice of each chunk
+    """
+
+    num_rows = max(1, chunk_elements // max(1, int(np.prod(shape[1:]))))
+    for start in range(0, shape[0], num_rows):
+        yield slice(start, min(start + num_rows, shape[0]))
+
+def read_row_chunk(x, y, v, rows: slice):
+    """
+    Read one chunk of the coordinates and the measurement into memory.
+
+    Parameters
+    ----------
+        x: `numpy.ndarray`, `numpy.memmap`, HDF5 dataset or `RegularGrid`
+            The x-coordinate
+        y: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The y-coordinate, None for a grid or a 1D profile
+        v: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The measured slope or height
+        rows: `slice`
+            The rows of the chunk
+
+    Returns
+    -------
+        x_chunk: `numpy.ndarray`
+            The x-coordinate of the chunk
+        y_chunk: `numpy.ndarray`
+            The y-coordinate of the chunk
+        v_chunk: `numpy.ndarray`
+            The measured slope or height of the chunk
+    """
+
+    v_chunk = np.asarray(v[rows], dtype=float)
+    if isinstance(x, RegularGrid):
+        return x.x2d[rows], x.y2d[rows], v_chunk
+    x_chunk = np.asarray(x[rows], dtype=float)
+    y_chunk = np.zeros_like(x_chunk) if y is None else np.asarray(y[rows], dtype=float)
+    return x_chunk, y_chunk, v_chunk
+
+@profiled
+def optimize_parameters_out_of_core(surface_generation_function: types.FunctionType,
+                                    standard_surface_shape_function: types.FunctionType,
+                                    x,
+                                    y,
+                                    v,
+                                    input_params_dict: dict,
+                                    opt_or_tol_dict: dict,
+                                    v_res_out = None,
+                                    v_fit_out = None,
+                                    chunk_elements: int = 2**20,
+                                    max_iter: int = 100,
+                                    ftol: float = 1e-8,
+                                    xtol: float = 1e-8,
+                                    ):
+    """
+    Optimize the surface parameters of a map streamed from disk in chunks of rows.
+
+    The data can be ``numpy.memmap`` arrays (e.g. ``numpy.load(..., mmap_mode='r')``), HDF5 
+    datasets or anything else sliced along the first axis, so only one chunk is in memory 
+    at a time. Each Levenberg-Marquardt iteration streams the chunks once and only keeps 
+    the normal equations ``JᵀJ`` and ``Jᵀr``, with the forward-difference Jacobian of a 
+    chunk from one batched surface generation. The temporaries of a chunk take about 
+    ``chunk_elements * (n_params + 1)`` values. The final fit and residual are written 
+    chunk by chunk to ``v_fit_out`` and ``v_res_out``.
+
+    Parameters
+    ----------
+        surface_generation_function: `function`
+            The function to generate surface (1D or 2D, slope or height)
+        standard_surface_shape_function: `function` 
+            The function handle for a standard surface shape 
+        x: `numpy.ndarray`, `numpy.memmap`, HDF5 dataset or `RegularGrid`
+            The measured x-coordinate in in unit of [m] as a suggestion, or the grid of a 2D map
+        y: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The measured y-coordinate in in unit of [m] as a suggestion, None for a grid or a 1D profile
+        v: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The measured slope or height in [rad] or [m] as a suggestion
+        input_params_dict: `dict`
+            The ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) target parameters, suggested in unit of 
+            [m] [m] [rad] [m] [m] [m] [rad] [rad] [rad]
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        v_res_out: `numpy.ndarray`, `numpy.memmap`, HDF5 dataset or `str`
+            The output of the residual in the shape of ``v``, or the path of a ``.npy`` file 
+            to create as a memory map. If None, it is allocated in memory.
+        v_fit_out: `numpy.ndarray`, `numpy.memmap`, HDF5 dataset or `str`
+            The output of the fitting result, as ``v_res_out``
+        chunk_elements: `int`
+            The maximum number of points in a chunk
+        max_iter: `int`
+            The maximum number of iterations
+        ftol: `float`
+            The tolerance for the relative change of the cost function
+        xtol: `float`
+            The tolerance for the relative change of the parameters
+
+    Returns
+    -------
+        v_res: `numpy.ndarray`
+            The residual written to ``v_res_out``
+        v_fit: `numpy.ndarray`
+            The fitting result written to ``v_fit_out``
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters.
+    """
+
+    shape = tuple(v.shape)
+    if isinstance(x, RegularGrid) and x.shape != shape:
+        raise ValueError(f"The grid shape {x.shape} does not match the data shape {shape}.")
+
+    # Default x_i and y_i from the mean of the valid points, streamed over the chunks
+    input_params_dict = dict(input_params_dict)
+    if 'x_i' not in input_params_dict or 'y_i' not in input_params_dict:
+        sum_x, sum_y, count = 0.0, 0.0, 0
+        for rows in iter_row_chunks(shape, chunk_elements):
+            x_chunk, y_chunk, v_chunk = read_row_chunk(x, y, v, rows)
+            is_valid = np.isfinite(v_chunk)
+            sum_x += np.sum(x_chunk[is_valid])
+            sum_y += np.sum(y_chunk[is_valid])
+            count += np.count_nonzero(is_valid)
+        input_params_dict.setdefault('x_i', sum_x / count)
+        input_params_dict.setdefault('y_i', sum_y / count)
+    init_params = check_input_params(input_params_dict, None, None, None)
+
+    # Optimization flags and boundaries
+    if isinstance(opt_or_tol_dict['p'], bool): # Use opt_dict
+        opt_vector = check_opt_dict(opt_or_tol_dict, surface_generation_function)
+        tol_vector = np.tile([-np.inf, np.inf], (9, 1))
+    else: # Use tol_dict
+        opt_vector, tol_vector = check_tol_dict(opt_or_tol_dict, surface_generation_function)
+
+    param = init_params[opt_vector] + 1e-6 # Add a small value to the initial parameters
+    lb = param + tol_vector[opt_vector, 0]
+    ub = param + tol_vector[opt_vector, 1]
+    num_params = param.size
+
+    def chunk_surfaces(param, x_chunk, y_chunk, v_chunk, with_jacobian):
+        # The surface and the forward-difference steps of the chunk in one batched generation
+        steps = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(param))
+        param_batch = np.tile(init_params[:, np.newaxis], (1, num_params + 1 if with_jacobian else 1))
+        param_batch[opt_vector] = param[:, np.newaxis]
+        if with_jacobian:
+            param_batch[np.flatnonzero(opt_vector), np.arange(1, num_params + 1)] += steps
+        v_batch = generate_surface_with_params(surface_generation_function, standard_surface_shape_function, x_chunk, y_chunk, param_batch, v_chunk)
+        return v_batch.reshape((param_batch.shape[1],) + v_chunk.shape), steps
+
+    def stream_normal_equations(param, with_jacobian, v_res_out=None, v_fit_out=None):
+        # Stream the chunks once and reduce them to the cost and the normal equations
+        cost, count = 0.0, 0
+        JtJ = np.zeros((num_params, num_params))
+        Jtr = np.zeros(num_params)
+        for rows in iter_row_chunks(shape, chunk_elements):
+            x_chunk, y_chunk, v_chunk = read_row_chunk(x, y, v, rows)
+            v_batch, steps = chunk_surfaces(param, x_chunk, y_chunk, v_chunk, with_jacobian)
+            v_res = v_chunk - v_batch[0]
+            is_valid = np.isfinite(v_res)
+            res = v_res[is_valid]
+            cost += 0.5 * np.sum(res**2)
+            count += res.size
+            if with_jacobian:
+                jac = (v_batch[0][is_valid] - v_batch[1:, is_valid]).T / steps
+                jac[~np.isfinite(jac)] = 0
+                JtJ += jac.T @ jac
+                Jtr += jac.T @ res
+            if v_res_out is not None:
+                v_res_out[rows] = v_res
+                v_fit_out[rows] = v_batch[0]
+        return cost, count, JtJ, Jtr
+
+    cost, _, JtJ, Jtr = stream_normal_equations(param, True)
+    damping = 1e-3
+    for _ in range(max_iter):
+        # Levenberg-Marquardt step from the normal equations
+        A = JtJ + damping * np.diag(np.maximum(np.diag(JtJ), np.finfo(float).tiny))
+        param_trial = np.clip(param - np.linalg.solve(A, Jtr), lb, ub)
+        cost_trial, _, _, _ = stream_normal_equations(param_trial, False)
+
+        is_better = cost_trial < cost
+        is_converged = is_better and ((cost - cost_trial <= ftol * cost) or \
+                                      (np.linalg.norm(param_trial - param) <= xtol * (xtol + np.linalg.norm(param))))
+        if is_better:
+            param = param_trial
+            damping /= 10
+            cost, _, JtJ, Jtr = stream_normal_equations(param, True)
+        else:
+            damping *= 10
+        if is_converged:
+            break
+
+    # Write the fitting result and the residual, and get the final normal equations
+    if isinstance(v_res_out, str):
+        v_res_out = np.lib.format.open_memmap(v_res_out, mode='w+', dtype=float, shape=shape)
+    elif v_res_out is None:
+        v_res_out = np.empty(shape)
+    if isinstance(v_fit_out, str):
+        v_fit_out = np.lib.format.open_memmap(v_fit_out, mode='w+', dtype=float, shape=shape)
+    elif v_fit_out is None:
+        v_fit_out = np.empty(shape)
+    cost, count, JtJ, _ = stream_normal_equations(param, True, v_res_out, v_fit_out)
+    if isinstance(v_res_out, np.memmap):
+        v_res_out.flush()
+    if isinstance(v_fit_out, np.memmap):
+        v_fit_out.flush()
+
+    # Get 95% confidence intervals
+    s_sq = 2 * cost / max(1, count - num_params)
+    perr = np.sqrt(np.diag(np.linalg.inv(JtJ)) * s_sq)
+
+    param_fix = init_params.copy()
+    param_fix[opt_vector] = np.nan
+    param_result = np.copy(param_fix)
+    param_result[opt_vector] = param
+    param_ci_result = np.zeros((param_fix.size, 2))
+    param_ci_result[opt_vector] = np.vstack((param - 2 * perr, param + 2 * perr)).T
+
+    # Release the initial and optimized values
+    opt_params_dict, opt_params_ci_dict, init_params_dict = release_params_dicts(init_params, param_fix, param_result, param_ci_result, opt_vector)
+
+    return v_res_out, v_fit_out, opt_params_dict, opt_params_ci_dict, init_params_dict
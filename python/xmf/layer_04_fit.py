@@ -23,6 +23,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
+
 import numpy as np
 
 from xmf.layer_01_standard import (
@@ -47,25 +49,36 @@ from xmf.layer_02_generation import (
     generate_1d_slope,
     generate_2d_curved_surface_height,
     generate_2d_cylinder_height,
+    resolve_grid,
 )
 
-from xmf.layer_03_optimization import optimize_parameters
+from xmf.layer_03_optimization import (
+    build_surrogate_for_optimization,
+    check_input_params,
+    check_opt_dict,
+    check_tol_dict,
+    optimize_parameters,
+    optimize_stacked_1d_parameters,
+    optimize_joint_parameters,
+    optimize_parameters_out_of_core,
+)
 
 def fit_convex_ellipsoid_height(x2d: np.ndarray,
                                 y2d: np.ndarray,
                                 z2d: np.ndarray,
                                 input_params_dict: dict,
                                 opt_or_tol_dict: dict,
+                                **kwargs,
                                 ):
     """
     Fit the convex ellipsoid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `numpy.ndarray`
@@ -73,6 +86,8 @@ def fit_convex_ellipsoid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -88,7 +103,7 @@ def fit_convex_ellipsoid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_convex_ellipsoid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_convex_ellipsoid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 
 def fit_concave_ellipsoid_height(x2d: np.ndarray,
@@ -96,16 +111,17 @@ def fit_concave_ellipsoid_height(x2d: np.ndarray,
                                   z2d: np.ndarray,
                                   input_params_dict: dict,
                                   opt_or_tol_dict: dict,
+                                  **kwargs,
                                 ):
     """
     Fit the concave ellipsoid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `dict`
@@ -113,6 +129,8 @@ def fit_concave_ellipsoid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -128,7 +146,7 @@ def fit_concave_ellipsoid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_concave_ellipsoid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_concave_ellipsoid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 
 
@@ -137,16 +155,17 @@ def fit_convex_elliptic_cylinder_height(x2d: np.ndarray,
                                   z2d: np.ndarray,
                                   input_params_dict: dict,
                                   opt_or_tol_dict: dict,
+                                  **kwargs,
                                 ):
     """
     Fit the convex elliptic cylinder parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         opt_params_dict: `dict`
@@ -154,6 +173,8 @@ def fit_convex_elliptic_cylinder_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -169,7 +190,7 @@ def fit_convex_elliptic_cylinder_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_cylinder_height, standard_convex_elliptic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_cylinder_height, standard_convex_elliptic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 
 
@@ -178,16 +199,17 @@ def fit_concave_elliptic_cylinder_height(x2d: np.ndarray,
                                   z2d: np.ndarray,
                                   input_params_dict: dict,
                                   opt_or_tol_dict: dict,
+                                  **kwargs,
                                 ):
     """
     Fit the concave elliptic cylinder parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         opt_params_dict: `dict`
@@ -195,6 +217,8 @@ def fit_concave_elliptic_cylinder_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -210,13 +234,14 @@ def fit_concave_elliptic_cylinder_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_cylinder_height, standard_concave_elliptic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_cylinder_height, standard_concave_elliptic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 
 def fit_convex_ellipse_height(x1d: np.ndarray,
                               z1d: np.ndarray,
                               input_params_dict: dict,
                               opt_or_tol_dict: dict,
+                              **kwargs,
                               ):
     """
     Fit the convex ellipse parameters from a measured height profile.
@@ -232,6 +257,8 @@ def fit_convex_ellipse_height(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -249,12 +276,13 @@ def fit_convex_ellipse_height(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_height, standard_convex_elliptic_cylinder_height, x1d, y1d, z1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_height, standard_convex_elliptic_cylinder_height, x1d, y1d, z1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_concave_ellipse_height(x1d: np.ndarray,
                                 z1d: np.ndarray,
                                 input_params_dict: dict,
                                 opt_or_tol_dict: dict,
+                                **kwargs,
                                 ):
     """
     Fit the concave ellipse parameters from a measured height profile.
@@ -270,6 +298,8 @@ def fit_concave_ellipse_height(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -287,12 +317,13 @@ def fit_concave_ellipse_height(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_height, standard_concave_elliptic_cylinder_height, x1d, y1d, z1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_height, standard_concave_elliptic_cylinder_height, x1d, y1d, z1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_convex_ellipse_slope(x1d: np.ndarray,
                               sx1d: np.ndarray,
                               input_params_dict: dict,
                               opt_or_tol_dict: dict,
+                              **kwargs,
                               ):
     """
     Fit the convex ellipse parameters from a measured slope profile.
@@ -308,6 +339,8 @@ def fit_convex_ellipse_slope(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -325,12 +358,13 @@ def fit_convex_ellipse_slope(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)
 
-    return optimize_parameters(generate_1d_slope, standard_convex_elliptic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_slope, standard_convex_elliptic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_concave_ellipse_slope(x1d: np.ndarray,
                                sx1d: np.ndarray,
                                input_params_dict: dict,
                                opt_or_tol_dict: dict,
+                               **kwargs,
                                 ):
     """
     Fit the concave ellipse parameters from a measured slope profile.
@@ -346,6 +380,8 @@ def fit_concave_ellipse_slope(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -363,7 +399,7 @@ def fit_concave_ellipse_slope(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_slope, standard_concave_elliptic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_slope, standard_concave_elliptic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 
 def fit_convex_hyperboloid_height(x2d: np.ndarray,
@@ -371,16 +407,17 @@ def fit_convex_hyperboloid_height(x2d: np.ndarray,
                                   z2d: np.ndarray,
                                   input_params_dict: dict,
                                   opt_or_tol_dict: dict,
+                                  **kwargs,
                                 ):
     """
     Fit the convex hyperboloid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `numpy.ndarray`
@@ -388,6 +425,8 @@ def fit_convex_hyperboloid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -403,23 +442,24 @@ def fit_convex_hyperboloid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_convex_hyperboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_convex_hyperboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_concave_hyperboloid_height(x2d: np.ndarray,
                                     y2d: np.ndarray,
                                     z2d: np.ndarray,
                                     input_params_dict: dict,
                                     opt_or_tol_dict: dict,
+                                    **kwargs,
                                     ):
     """
     Fit the concave hyperboloid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `numpy.ndarray`
@@ -427,6 +467,8 @@ def fit_concave_hyperboloid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -442,23 +484,24 @@ def fit_concave_hyperboloid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_concave_hyperboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_concave_hyperboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_convex_hyperbolic_cylinder_height(x2d: np.ndarray,
                                            y2d: np.ndarray,
                                            z2d: np.ndarray,
                                            input_params_dict: dict,
                                            opt_or_tol_dict: dict,
+                                           **kwargs,
                                                     ):
     """
     Fit the convex hyperbolic cylinder parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         opt_params_dict: `dict`
@@ -466,6 +509,8 @@ def fit_convex_hyperbolic_cylinder_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -481,23 +526,24 @@ def fit_convex_hyperbolic_cylinder_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return  optimize_parameters(generate_2d_cylinder_height, standard_convex_hyperbolic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return  optimize_parameters(generate_2d_cylinder_height, standard_convex_hyperbolic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_concave_hyperbolic_cylinder_height(x2d: np.ndarray,
                                            y2d: np.ndarray,
                                            z2d: np.ndarray,
                                            input_params_dict: dict,
                                            opt_or_tol_dict: dict,
+                                           **kwargs,
                                                     ):
     """
     Fit the concave hyperbolic cylinder parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         opt_params_dict: `dict`
@@ -505,6 +551,8 @@ def fit_concave_hyperbolic_cylinder_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -520,12 +568,13 @@ def fit_concave_hyperbolic_cylinder_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return  optimize_parameters(generate_2d_cylinder_height, standard_concave_hyperbolic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return  optimize_parameters(generate_2d_cylinder_height, standard_concave_hyperbolic_cylinder_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_convex_hyperbola_height(x1d: np.ndarray,
                                  z1d_measured: np.ndarray,
                                  input_params_dict: dict,
                                  opt_1d_cylinder_height: dict,
+                                 **kwargs,
                                     ):
     """
     Fit the convex hyperbola parameters from a measured height profile.
@@ -541,6 +590,8 @@ def fit_convex_hyperbola_height(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -558,12 +609,13 @@ def fit_convex_hyperbola_height(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_height, standard_convex_hyperbolic_cylinder_height, x1d, y1d, z1d_measured, input_params_dict, opt_1d_cylinder_height)
+    return optimize_parameters(generate_1d_height, standard_convex_hyperbolic_cylinder_height, x1d, y1d, z1d_measured, input_params_dict, opt_1d_cylinder_height, **kwargs)
 
 def fit_concave_hyperbola_height(x1d: np.ndarray,
                                   z1d_measured: np.ndarray,
                                   input_params_dict: dict,
                                   opt_1d_cylinder_height: dict,
+                                  **kwargs,
                                   ):
     """
     Fit the concave hyperbola parameters from a measured height profile.
@@ -579,6 +631,8 @@ def fit_concave_hyperbola_height(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -596,12 +650,13 @@ def fit_concave_hyperbola_height(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_height, standard_concave_hyperbolic_cylinder_height, x1d, y1d, z1d_measured, input_params_dict, opt_1d_cylinder_height)
+    return optimize_parameters(generate_1d_height, standard_concave_hyperbolic_cylinder_height, x1d, y1d, z1d_measured, input_params_dict, opt_1d_cylinder_height, **kwargs)
 
 def fit_convex_hyperbola_slope(x1d: np.ndarray,
                                 sx1d: np.ndarray,
                                 input_params_dict: dict,
                                 opt_or_tol_dict: dict,
+                                **kwargs,
                                   ):
     """
     Fit the convex hyperbola parameters from a measured slope profile.
@@ -617,6 +672,8 @@ def fit_convex_hyperbola_slope(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -634,12 +691,13 @@ def fit_convex_hyperbola_slope(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_slope, standard_convex_hyperbolic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_slope, standard_convex_hyperbolic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_concave_hyperbola_slope(x1d: np.ndarray,
                                  sx1d: np.ndarray,
                                  input_params_dict: dict,
                                  opt_or_tol_dict: dict,
+                                 **kwargs,
                                     ):
     """
     Fit the concave hyperbola parameters from a measured slope profile.
@@ -655,6 +713,8 @@ def fit_concave_hyperbola_slope(x1d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -672,23 +732,24 @@ def fit_concave_hyperbola_slope(x1d: np.ndarray,
 
     y1d = np.zeros_like(x1d)  # No need to consider y-coordinates in metrology coordinates for 1D case
 
-    return optimize_parameters(generate_1d_slope, standard_concave_hyperbolic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_1d_slope, standard_concave_hyperbolic_cylinder_xslope, x1d, y1d, sx1d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_sag_col_diaboloid_height(x2d: np.ndarray,
                                  y2d: np.ndarray,
                                  z2d: np.ndarray,
                                  input_params_dict: dict,
                                  opt_or_tol_dict: dict,
+                                 **kwargs,
                                  ):
     """
     Fit the sagittal collimating diaboloid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `dict`
@@ -696,6 +757,8 @@ def fit_sag_col_diaboloid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -711,23 +774,24 @@ def fit_sag_col_diaboloid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_sag_col_diaboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_sag_col_diaboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
 
 def fit_tan_col_diaboloid_height(x2d: np.ndarray,
                                  y2d: np.ndarray,
                                  z2d: np.ndarray,
                                  input_params_dict: dict,
                                  opt_or_tol_dict: dict,
+                                 **kwargs,
                                  ):
     """
     Fit the tangential collimating diaboloid parameters from a measured height map.
 
     Parameters
     ----------
-        x2d: `numpy.ndarray`
-            The x coordinate in the suggested unit of [m]
+        x2d: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
         y2d: `numpy.ndarray`
-            The y coordinate in the suggested unit of [m]
+            The y coordinate in the suggested unit of [m], None for a grid
         z2d: `numpy.ndarray`
             The z coordinate in the suggested unit of [m]
         input_params_dict: `dict`
@@ -735,6 +799,8 @@ def fit_tan_col_diaboloid_height(x2d: np.ndarray,
         opt_or_tol_dict: `dict`
             The structure to set whether optimization flag or tolerance for 
             ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
         init_params_dict: `dict`
             The used initial parameters.
             
@@ -750,4 +816,358 @@ def fit_tan_col_diaboloid_height(x2d: np.ndarray,
             The confidence intervals of the optimized parameters in dictionary
     """
 
-    return optimize_parameters(generate_2d_curved_surface_height, standard_tan_col_diaboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict)
+    return optimize_parameters(generate_2d_curved_surface_height, standard_tan_col_diaboloid_height, x2d, y2d, z2d, input_params_dict, opt_or_tol_dict, **kwargs)
+
+
+# The generation and standard shape functions used by each fitting function
+fit_model_dict = {
+    'fit_convex_ellipsoid_height': (generate_2d_curved_surface_height, standard_convex_ellipsoid_height),
+    'fit_concave_ellipsoid_height': (generate_2d_curved_surface_height, standard_concave_ellipsoid_height),
+    'fit_convex_elliptic_cylinder_height': (generate_2d_cylinder_height, standard_convex_elliptic_cylinder_height),
+    'fit_concave_elliptic_cylinder_height': (generate_2d_cylinder_height, standard_concave_elliptic_cylinder_height),
+    'fit_convex_ellipse_height': (generate_1d_height, standard_convex_elliptic_cylinder_height),
+    'fit_concave_ellipse_height': (generate_1d_height, standard_concave_elliptic_cylinder_height),
+    'fit_convex_ellipse_slope': (generate_1d_slope, standard_convex_elliptic_cylinder_xslope),
+    'fit_concave_ellipse_slope': (generate_1d_slope, standard_concave_elliptic_cylinder_xslope),
+    'fit_convex_hyperboloid_height': (generate_2d_curved_surface_height, standard_convex_hyperboloid_height),
+    'fit_concave_hyperboloid_height': (generate_2d_curved_surface_height, standard_concave_hyperboloid_height),
+    'fit_convex_hyperbolic_cylinder_height': (generate_2d_cylinder_height, standard_convex_hyperbolic_cylinder_height),
+    'fit_concave_hyperbolic_cylinder_height': (generate_2d_cylinder_height, standard_concave_hyperbolic_cylinder_height),
+    'fit_convex_hyperbola_height': (generate_1d_height, standard_convex_hyperbolic_cylinder_height),
+    'fit_concave_hyperbola_height': (generate_1d_height, standard_concave_hyperbolic_cylinder_height),
+    'fit_convex_hyperbola_slope': (generate_1d_slope, standard_convex_hyperbolic_cylinder_xslope),
+    'fit_concave_hyperbola_slope': (generate_1d_slope, standard_concave_hyperbolic_cylinder_xslope),
+    'fit_sag_col_diaboloid_height': (generate_2d_curved_surface_height, standard_sag_col_diaboloid_height),
+    'fit_tan_col_diaboloid_height': (generate_2d_curved_surface_height, standard_tan_col_diaboloid_height),
+}
+
+def get_fit_model(model):
+    """
+    Get the generation and standard shape functions of a fitting model.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipse_slope``, or its name 
+            with or without the ``fit_`` prefix, e.g. ``'concave_ellipse_slope'``
+
+    Returns
+    -------
+        surface_generation_function: `function`
+            The function to generate the surface
+        standard_surface_shape_function: `function` 
+            The function handle for the standard surface shape 
+    """
+
+    name = model if isinstance(model, str) else model.__name__
+    if not name.startswith('fit_'):
+        name = 'fit_' + name
+    if name not in fit_model_dict:
+        raise ValueError(f"Unknown fitting model: {model}. The supported models are {', '.join(fit_model_dict)}.")
+    return fit_model_dict[name]
+
+def get_fit_function(model):
+    """
+    Get the fitting function of a model.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function or its name with or without the ``fit_`` prefix
+
+    Returns
+    -------
+        fit_function: `function`
+            The fitting function, e.g. ``fit_concave_ellipse_slope``
+    """
+
+    if not isinstance(model, str):
+        get_fit_model(model)
+        return model
+    name = model if model.startswith('fit_') else 'fit_' + model
+    get_fit_model(name)
+    return globals()[name]
+
+def fit_stacked_profiles(model,
+                         x1d: np.ndarray,
+                         v2d: np.ndarray,
+                         input_params_dict: dict,
+                         opt_or_tol_dict: dict,
+                         **kwargs,
+                         ):
+    """
+    Fit a stack of 1D profiles measured at the same x coordinates simultaneously.
+
+    This gives the same results as calling the 1D fitting function for each row of ``v2d``, 
+    but all the profiles are iterated together with batched surface generation.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The 1D fitting function, e.g. ``fit_concave_ellipse_slope``, or its name
+        x1d: `numpy.ndarray`
+            The x coordinate in the suggested unit of [m]
+        v2d: `numpy.ndarray`
+            The K measured height or slope profiles in shape of (K, x1d.size)
+        input_params_dict: `dict`
+            The ``p``, ``q``, ``theta``, etc. as scalars or arrays in shape of (K,)
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_stacked_1d_parameters``, e.g. ``max_iter``
+
+    Returns
+    -------
+        v2d_residual: `numpy.ndarray`
+            The residuals after the best fit in shape of (K, x1d.size)
+        v2d_fit: `numpy.ndarray`
+            The fitted profiles in shape of (K, x1d.size)
+        opt_params_dict: `dict`
+            The optimized parameters in arrays of shape (K,)
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in arrays of shape (K, 2)
+        init_params_dict: `dict`
+            The used initial parameters in arrays of shape (K,)
+    """
+
+    surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+    if surface_generation_function not in (generate_1d_height, generate_1d_slope):
+        raise ValueError(f"The model {model} is not a 1D profile model.")
+
+    return optimize_stacked_1d_parameters(surface_generation_function, standard_surface_shape_function, x1d, v2d, input_params_dict, opt_or_tol_dict, **kwargs)
+
+def fit_joint_subapertures(model,
+                           x_list: list,
+                           y_list: list,
+                           v_list: list,
+                           input_params_dict: dict,
+                           opt_or_tol_dict: dict,
+                           **kwargs,
+                           ):
+    """
+    Fit overlapping subapertures of one mirror jointly with shared ``p``, ``q``, ``theta``.
+
+    Each subaperture keeps its own ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma`` 
+    in its own metrology coordinates.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``, or its name
+        x_list: `list`
+            The x coordinates of the subapertures in the suggested unit of [m]
+        y_list: `list`
+            The y coordinates of the subapertures in the suggested unit of [m], or None for 1D models
+        v_list: `list`
+            The measured heights or slopes of the subapertures
+        input_params_dict: `dict`
+            The shared ``p``, ``q``, ``theta``, and the other parameters as scalars or sequences of length K
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_joint_parameters``, e.g. ``tr_solver``
+
+    Returns
+    -------
+        v_residual_list: `list`
+            The residuals of the subapertures after the best fit
+        v_fit_list: `list`
+            The fitted heights or slopes of the subapertures
+        opt_params_dict: `dict`
+            The optimized parameters, the shared ones as scalars and the others in arrays of shape (K,)
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters in dictionary
+    """
+
+    surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+
+    return optimize_joint_parameters(surface_generation_function, standard_surface_shape_function, x_list, y_list, v_list, input_params_dict, opt_or_tol_dict, **kwargs)
+
+def fit_out_of_core(model,
+                    x,
+                    y,
+                    v,
+                    input_params_dict: dict,
+                    opt_or_tol_dict: dict,
+                    **kwargs,
+                    ):
+    """
+    Fit a map larger than the memory, streamed in chunks of rows from memory-mapped data.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``, or its name
+        x: `numpy.ndarray`, `numpy.memmap`, HDF5 dataset or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
+        y: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The y coordinate in the suggested unit of [m], None for a grid or a 1D profile
+        v: `numpy.ndarray`, `numpy.memmap` or HDF5 dataset
+            The measured height or slope
+        input_params_dict: `dict`
+            The ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+            ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+            ``gamma`` (optional) target parameters
+        opt_or_tol_dict: `dict`
+            The structure to set whether optimization flag or tolerance for 
+            ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+        kwargs:
+            The additional options passed to ``optimize_parameters_out_of_core``, 
+            e.g. ``v_res_out``, ``v_fit_out`` or ``chunk_elements``
+
+    Returns
+    -------
+        v_residual: `numpy.ndarray`
+            The residual after the best fit, written to ``v_res_out``
+        v_fit: `numpy.ndarray`
+            The fitted surface, written to ``v_fit_out``
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters in dictionary
+    """
+
+    surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+    return optimize_parameters_out_of_core(surface_generation_function, standard_surface_shape_function, x, y, v, input_params_dict, opt_or_tol_dict, **kwargs)
+
+class FitSession:
+    """
+    A session fitting several maps, or the same map several times, on one grid.
+
+    With ``use_surrogate``, the surrogate of the standard shape is built once for each 
+    (``p``, ``q``, ``theta``) over the whole grid and reused by all the fits of the session, 
+    as long as it covers the grid around (``x_i``, ``y_i``) and ``p``, ``q``, ``theta`` are 
+    fixed. The last result can be used as the starting point of the next fit, e.g. freeing 
+    ``theta`` after an alignment-only pass.
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function, e.g. ``fit_concave_ellipsoid_height``, or its name
+        x: `numpy.ndarray` or `RegularGrid`
+            The x coordinate in the suggested unit of [m], or the grid of x and y axes
+        y: `numpy.ndarray`
+            The y coordinate in the suggested unit of [m], None for a grid or a 1D profile
+        max_surrogates: `int`
+            The maximum number of surrogates kept, the least recently used are dropped
+    """
+
+    def __init__(self, model, x, y=None, max_surrogates: int = 4):
+        self.fit_function = get_fit_function(model)
+        self.surface_generation_function, self.standard_surface_shape_function = get_fit_model(model)
+        self.is_1d = self.surface_generation_function in (generate_1d_height, generate_1d_slope)
+        self.x = x
+        self.y = None if self.is_1d else y
+        x_resolved, y_resolved = resolve_grid(x, self.y)
+        self.shape = np.shape(x_resolved)
+        self.x_range = (np.min(x_resolved), np.max(x_resolved))
+        self.y_range = (0.0, 0.0) if self.is_1d else (np.min(y_resolved), np.max(y_resolved))
+        self.surrogate_dict = collections.OrderedDict()
+        self.max_surrogates = max_surrogates
+        self.last_result = None
+
+    def get_surrogate(self, init_params_dict: dict):
+        """
+        Get the surrogate of the standard shape over the whole grid, built once for each (``p``, ``q``, ``theta``)
+
+        Parameters
+        ----------
+            init_params_dict: `dict`
+                The initial parameters with ``p``, ``q``, ``theta``, ``x_i`` and ``y_i``
+        Returns
+        -------
+            surrogate: `StandardHeightSurrogate`
+                The surrogate, or None if it is not applicable
+        """
+
+        if self.surface_generation_function != generate_2d_curved_surface_height:
+            return None
+
+        x_i, y_i = init_params_dict['x_i'], init_params_dict['y_i']
+        key = (init_params_dict['p'], init_params_dict['q'], init_params_dict['theta'])
+        if key in self.surrogate_dict:
+            self.surrogate_dict.move_to_end(key)
+            if self.surrogate_dict[key] is None: # Not applicable to this shape
+                return None
+        surrogate = self.surrogate_dict.get(key)
+        if surrogate is not None and surrogate.x_range[0] <= self.x_range[0] - x_i and self.x_range[1] - x_i <= surrogate.x_range[1] \
+                and surrogate.y_range[0] <= self.y_range[0] - y_i and self.y_range[1] - y_i <= surrogate.y_range[1]:
+            return surrogate
+
+        init_params = np.array([*key, x_i, y_i, 0, 0, 0, 0])
+        surrogate = build_surrogate_for_optimization(self.surface_generation_function, self.standard_surface_shape_function, 
+                                                     self.x, self.y, np.broadcast_to(0.0, self.shape), init_params, np.zeros(9, dtype=bool))
+        self.surrogate_dict[key] = surrogate
+        self.surrogate_dict.move_to_end(key)
+        while len(self.surrogate_dict) > self.max_surrogates:
+            self.surrogate_dict.popitem(last=False)
+        return surrogate
+
+    def fit(self, v: np.ndarray, input_params_dict: dict, opt_or_tol_dict: dict, warm_start=False, **kwargs):
+        """
+        Fit a measured map or profile on the grid of the session
+
+        Parameters
+        ----------
+            v: `numpy.ndarray`
+                The measured height or slope on the grid
+            input_params_dict: `dict`
+                The ``p``, ``q``, ``theta``, ``x_i`` (optional), ``y_i`` (optional), 
+                ``z_i`` (optional), ``alpha`` (optional), ``beta`` (optional) and 
+                ``gamma`` (optional) target parameters
+            opt_or_tol_dict: `dict`
+                The structure to set whether optimization flag or tolerance for 
+                ``p``, ``q``, ``theta``, ``x_i``, ``y_i``, ``z_i``, ``alpha``, ``beta``, ``gamma``.
+            warm_start: `bool` or `dict`
+                If True, start from the optimized parameters of the last fit of the session, 
+                or from the given parameters, overriding ``input_params_dict``. The tolerances 
+                are relative to the starting point.
+            kwargs:
+                The additional options passed to ``optimize_parameters``, e.g. ``use_surrogate``, ``ci_method``, ``callback``, ``max_time`` or ``target_rms``
+
+        Returns
+        -------
+            v_res: `numpy.ndarray`
+                The residual
+            v_fit: `numpy.ndarray`
+                The fitting result
+            opt_params_dict: `dict`
+                The optimized parameters in dictionary
+            opt_params_ci_dict: `dict`
+                The confidence intervals of the optimized parameters in dictionary
+            init_params_dict: `dict`
+                The used initial parameters
+        """
+
+        params_dict = dict(input_params_dict)
+        if warm_start is True and self.last_result is not None:
+            params_dict.update(self.last_result[2])
+        elif isinstance(warm_start, dict):
+            params_dict.update(warm_start)
+
+        # The surrogate is only used with p, q, theta fixed
+        if isinstance(opt_or_tol_dict['p'], bool):
+            opt_vector = check_opt_dict(opt_or_tol_dict, self.surface_generation_function)
+        else:
+            opt_vector, _ = check_tol_dict(opt_or_tol_dict, self.surface_generation_function)
+
+        if kwargs.get('use_surrogate') is True and self.surface_generation_function == generate_2d_curved_surface_height and not np.any(opt_vector[:3]):
+            # The default x_i and y_i are the mean coordinates of the valid points, as in the fit
+            str_param_name_list = ['p', 'q', 'theta',
+                                   'x_i', 'y_i', 'z_i', 
+                                   'alpha', 'beta', 'gamma']
+            init_params_dict = dict(zip(str_param_name_list, check_input_params(params_dict, self.x, self.y, v)))
+            kwargs['use_surrogate'] = self.get_surrogate(init_params_dict) or False
+
+        if self.is_1d:
+            result = self.fit_function(self.x, v, params_dict, opt_or_tol_dict, **kwargs)
+        else:
+            result = self.fit_function(self.x, self.y, v, params_dict, opt_or_tol_dict, **kwargs)
+        self.last_result = result
+        return result
@@ -0,0 +1,373 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import threading
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from xmf.layer_02_generation import (
+    generate_1d_height,
+    generate_1d_slope,
+)
+
+from xmf.layer_04_fit import get_fit_model, get_fit_function
+
+
+def create_shared_array(shape: tuple, dtype=float):
+    """
+    Allocate an array in a new shared memory block
+
+    Parameters
+    ----------
+        shape: `tuple`
+            The array shape
+        dtype: `numpy.dtype`
+            The array data type
+    Returns
+    -------
+        shm: `multiprocessing.shared_memory.SharedMemory`
+            The shared memory block, to close and unlink after use
+        descriptor: `tuple`
+            The block name, shape and data type to attach the array in another process
+        array: `numpy.ndarray`
+            The array in the block
+    """
+
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, (shm.name, tuple(shape), dtype.str), array
+
+
+def attach_shared_array(descriptor: tuple):
+    """
+    Attach an array in a shared memory block created by another process
+
+    Parameters
+    ----------
+        descriptor: `tuple`
+            The block name, shape and data type from ``create_shared_array``
+    Returns
+    -------
+        shm: `multiprocessing.shared_memory.SharedMemory`
+            The shared memory block, to close after use
+        array: `numpy.ndarray`
+            The array in the block without copy
+    """
+
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def fit_shared_worker(model,
+                      x_descriptor,
+                      y_descriptor,
+                      v_descriptor,
+                      v_res_descriptor: tuple,
+                      v_fit_descriptor: tuple,
+                      input_params_dict: dict,
+                      opt_or_tol_dict: dict,
+                      kwargs: dict):
+    """
+    Fit the arrays in shared memory and write the residual and the fitting result in place
+
+    Parameters
+    ----------
+        model: `function` or `str`
+            The fitting function or its name
+        x_descriptor: `tuple` or `RegularGrid`
+            The descriptor of x, or the grid itself
+        y_descriptor: `tuple`
+            The descriptor of y, None for a grid or a 1D profile
+        v_descriptor: `tuple`
+            The descriptor of the measured height or slope
+        v_res_descriptor: `tuple`
+            The descriptor of the output residual
+        v_fit_descriptor: `tuple`
+            The descriptor of the output fitting result
+        input_params_dict: `dict`
+            The initial parameters
+        opt_or_tol_dict: `dict`
+            The optimization flags or tolerances
+        kwargs: `dict`
+            The additional options passed to the fitting function
+    Returns
+    -------
+        opt_params_dict: `dict`
+            The optimized parameters in dictionary
+        opt_params_ci_dict: `dict`
+            The confidence intervals of the optimized parameters in dictionary
+        init_params_dict: `dict`
+            The used initial parameters
+    """
+
+    shm_list = []
+    def attach(descriptor):
+        if not isinstance(descriptor, tuple):
+            return descriptor
+        shm, array = attach_shared_array(descriptor)
+        shm_list.append(shm)
+        return array
+
+    try:
+        x, y, v, v_res_out, v_fit_out = [attach(descriptor) for descriptor in (x_descriptor, y_descriptor, v_descriptor, v_res_descriptor, v_fit_descriptor)]
+        fit_function = get_fit_function(model)
+        surface_generation_function, _ = get_fit_model(model)
+        if surface_generation_function in (generate_1d_height, generate_1d_slope):
+            v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict = fit_function(x, v, input_params_dict, opt_or_tol_dict, **kwargs)
+        else:
+            v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict = fit_function(x, y, v, input_params_dict, opt_or_tol_dict, **kwargs)
+        v_res_out[...] = v_res
+        v_fit_out[...] = v_fit
+        del x, y, v, v_res_out, v_fit_out # Release the views before closing the blocks
+    finally:
+        for shm in shm_list:
+            try:
+                shm.close()
+            except BufferError: # The views are still referenced after an error
+                pass
+
+    return opt_params_dict, opt_params_ci_dict, init_params_dict
+
+
+def warm_up_worker():
+    """
+    Run small 1D and 2D fits so the first real fit of a worker does not pay the first-call costs
+    """
+
+    x1d = np.linspace(-0.01, 0.01, 21)
+    x2d, y2d = np.meshgrid(x1d, x1d[::4])
+    params_dict = {'p': 30, 'q': 10, 'theta': 3e-3}
+    opt_dict = {'p': False, 'q': False, 'theta': False}
+    for model, x, y in (('concave_ellipse_height', x1d, None), ('concave_ellipsoid_height', x2d, y2d)):
+        surface_generation_function, standard_surface_shape_function = get_fit_model(model)
+        if y is None:
+            v = surface_generation_function(standard_surface_shape_function, x, 30, 10, 3e-3, 0, 0, 0)
+            get_fit_function(model)(x, v, params_dict, opt_dict)
+        else:
+            v = surface_generation_function(standard_surface_shape_function, x, y, 30, 10, 3e-3, 0, 0, 0, 0, 0, 0)
+            get_fit_function(model)(x, y, v, params_dict, opt_dict)
+
+
+class SharedMemoryFitPool:
+    """
+    A process pool fitting the maps through shared memory
+
+    The input arrays are copied once into shared memory blocks, and the workers write 
+    the residual and the fitting result into output blocks, so only the block names 
+    and the parameter dictionaries are pickled. The same coordinate arrays passed to 
+    several jobs share one block. All the blocks are unlinked when the pool is closed, 
+    also with the ``with`` statement.
+
+    Parameters
+    ----------
+        max_workers: `int`
+            The number of worker processes
+        warm_up: `bool`
+            If True, all the workers are started now and run ``warm_up_worker``
+    """
+
+    def __init__(self, max_workers: int = None, warm_up: bool = False):
+        self.max_workers = max_workers or os.cpu_count()
+        # Share the resource tracker with the workers, so they do not unlink the blocks at exit
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_up_worker if warm_up else None)
+        self.lock = threading.Lock()
+        self.shared_inputs = {} # id(array) -> [array, shm, descriptor, number of pending jobs]
+        self.shm_set = set()
+        if warm_up:
+            for future in [self.executor.submit(os.getpid) for _ in range(self.max_workers)]:
+                future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def share(self, array):
+        """
+        Get the descriptor of an input array, copying it into shared memory on first use
+
+        Parameters
+        ----------
+            array: `numpy.ndarray` or `RegularGrid`
+                The input array. ``RegularGrid`` and None are passed as they are.
+        Returns
+        -------
+            descriptor: `tuple`
+                The descriptor of the shared array
+        """
+
+        if not isinstance(array, np.ndarray):
+            return array
+        with self.lock:
+            if id(array) not in self.shared_inputs:
+                shm, descriptor, shared = create_shared_array(array.shape, np.float64)
+                shared[...] = array
+                self.shared_inputs[id(array)] = [array, shm, descriptor, 0] # Keep the array to keep its id
+                self.shm_set.add(shm)
+            entry = self.shared_inputs[id(array)]
+            entry[3] += 1 # Number of the pending jobs
+            return entry[2]
+
+    def release(self, array, unlink: bool):
+        """
+        Mark a job using an input array as done, and unlink the block if no job uses it
+
+        Parameters
+        ----------
+            array: `numpy.ndarray`
+                The input array given to ``submit``
+            unlink: `bool`
+                If True, the block is unlinked when no pending job uses it
+        """
+
+        if not isinstance(array, np.ndarray):
+            return
+        with self.lock:
+            entry = self.shared_inputs.get(id(array))
+            if entry is None:
+                return
+            entry[3] -= 1
+            if not unlink or entry[3] > 0:
+                return
+            del self.shared_inputs[id(array)]
+            self.shm_set.discard(entry[1])
+        entry[1].close()
+        entry[1].unlink()
+
+    def submit(self, model, x, y, v, input_params_dict: dict, opt_or_tol_dict: dict, release_v: bool = True, release_xy: bool = False, **kwargs):
+        """
+        Submit a fit to the pool
+
+        Parameters
+        ----------
+            model: `function` or `str`
+                The fitting function or its name, e.g. ``'concave_ellipsoid_height'``
+            x: `numpy.ndarray` or `RegularGrid`
+                The x coordinates, or the grid of a 2D map
+            y: `numpy.ndarray`
+                The y coordinates, None for a grid or a 1D profile
+            v: `numpy.ndarray`
+                The measured height or slope
+            input_params_dict: `dict`
+                The initial parameters
+            opt_or_tol_dict: `dict`
+                The optimization flags or tolerances
+            release_v: `bool`
+                If True, the block of ``v`` is unlinked when no pending fit uses it.
+            release_xy: `bool`
+                If True, the blocks of ``x`` and ``y`` are unlinked when no pending fit uses them. 
+                By default, they are kept for the next fits on the same coordinates until the pool is closed.
+            kwargs:
+                The additional options passed to the fitting function
+
+        Returns
+        -------
+            future: `concurrent.futures.Future`
+                The future of the fitting result, as the return of the fitting function
+        """
+
+        get_fit_model(model) # Fail early for an unknown model
+        v = np.asarray(v)
+        x_descriptor, y_descriptor, v_descriptor = self.share(x), self.share(y), self.share(v)
+        res_shm, res_descriptor, v_res = create_shared_array(np.shape(v))
+        fit_shm, fit_descriptor, v_fit = create_shared_array(np.shape(v))
+        with self.lock:
+            self.shm_set.update((res_shm, fit_shm))
+
+        future = Future()
+        def done(worker_future):
+            # Copy the outputs out of shared memory and unlink the blocks of the job
+            try:
+                opt_params_dict, opt_params_ci_dict, init_params_dict = worker_future.result()
+                future.set_result((v_res.copy(), v_fit.copy(), opt_params_dict, opt_params_ci_dict, init_params_dict))
+            except BaseException as err:
+                future.set_exception(err)
+            finally:
+                for shm in (res_shm, fit_shm):
+                    with self.lock:
+                        self.shm_set.discard(shm)
+                    shm.close()
+                    shm.unlink()
+                self.release(x, release_xy)
+                self.release(y, release_xy)
+                self.release(v, release_v)
+
+        worker_future = self.executor.submit(fit_shared_worker, model, x_descriptor, y_descriptor, v_descriptor,
+                                             res_descriptor, fit_descriptor, input_params_dict, opt_or_tol_dict, kwargs)
+        worker_future.add_done_callback(done)
+        return future
+
+    def map(self, model, x, y, v_list: list, input_params_dict: dict, opt_or_tol_dict: dict, **kwargs):
+        """
+        Fit several maps on the same coordinates
+
+        Parameters
+        ----------
+            model: `function` or `str`
+                The fitting function or its name
+            x: `numpy.ndarray` or `RegularGrid`
+                The x coordinates shared by all the maps, or the grid
+            y: `numpy.ndarray`
+                The y coordinates shared by all the maps, None for a grid or 1D profiles
+            v_list: `list`
+                The measured maps
+            input_params_dict: `dict`
+                The initial parameters
+            opt_or_tol_dict: `dict`
+                The optimization flags or tolerances
+            kwargs:
+                The additional options passed to the fitting function
+
+        Returns
+        -------
+            result_list: `list`
+                The fitting results in the order of ``v_list``
+        """
+
+        futures = [self.submit(model, x, y, v, input_params_dict, opt_or_tol_dict, **kwargs) for v in v_list]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Shut down the workers and unlink all the shared memory blocks
+        """
+
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            shm_list = list(self.shm_set)
+            self.shm_set.clear()
+            self.shared_inputs.clear()
+        for shm in shm_list:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,240 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# The profiler recording the calls, None when profiling is disabled
+active_profiler = None
+
+
+class Profiler:
+    """
+    The record of the timed calls and counters of a ``profile`` block
+
+    Attributes
+    ----------
+        span_list: `list`
+            The ``(name, start_ns, end_ns, thread_id)`` of each timed call
+        counter_dict: `dict`
+            The ``[number of records, sum of values]`` of each counter, e.g. the generation iterations
+    """
+
+    def __init__(self):
+        self.span_list = []
+        self.counter_dict = {}
+        self.lock = threading.Lock()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+
+    def add_span(self, name: str, start_ns: int, end_ns: int):
+        """
+        Record a timed call
+
+        Parameters
+        ----------
+            name: `str`
+                The name of the function
+            start_ns: `int`
+                The start time from ``time.perf_counter_ns``
+            end_ns: `int`
+                The end time from ``time.perf_counter_ns``
+        """
+
+        self.span_list.append((name, start_ns, end_ns, threading.get_ident()))
+
+    def add_count(self, name: str, value: float = 1):
+        """
+        Add a value to a counter
+
+        Parameters
+        ----------
+            name: `str`
+                The name of the counter
+            value: `float`
+                The value to add
+        """
+
+        with self.lock:
+            counter = self.counter_dict.setdefault(name, [0, 0])
+            counter[0] += 1
+            counter[1] += value
+
+    def get_summary(self):
+        """
+        Get the calls, the total, mean and maximum times of each function, from the longest total time
+
+        The times include the nested calls, e.g. the time of ``common_cost_function_for_optimization`` 
+        includes the generation and the standard functions.
+
+        Returns
+        -------
+            summary_list: `list`
+                The ``name``, ``calls``, ``total``, ``mean`` and ``max`` times in seconds of each function
+        """
+
+        summary_dict = {}
+        for name, start_ns, end_ns, _ in list(self.span_list):
+            summary = summary_dict.setdefault(name, {'name': name, 'calls': 0, 'total': 0.0, 'max': 0.0})
+            duration = (end_ns - start_ns) * 1e-9
+            summary['calls'] += 1
+            summary['total'] += duration
+            summary['max'] = max(summary['max'], duration)
+        for summary in summary_dict.values():
+            summary['mean'] = summary['total'] / summary['calls']
+        return sorted(summary_dict.values(), key=lambda summary: -summary['total'])
+
+    def format_summary(self):
+        """
+        Format the summary and the counters as a table
+
+        Returns
+        -------
+            table: `str`
+                The table with one row per function and per counter
+        """
+
+        end_ns = self.end_ns or time.perf_counter_ns()
+        wall = (end_ns - self.start_ns) * 1e-9
+        summary_list = self.get_summary()
+        width = max([len(summary['name']) for summary in summary_list] + [len(name) for name in self.counter_dict] + [8])
+        line_list = [f"Profile of {wall:.3f} s",
+                     f"{'function':<{width}} {'calls':>8} {'total [s]':>10} {'mean [ms]':>10} {'max [ms]':>10} {'% wall':>7}"]
+        for summary in summary_list:
+            line_list.append(f"{summary['name']:<{width}} {summary['calls']:>8} {summary['total']:>10.4f} {summary['mean'] * 1e3:>10.3f} "
+                             f"{summary['max'] * 1e3:>10.3f} {100 * summary['total'] / wall if wall > 0 else 0:>7.1f}")
+        if self.counter_dict:
+            line_list.append(f"{'counter':<{width}} {'records':>8} {'sum':>10} {'mean':>10}")
+            for name, (num, total) in sorted(self.counter_dict.items()):
+                line_list.append(f"{name:<{width}} {num:>8} {total:>10g} {total / num:>10.3g}")
+        return '\n'.join(line_list)
+
+    def export_chrome_trace(self, file_path: str):
+        """
+        Export the timed calls and counters as a Chrome trace, to open in ``chrome://tracing`` or Perfetto
+
+        Parameters
+        ----------
+            file_path: `str`
+                The JSON file path
+        """
+
+        pid = os.getpid()
+        event_list = [{'name': name, 'ph': 'X', 'ts': (start_ns - self.start_ns) / 1e3, 'dur': (end_ns - start_ns) / 1e3, 'pid': pid, 'tid': tid}
+                      for name, start_ns, end_ns, tid in list(self.span_list)]
+        event_list.sort(key=lambda event: event['ts'])
+        summary = {name: {'records': num, 'sum': total} for name, (num, total) in self.counter_dict.items()}
+        with open(file_path, 'w') as file:
+            json.dump({'traceEvents': event_list, 'displayTimeUnit': 'ms', 'otherData': {'counters': summary}}, file)
+
+
+@contextlib.contextmanager
+def profile(trace_path: str = None, print_summary: bool = False):
+    """
+    Profile the fits run in the ``with`` block
+
+    The standard functions, the generation and its iterations, the cost evaluations, the 
+    optimization and the confidence intervals are timed in all the threads of this process, 
+    but not in the worker processes of a process pool. Outside the block, each instrumented 
+    call only checks that profiling is disabled.
+
+    Parameters
+    ----------
+        trace_path: `str`
+            If given, the Chrome trace JSON file written at the end of the block
+        print_summary: `bool`
+            If True, print the summary table at the end of the block
+    Returns
+    -------
+        profiler: `Profiler`
+            The profiler with the records, e.g. for ``profiler.format_summary()``
+    """
+
+    global active_profiler
+    if active_profiler is not None:
+        raise RuntimeError("xmf.profile blocks cannot be nested.")
+
+    profiler = Profiler()
+    active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        active_profiler = None
+        profiler.end_ns = time.perf_counter_ns()
+        if trace_path is not None:
+            profiler.export_chrome_trace(trace_path)
+        if print_summary:
+            print(profiler.format_summary())
+
+
+def profiled(function):
+    """
+    Decorate a function to be timed in the ``profile`` blocks
+
+    Parameters
+    ----------
+        function: `function`
+            The function to time
+    Returns
+    -------
+        profiled_function: `function`
+            The function recording its calls when a profile is active
+    """
+
+    name = function.__name__
+
+    @functools.wraps(function)
+    def profiled_function(*args, **kwargs):
+        profiler = active_profiler
+        if profiler is None:
+            return function(*args, **kwargs)
+        start_ns = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.add_span(name, start_ns, time.perf_counter_ns())
+
+    return profiled_function
+
+
+def add_profile_count(name: str, value: float = 1):
+    """
+    Add a value to a counter of the active profile, if any
+
+    Parameters
+    ----------
+        name: `str`
+            The name of the counter
+        value: `float`
+            The value to add
+    """
+
+    profiler = active_profiler
+    if profiler is not None:
+        profiler.add_count(name, value)
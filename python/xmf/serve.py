@@ -0,0 +1,315 @@
+# Copyright (c) 2025 Racheal Xu, Lei Huang
+#
+# Lei Huang
+# huanglei0114gmail.com
+#
+# All rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import json
+import os
+import socketserver
+import stat
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from xmf.layer_04_fit import fit_model_dict, get_fit_model
+from xmf.io import load_measurement
+from xmf.parallel import SharedMemoryFitPool
+
+npz_content_type = 'application/x-npz'
+
+
+def resolve_data_path(path: str, data_root: str):
+    """
+    Resolve the path of a measurement file requested by a client within the data root
+
+    Parameters
+    ----------
+        path: `str`
+            The path relative to the data root
+        data_root: `str`
+            The directory of the measurement files served, None to refuse all paths
+    Returns
+    -------
+        path: `str`
+            The resolved path
+    """
+
+    if data_root is None:
+        raise ValueError("The service has no data root, send the x and v arrays instead of a path.")
+    root = os.path.realpath(data_root)
+    resolved_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved_path]) != root:
+        raise ValueError(f"The path {path} is outside the data root.")
+    return resolved_path
+
+
+def parse_fit_request(body: bytes, content_type: str, data_root: str = None):
+    """
+    Parse the body of a ``POST /fit`` request
+
+    A JSON body has the ``model``, the ``opt_dict`` or ``tol_dict``, optionally the 
+    ``input_params`` and the ``fit_options``, and either the ``path`` of a measurement file 
+    within ``data_root`` or the ``x``, ``y`` (2D only) and ``v`` arrays as nested lists with 
+    null for NaN. An ``application/x-npz`` body has the ``x``, ``y`` and ``v`` arrays and 
+    the other fields as a JSON string in ``request``.
+
+    Parameters
+    ----------
+        body: `bytes`
+            The request body
+        content_type: `str`
+            The content type of the body
+        data_root: `str`
+            The directory of the measurement files a ``path`` may refer to, None to refuse paths
+    Returns
+    -------
+        request: `dict`
+            The ``model``, ``x``, ``y``, ``v``, ``input_params``, ``opt_or_tol_dict`` and ``fit_options``
+    """
+
+    if content_type.startswith(npz_content_type):
+        with np.load(io.BytesIO(body)) as npz:
+            request = json.loads(str(npz['request']))
+            for name in ('x', 'y', 'v'):
+                if name in npz.files:
+                    request[name] = npz[name]
+    else:
+        request = json.loads(body)
+        for name in ('x', 'y', 'v'):
+            if request.get(name) is not None:
+                request[name] = np.array(request[name], dtype=float)
+
+    if 'model' not in request:
+        raise ValueError("The request must have a model.")
+    get_fit_model(request['model'])
+    if 'opt_dict' in request:
+        opt_or_tol_dict = request['opt_dict']
+    elif 'tol_dict' in request:
+        opt_or_tol_dict = request['tol_dict']
+    else:
+        raise ValueError("The request must have an opt_dict or a tol_dict.")
+
+    input_params_dict = request.get('input_params', {})
+    if 'path' in request:
+        measurement = load_measurement(resolve_data_path(request['path'], data_root))
+        input_params_dict = {**{name: val for name, val in measurement.params_target.items() if name in ('p', 'q', 'theta')}, **input_params_dict}
+        x, y, v = measurement.x, measurement.y, measurement.v
+    elif request.get('x') is not None and request.get('v') is not None:
+        x, y, v = request['x'], request.get('y'), request['v']
+    else:
+        raise ValueError("The request must have a path or the x and v arrays.")
+
+    return {'model': request['model'], 'x': x, 'y': y, 'v': v, 'input_params': input_params_dict,
+            'opt_or_tol_dict': opt_or_tol_dict, 'fit_options': request.get('fit_options', {})}
+
+
+def encode_fit_result(result: tuple, elapsed: float, as_npz: bool):
+    """
+    Encode the fitting result as the response body
+
+    Parameters
+    ----------
+        result: `tuple`
+            The ``v_res``, ``v_fit``, ``opt_params_dict``, ``opt_params_ci_dict`` and ``init_params_dict``
+        elapsed: `float`
+            The fitting time in seconds
+        as_npz: `bool`
+            If True, the arrays are sent in a ``.npz`` body with the other fields as a JSON string in ``response``
+    Returns
+    -------
+        body: `bytes`
+            The response body
+        content_type: `str`
+            The content type of the body
+    """
+
+    v_res, v_fit, opt_params_dict, opt_params_ci_dict, init_params_dict = result
+    fields = {'opt_params_dict': {name: float(val) for name, val in opt_params_dict.items()},
+              'opt_params_ci_dict': {name: [None if np.isnan(val) else float(val) for val in np.ravel(ci)] for name, ci in opt_params_ci_dict.items()},
+              'init_params_dict': {name: float(val) for name, val in init_params_dict.items()},
+              'status': getattr(opt_params_dict, 'status', 'converged'),
+              'rms': float(np.nanstd(v_res)),
+              'time_fit': elapsed}
+
+    if as_npz:
+        buffer = io.BytesIO()
+        np.savez(buffer, v_res=v_res, v_fit=v_fit, response=json.dumps(fields))
+        return buffer.getvalue(), npz_content_type
+
+    def to_list(array):
+        return np.where(np.isnan(array), None, array).tolist()
+    fields.update({'v_res': to_list(v_res), 'v_fit': to_list(v_fit)})
+    return json.dumps(fields).encode(), 'application/json'
+
+
+class FitRequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP handler of the fitting service
+
+    ``GET /health`` reports the state, ``GET /models`` lists the models and 
+    ``POST /fit`` fits a measurement, see ``parse_fit_request``. The response is JSON, 
+    or ``.npz`` if the request accepts ``application/x-npz``.
+    """
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def send_body(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, fields: dict):
+        self.send_body(status, json.dumps(fields).encode())
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'workers': self.server.pool.max_workers, 'pid': os.getpid()})
+        elif self.path == '/models':
+            self.send_json(200, {'models': [name[len('fit_'):] for name in fit_model_dict]})
+        else:
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/fit':
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            request = parse_fit_request(body, self.headers.get('Content-Type', 'application/json'), self.server.data_root)
+        except Exception as err:
+            self.send_json(400, {'error': f"{type(err).__name__}: {err}"})
+            return
+        try:
+            t_start = time.perf_counter()
+            result = self.server.pool.submit(request['model'], request['x'], request['y'], request['v'],
+                                             request['input_params'], request['opt_or_tol_dict'],
+                                             release_xy=True, **request['fit_options']).result()
+            body, content_type = encode_fit_result(result, time.perf_counter() - t_start,
+                                                   npz_content_type in self.headers.get('Accept', ''))
+        except Exception as err:
+            self.send_json(500, {'error': f"{type(err).__name__}: {err}"})
+            return
+        self.send_body(200, body, content_type)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    """
+    The threading HTTP server on a Unix socket
+    """
+
+    daemon_threads = True
+
+
+def remove_unix_socket(unix_socket: str):
+    """
+    Remove a stale Unix socket, refusing to remove any other kind of file
+
+    Parameters
+    ----------
+        unix_socket: `str`
+            The Unix socket path
+    """
+
+    if not os.path.lexists(unix_socket):
+        return
+    if not stat.S_ISSOCK(os.lstat(unix_socket).st_mode):
+        raise FileExistsError(f"{unix_socket} exists and is not a Unix socket.")
+    os.remove(unix_socket)
+
+
+def create_fit_server(host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None, max_workers: int = None,
+                      data_root: str = None):
+    """
+    Create the local fitting service with a pool of warm worker processes
+
+    Parameters
+    ----------
+        host: `str`
+            The host address, localhost by default
+        port: `int`
+            The TCP port. If 0, a free port is chosen.
+        unix_socket: `str`
+            The Unix socket path. If given, it is used instead of the TCP port.
+        max_workers: `int`
+            The number of worker processes
+        data_root: `str`
+            The directory of the measurement files the clients may request by ``path``, 
+            None to accept only the arrays
+    Returns
+    -------
+        server: `socketserver.BaseServer`
+            The server with the pool of workers in ``server.pool``
+    """
+
+    if unix_socket is not None:
+        remove_unix_socket(unix_socket)
+    pool = SharedMemoryFitPool(max_workers, warm_up=True)
+    try:
+        if unix_socket is not None:
+            server = ThreadingUnixHTTPServer(unix_socket, FitRequestHandler)
+        else:
+            server = ThreadingHTTPServer((host, port), FitRequestHandler)
+    except BaseException:
+        pool.close()
+        raise
+    server.pool = pool
+    server.data_root = data_root
+    return server
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None, max_workers: int = None,
+          data_root: str = None):
+    """
+    Run the local fitting service until interrupted
+
+    Parameters
+    ----------
+        host: `str`
+            The host address, localhost by default
+        port: `int`
+            The TCP port
+        unix_socket: `str`
+            The Unix socket path. If given, it is used instead of the TCP port.
+        max_workers: `int`
+            The number of worker processes
+        data_root: `str`
+            The directory of the measurement files the clients may request by ``path``
+    """
+
+    server = create_fit_server(host, port, unix_socket, max_workers, data_root)
+    address = unix_socket or f"http://{host}:{server.server_address[1]}"
+    print(f"xmf fitting service with {server.pool.max_workers} workers on {address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.close()
+        if unix_socket is not None:
+            remove_unix_socket(unix_socket)